@@ -0,0 +1,3 @@
+__version__ = "0.3.2"
+
+from .lcpcli import Lcpcli  # noqa: F401
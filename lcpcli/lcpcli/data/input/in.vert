@@ -0,0 +1,46 @@
+<corpus>
+<text id="in">
+<s sent_id="isst_tanl-19">
+Corriere	Corriere	PROPN
+Sport	Sport	PROPN
+da	da	ADP
+pagina	pagina	NOUN
+23	23	NUM
+a	a	ADP
+pagina	pagina	NOUN
+26	26	NUM
+</s>
+<s sent_id="isst_tanl-58">
+I	il	DET
+tre	tre	NUM
+avevano	avere	AUX
+da	da	ADP
+poco	poco	ADV
+lasciato	lasciare	VERB
+la	il	DET
+cima	cima	NOUN
+e	e	CCONJ
+stavano	stare	AUX
+cominciando	cominciare	VERB
+la	il	DET
+discesa	discesa	NOUN
+.	.	PUNCT
+</s>
+<s sent_id="isst_tanl-124">
+Tutti	tutto	DET
+gli	il	DET
+esseri	essere	NOUN
+umani	umano	ADJ
+sanno	sapere	VERB
+di	di	ADP
+poter	potere	AUX
+essere	essere	AUX
+più	più	ADV
+di	di	ADP
+ciò	ciò	PRON
+che	che	PRON
+sono	essere	VERB
+.	.	PUNCT
+</s>
+</text>
+</corpus>
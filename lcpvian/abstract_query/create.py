@@ -1,7 +1,22 @@
+import json
+
 from typing import Any, cast
 
 import sqlparse  # type: ignore
 
+from redis import Redis as RedisConnection
+
+from .plan_cache import (
+    BATCH_SENTINEL,
+    PLAN_CACHE,
+    SQL_PLAN_TEMPLATES,
+    config_version,
+    dump_plan,
+    fill_template,
+    load_plan,
+    plan_key,
+    split_batch,
+)
 from .query import QueryMaker
 from .results import ResultsMaker
 from .typed import QueryJSON
@@ -32,11 +47,86 @@ def json_to_sql(
     batch: str = "token_rest",
     config: QueryJSON = {},
     lang: str | None = None,
+    connection: RedisConnection | None = None,
+    row_budget: int | None = None,
 ) -> tuple[str, QueryJSON, dict[int, Any]]:
     """
     The only public thing exposed by this module.
 
-    It requires a query in JSON format plus configuration stuff
+    It requires a query in JSON format plus configuration stuff.
+    Plans are cached by query, batch, language and config version (in redis too
+    if a connection is passed). When several batches share a stem (token1, token2...)
+    a template is compiled once and only the batch suffix is substituted,
+    provided the template reproduces a plan compiled the regular way.
+
+    If row_budget is set, each plain result set returns at most that many lines.
+    The lines of plain result sets are ordered by segment and tokens either way
+    """
+    # sorted, so that the same query with its keys in another order shares plans
+    query_str = json.dumps(query_json, separators=(",", ":"), sort_keys=True)
+    version = config_version(cast(dict, config))
+    key = plan_key(query_str, schema, batch, lang, version, row_budget)
+    cached = PLAN_CACHE.get(key, connection)
+    if cached is not None:
+        return load_plan(cached)
+
+    plan: str | None = None
+    split = split_batch(batch) if SQL_PLAN_TEMPLATES else None
+    if split:
+        stem, suffix = split
+        family_key = plan_key(
+            query_str, schema, stem, lang, version, row_budget, "template"
+        )
+        family: dict = json.loads(PLAN_CACHE.get(family_key, connection) or "{}")
+        if family.get("template"):
+            plan = fill_template(family["template"], suffix)
+        elif family.get("batch", batch) != batch:
+            # second batch of the family: compile a template and check it against
+            # a plan compiled the regular way before using it for the other batches
+            ref_batch: str = family["batch"]
+            ref_key = plan_key(query_str, schema, ref_batch, lang, version, row_budget)
+            ref_plan = PLAN_CACHE.get(ref_key, connection)
+            if ref_plan is None:
+                ref_batch = batch
+                ref_plan = dump_plan(
+                    *_compile(query_json, schema, batch, config, lang, row_budget)
+                )
+            template = dump_plan(
+                *_compile(
+                    json.loads(query_str),
+                    schema,
+                    stem + BATCH_SENTINEL,
+                    config,
+                    lang,
+                    row_budget,
+                )
+            )
+            ref_suffix = ref_batch[len(stem) :]
+            valid = fill_template(template, ref_suffix) == ref_plan
+            plan = fill_template(template, suffix) if valid else None
+            if ref_batch == batch:
+                plan = ref_plan
+            family = {"template": template if valid else None}
+            PLAN_CACHE.set(family_key, json.dumps(family), connection)
+        elif not family:
+            PLAN_CACHE.set(family_key, json.dumps({"batch": batch}), connection)
+
+    if plan is None:
+        plan = dump_plan(*_compile(query_json, schema, batch, config, lang, row_budget))
+    PLAN_CACHE.set(key, plan, connection)
+    return load_plan(plan)
+
+
+def _compile(
+    query_json: QueryJSON,
+    schema: str,
+    batch: str,
+    config: QueryJSON,
+    lang: str | None,
+    row_budget: int | None = None,
+) -> tuple[str, QueryJSON, dict[int, Any]]:
+    """
+    Build the SQL query for one batch
     """
     all_labels = _get_all_labels(query_json)
     all_refs = {
@@ -45,7 +135,9 @@ def json_to_sql(
     }
     language: str | None = lang.lower() if lang else None
     conf: Config = Config(schema, batch, config, language)
-    query_json, result_data = ResultsMaker(query_json, conf, all_refs).results()
+    query_json, result_data = ResultsMaker(
+        query_json, conf, all_refs, row_budget
+    ).results()
     query_part: str
     seg_label: str
     query_part, seg_label, has_char_range = QueryMaker(
@@ -0,0 +1,150 @@
+"""
+plan_cache.py: bounded cache of the SQL compiled by json_to_sql
+
+Compiled plans are kept in a per-process LRU and, when a redis connection
+is provided, in redis so that the app and the workers share them.
+
+Plans are serialized as JSON, tagging the tuples and the dicts with non-string
+keys so that a cached plan loads with the same types as a freshly compiled one.
+"""
+
+import json
+import os
+import re
+
+from collections import OrderedDict
+from hashlib import md5
+from redis import Redis as RedisConnection
+from typing import Any
+
+SQL_PLAN_CACHE_SIZE = int(os.getenv("SQL_PLAN_CACHE_SIZE", 256))
+SQL_PLAN_CACHE_TTL = int(os.getenv("SQL_PLAN_CACHE_TTL", 86400))
+SQL_PLAN_TEMPLATES = os.getenv("SQL_PLAN_TEMPLATES", "true").lower() in (
+    "true",
+    "1",
+    "yes",
+)
+
+# Stands in for the batch suffix (digits or 'rest') when compiling a template
+BATCH_SENTINEL = "90817263541"
+BATCH_SUFFIX = re.compile(r"(.+?)(\d+|rest)$")
+# Part of the plan keys: bump it when the serialization of the plans changes
+PLAN_FORMAT = 2
+
+
+class PlanCache:
+    """
+    LRU of serialized plans, backed by redis if a connection is passed
+    """
+
+    def __init__(self, maxsize: int = SQL_PLAN_CACHE_SIZE, prefix: str = "sql_plan"):
+        self.maxsize = maxsize
+        self.prefix = prefix
+        self._plans: OrderedDict[str, str] = OrderedDict()
+
+    def get(self, key: str, connection: RedisConnection | None = None) -> str | None:
+        if key in self._plans:
+            self._plans.move_to_end(key)
+            return self._plans[key]
+        if connection is None:
+            return None
+        try:
+            raw = connection.get(f"{self.prefix}::{key}")
+        except Exception:
+            return None
+        if raw is None:
+            return None
+        value = raw.decode("utf-8") if isinstance(raw, bytes) else str(raw)
+        self._remember(key, value)
+        return value
+
+    def set(self, key: str, value: str, connection: RedisConnection | None = None):
+        self._remember(key, value)
+        if connection is None:
+            return
+        try:
+            connection.set(f"{self.prefix}::{key}", value, ex=SQL_PLAN_CACHE_TTL)
+        except Exception as err:
+            print(f"Could not store the SQL plan in redis: {err}")
+
+    def clear(self):
+        self._plans.clear()
+
+    def _remember(self, key: str, value: str):
+        self._plans[key] = value
+        self._plans.move_to_end(key)
+        while len(self._plans) > self.maxsize:
+            self._plans.popitem(last=False)
+
+
+PLAN_CACHE = PlanCache()
+
+
+def config_version(config: dict[str, Any]) -> str:
+    """
+    Fingerprint of a corpus config, so that plans are recompiled when it changes
+    """
+    relevant = {k: v for k, v in config.items() if k != "doc_ids"}
+    dumped = json.dumps(relevant, sort_keys=True, default=str)
+    return md5(dumped.encode("utf-8")).digest().hex()
+
+
+def plan_key(*parts: Any) -> str:
+    dumped = json.dumps(
+        [PLAN_FORMAT, *parts], separators=(",", ":"), sort_keys=True, default=str
+    )
+    return md5(dumped.encode("utf-8")).digest().hex()
+
+
+def split_batch(batch: str) -> tuple[str, str] | None:
+    """
+    Split a batch name into its stem and suffix (token12 -> token, 12)
+    """
+    match = BATCH_SUFFIX.match(batch)
+    if not match:
+        return None
+    return match.group(1), match.group(2)
+
+
+def _pack(value: Any) -> Any:
+    """
+    JSON-ready copy of value where tuples and dicts with non-string keys are tagged
+    """
+    if isinstance(value, tuple):
+        return {"__tuple__": [_pack(v) for v in value]}
+    if isinstance(value, list):
+        return [_pack(v) for v in value]
+    if isinstance(value, dict):
+        if all(isinstance(k, str) for k in value) and not _is_tagged(value):
+            return {k: _pack(v) for k, v in value.items()}
+        return {"__items__": [[_pack(k), _pack(v)] for k, v in value.items()]}
+    return value
+
+
+def _is_tagged(value: dict) -> bool:
+    return len(value) == 1 and ("__tuple__" in value or "__items__" in value)
+
+
+def _unpack(value: Any) -> Any:
+    if isinstance(value, list):
+        return [_unpack(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    if _is_tagged(value) and "__tuple__" in value:
+        return tuple(_unpack(v) for v in value["__tuple__"])
+    if _is_tagged(value):
+        return {_unpack(k): _unpack(v) for k, v in value["__items__"]}
+    return {k: _unpack(v) for k, v in value.items()}
+
+
+def dump_plan(script: str, meta_json: Any, post_processes: dict[int, Any]) -> str:
+    return json.dumps([script, _pack(meta_json), _pack(post_processes)])
+
+
+def load_plan(plan: str) -> tuple[str, Any, dict[int, Any]]:
+    script, meta_json, post_processes = json.loads(plan)
+    return script, _unpack(meta_json), _unpack(post_processes)
+
+
+def fill_template(template: str, suffix: str) -> str:
+    return template.replace(BATCH_SENTINEL, suffix)
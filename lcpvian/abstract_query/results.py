@@ -54,9 +54,15 @@ class ResultsMaker:
     """
 
     def __init__(
-        self, query_json: QueryJSON, conf: Config, all_refs: dict[str, list[str]]
+        self,
+        query_json: QueryJSON,
+        conf: Config,
+        all_refs: dict[str, list[str]],
+        row_budget: int | None = None,
     ) -> None:
         self.conf: Config = conf
+        # max number of lines in each plain result set (None or 0 = no limit)
+        self.row_budget: int | None = row_budget
         self.config: ConfigJSON = conf.config
         self.schema: str = conf.schema
         self.lang: str = conf.lang or ""
@@ -300,6 +306,9 @@ class ResultsMaker:
             elif kind == "resultsCollocation":
                 self._add_collocation_selects(r)
                 made, meta = self.collocation(i, varname, r)
+            if kind != "resultsPlain" and r.get("approximate"):
+                # only keep the top n rows (see stats_store.StatsStore)
+                meta["approximate"] = {"top": int(cast(int, r["approximate"]))}
 
             strings.append(made)
             attribs.append(meta)
@@ -489,6 +498,7 @@ class ResultsMaker:
 
         lay: str
         tokens: list[dict] = []
+        token_ids: list[str] = []
 
         include_disjunction: bool = False
         if "*" in ents:
@@ -578,6 +588,7 @@ class ResultsMaker:
                 select = sql_str(f"{ent_ref} AS {LR}", ent_ref.alias)
                 self.r.selects.add(select)
                 self.r.entities.add(ent_ref.alias)
+                token_ids.append(ent_ref.alias)
 
         for e in ents:
             entities_list, attributes = self._process_entity(e)
@@ -623,6 +634,7 @@ WHERE {ent_stream_ref} && {cont_tok_stream_ref}
         ents_form: str = ", ".join(quoted_entouts)
         doc_join = ""
         extras: list[str] = []
+        extra_columns: list[str] = []
         ranges: list[dict[str, Any]] = []
 
         for anchor in ("time", "stream"):
@@ -637,6 +649,7 @@ WHERE {ent_stream_ref} && {cont_tok_stream_ref}
                 )
                 self.r.selects.add(sql_str("{}", out_ref.alias))
                 extras.append(fr)
+                extra_columns.append(sql_str("{}", out_ref.alias))
                 ranges.append(
                     {
                         "name": out_ref.alias,
@@ -682,13 +695,33 @@ WHERE {ent_stream_ref} && {cont_tok_stream_ref}
             self.r.entities.add(ft_seg_ref.alias)
             context_ref = sql_str("{}", ft_seg_ref.alias)
 
+        # the lines are deduplicated, ordered and limited on the columns they are
+        # built from, so that only the lines kept are built. They are ordered by
+        # segment and first token whether or not there is a budget, so that a batch
+        # re-run (with a larger budget or none) starts with the same lines
+        first_token = next((x for x in entout if x in token_ids), None)
+        order_by: list[str] = [context_ref]
+        if first_token:
+            order_by.append(sql_str("{}", first_token))
+        order_by += quoted_entouts
+        if include_disjunction:
+            order_by.append(sql_str("{}", "disjunction_matches"))
+        order_by = list(dict.fromkeys(order_by))
+        columns = ", ".join(dict.fromkeys(order_by + extra_columns))
+        order = ", ".join(order_by)
+        limit = f"LIMIT {int(self.row_budget)}" if self.row_budget else ""
         out = f"""
-            res{i} AS ( SELECT DISTINCT
+            res{i} AS ( SELECT
             {i}::int2 AS rstype,
             jsonb_build_array({context_ref}, jsonb_build_array({ents_form}) {select_extra})
-        FROM
-            match_list
+        FROM (
+            SELECT DISTINCT {columns}
+            FROM match_list
             {doc_join}
+            ORDER BY {order}
+            {limit}
+        ) match_list
+        ORDER BY {order}
         )
         """
         metadata: ResultMetadata = {
@@ -69,7 +69,9 @@ class RefInfo(TypedDict, total=False):
 # model corpus config data
 ConfigJSON: TypeAlias = JSONObject
 # model the result metadata returned alongside a query
-ResultMetadata: TypeAlias = dict[str, str | Attribs | bool | list[JSONObject]]
+ResultMetadata: TypeAlias = dict[
+    str, str | Attribs | bool | list[JSONObject] | JSONObject
+]
 
 # Joins are stored as dict keys, with None as values. If the value is True,
 # the join will be put at the end of the list of joins (for performance reasons)
@@ -2,14 +2,24 @@
 api.py: API access to LCP
 """
 
-import asyncio
 import json
 
+from contextlib import aclosing
+from uuid import uuid4
+
 from aiohttp import web
 from typing import cast, Any
 
 from .query import process_query
-from .utils import LCPApplication
+from .query_classes import (
+    QueryInfo,
+    Request,
+    close_request_stream,
+    open_request_stream,
+    stream_request,
+    wait_for_request,
+)
+from .utils import CustomEncoder, LCPApplication
 from .validate import validate
 
 
@@ -39,7 +49,13 @@ async def get_corpus(request: web.Request) -> web.Response:
     return web.json_response(request.app["config"].get(cid, {}))
 
 
-async def search(request: web.Request) -> web.Response:
+async def _start_search(
+    request: web.Request, request_id: str = ""
+) -> tuple[Request, QueryInfo] | web.Response:
+    """
+    Check and validate a search request and start the corresponding query,
+    under request_id if given
+    """
     authenticator = request.app["auth_class"](request.app)
     user_data = await _get_user(request, authenticator)
     cid: str = request.match_info["corpus_id"]
@@ -77,17 +93,71 @@ async def search(request: web.Request) -> web.Response:
     }
     if "to_export" in request_data:
         data_to_process["to_export"] = request_data["to_export"]
+    if "cursor" in request_data:
+        data_to_process["cursor"] = request_data["cursor"]
+    if request_id:
+        data_to_process["id"] = request_id
     req, qi, job = process_query(cast(LCPApplication, request.app), data_to_process)
 
     # No job means no query is being run: delete the request
     if job is None and qi.has_request(req):
         qi.delete_request(req)
 
-    while 1:
-        await asyncio.sleep(0.5)
-        if not qi.has_request(req):
-            break
+    return req, qi
 
-    payload = request.app["query_buffers"].pop(req.id, {})
+
+async def search(request: web.Request) -> web.Response:
+    started = await _start_search(request)
+    if isinstance(started, web.Response):
+        return started
+    req, qi = started
+
+    try:
+        await wait_for_request(qi, req)
+    finally:
+        payload = request.app["query_buffers"].pop(req.id, {})
 
     return web.json_response(payload)
+
+
+async def search_stream(request: web.Request) -> web.StreamResponse:
+    """
+    Same as search, but write each query_result/segments payload as soon as it is
+    produced, as a line of NDJSON, or as a Server-Sent Event if the client accepts
+    text/event-stream
+    """
+    request_id = f"request::{uuid4()}"
+    # the payloads of a cached query are sent as soon as it is processed: the
+    # stream must be registered before, or they would be dropped
+    open_request_stream(request_id)
+    try:
+        started = await _start_search(request, request_id)
+        if isinstance(started, web.Response):
+            return started
+        req, qi = started
+        # payloads are streamed, not buffered
+        request.app["query_buffers"].pop(req.id, None)
+
+        sse = "text/event-stream" in request.headers.get("Accept", "")
+        response = web.StreamResponse(
+            headers={
+                "Content-Type": "text/event-stream" if sse else "application/x-ndjson",
+                "Cache-Control": "no-cache",
+            }
+        )
+        await response.prepare(request)
+        # a disconnection interrupts the loop: closing the stream right away stops
+        # the request
+        async with aclosing(stream_request(qi, req)) as payloads:
+            async for payload in payloads:
+                line = json.dumps(payload, cls=CustomEncoder)
+                if sse:
+                    action = payload.get("action") or "message"
+                    line = f"event: {action}\ndata: {line}\n"
+                # write waits for the transport to drain: a client that falls too
+                # far behind gets a failure (see Request.send_sync)
+                await response.write(f"{line}\n".encode("utf-8"))
+        await response.write_eof()
+        return response
+    finally:
+        close_request_stream(request_id)
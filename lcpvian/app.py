@@ -12,7 +12,7 @@ import aiohttp_cors
 import asyncio
 import uvloop
 
-from collections import defaultdict, deque
+from collections import deque
 from typing import cast, Type
 
 from aiohttp import WSCloseCode, web
@@ -43,7 +43,7 @@ from .utils import (
 
 load_env()
 
-from .api import list_corprora, get_corpus, search
+from .api import list_corprora, get_corpus, search, search_stream
 from .check_file_permissions import check_file_permissions
 from .corpora import (
     corpora,
@@ -74,7 +74,7 @@ from .project import project_users_invite, project_users
 from .project import project_users_invitation_remove, project_user_update
 from .query import post_query
 from .query_service import QueryService
-from .sock import listen_to_redis, sock, ws_cleanup
+from .sock import listen_to_redis, log_encoding_stats, sock, ws_cleanup
 from .store import fetch_queries, store_query, delete_query
 from .swissubase import swissubase_check_api, swissubase_submit
 from .typed import Config, Endpoint, Task, Websockets
@@ -86,6 +86,7 @@ from .upload import (
     upload_info,
 )
 from .lama import handle_lama_error
+from .validate import QueryValidator
 from .video import video
 
 # this is all just a way to find out if utils (and therefore the codebase) is a c extension
@@ -145,6 +146,7 @@ async def on_shutdown(app: web.Application) -> None:
         app["redis"].quit()
     except Exception:
         pass
+    app["validator"].shutdown()
     msg = "Server shutdown"
     for room, conns in app["websockets"].items():
         for ws, uid in conns:
@@ -158,6 +160,7 @@ async def start_background_tasks(app: web.Application) -> None:
     """
     Start the thread that listens to redis pubsub
     Start the thread that periodically removes stale websocket connections
+    Start the thread that periodically logs the websocket encoding stats
     """
     lapp = cast(LCPApplication, app)
     for instance in ("redis", "shared_redis"):
@@ -166,16 +169,19 @@ async def start_background_tasks(app: web.Application) -> None:
         listener = f"{instance}_listener"
         lapp.addkey(listener, Task, asyncio.create_task(listen_to_redis(app, instance)))
     lapp.addkey("ws_cleanup", Task, asyncio.create_task(ws_cleanup(app["websockets"])))
+    lapp.addkey("ws_stats", Task, asyncio.create_task(log_encoding_stats()))
 
 
 async def cleanup_background_tasks(app: web.Application) -> None:
     """
-    Stop running background tasks: redis listener, stale ws cleaner
+    Stop running background tasks: redis listener, stale ws cleaner, ws stats
     """
     app["redis_listener"].cancel()
     await app["redis_listener"]
     app["ws_cleanup"].cancel()
     await app["ws_cleanup"]
+    app["ws_stats"].cancel()
+    await app["ws_stats"]
 
 
 async def create_app(test: bool = False) -> web.Application:
@@ -245,10 +251,11 @@ async def create_app(test: bool = False) -> web.Application:
         },
     )
 
-    # all websocket connections are stored in here, as {room: {(connection, user_id,)}}
+    # all websocket connections are stored in here, as {room: {(connection, user_id,)}},
+    # indexed by (room, user) for routing messages (see typed.Websockets)
     # when a user leaves the app, the connection should be removed. If it's not,
     # the dict is periodically cleaned by a separate thread, to stop this from always growing
-    ws: Websockets = defaultdict(set)
+    ws: Websockets = Websockets()
     app.addkey("websockets", Websockets, ws)
     app.addkey("_debug", bool, DEBUG)
     app.addkey("auth_class", Type, AUTH_CLASS)
@@ -261,6 +268,7 @@ async def create_app(test: bool = False) -> web.Application:
         ("/api/corpora", "GET", list_corprora),
         ("/api/corpora/{corpus_id}", "GET", get_corpus),
         ("/api/corpora/{corpus_id}/search", "POST", search),
+        ("/api/corpora/{corpus_id}/search/stream", "POST", search_stream),
         ("/check-file-permissions", "GET", check_file_permissions),
         ("/config", "POST", refresh_config),
         ("/corpora", "POST", corpora),
@@ -396,6 +404,7 @@ async def create_app(test: bool = False) -> web.Application:
     if not test:
         await qs.get_config()
     app.addkey("canceled", deque[str], deque(maxlen=99999))
+    app.addkey("validator", QueryValidator, QueryValidator())
 
     if test:
         return app
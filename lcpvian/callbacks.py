@@ -43,6 +43,7 @@ from .typed import (
 )
 from .utils import (
     Interrupted,
+    _job_stopped,
     _row_to_value,
     _publish_msg,
     _sharepublish_msg,
@@ -599,8 +600,12 @@ def _general_failure(
         print(f"cannot format object: {trace} / {err}")
 
     print("Failure of some kind:", job, trace, typ, value)
-    if isinstance(typ, Interrupted) or typ == Interrupted:
-        # no need to send a message to the user for interrupts
+    if (
+        isinstance(typ, Interrupted)
+        or typ == Interrupted
+        or _job_stopped(connection, job)
+    ):
+        # no need to send a message to the user for interrupts or stopped jobs
         # jso = {"status": "interrupted", "action": "interrupted", "job": job.id}
         return None
     else:
@@ -0,0 +1,89 @@
+"""
+char_ranges.py: vectorised overlap tests between char ranges
+
+The lines of the segment queries carry the char range of their segment (or of
+their meta) as a "[lower,upper)" string. They are parsed once, when the query
+results are cached, into an (n, 2) int64 array stored next to them, and matched
+against the char ranges of the hits of each request with searchsorted.
+"""
+
+import re
+
+import numpy as np
+
+from io import BytesIO
+from typing import Any, Iterable
+
+CHAR_RANGE = re.compile(r"\[(\d+),(\d+)\)")
+
+
+def parse_char_range(content: Any) -> tuple[int, int] | None:
+    """
+    The char range at the end of a line of the segment query, if any
+    """
+    cr: Any = content[-1] if content else None
+    if isinstance(cr, dict):
+        cr = cr.get("char_range", "")
+    if not isinstance(cr, str):
+        return None
+    match = CHAR_RANGE.match(cr)
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def line_ranges(lines: list) -> np.ndarray:
+    """
+    The char ranges of the lines as an (n, 2) array, with [0, 0) for the lines
+    without a char range (an empty range overlaps nothing)
+    """
+    ranges = np.zeros((len(lines), 2), dtype=np.int64)
+    for n, (_, content) in enumerate(lines):
+        cr = parse_char_range(content)
+        if cr is not None:
+            ranges[n] = cr
+    return ranges
+
+
+def ranges_to_bytes(ranges: np.ndarray) -> bytes:
+    out = BytesIO()
+    np.save(out, ranges, allow_pickle=False)
+    return out.getvalue()
+
+
+def ranges_from_bytes(raw: bytes) -> np.ndarray:
+    return np.load(BytesIO(raw), allow_pickle=False)
+
+
+class RangeMatcher:
+    """
+    Union of char ranges, merged into sorted disjoint intervals
+    """
+
+    def __init__(self, ranges: Iterable[list[int] | tuple[int, int]]):
+        arr = np.array([(r[0], r[1]) for r in ranges], dtype=np.int64).reshape(-1, 2)
+        arr = arr[arr[:, 0] < arr[:, 1]]
+        arr = arr[np.argsort(arr[:, 0], kind="stable")]
+        if not len(arr):
+            self.starts = self.ends = np.zeros(0, dtype=np.int64)
+            return
+        # A range starts a new interval unless it overlaps or touches the previous ones
+        reach = np.maximum.accumulate(arr[:, 1])
+        new = np.empty(len(arr), dtype=np.bool_)
+        new[0] = True
+        new[1:] = arr[1:, 0] > reach[:-1]
+        firsts = np.flatnonzero(new)
+        self.starts = arr[firsts, 0]
+        self.ends = np.maximum.reduceat(arr[:, 1], firsts)
+
+    def overlaps(self, ranges: np.ndarray) -> np.ndarray:
+        """
+        Whether each [lower, upper) range of the (n, 2) array overlaps the union
+        """
+        lower, upper = ranges[:, 0], ranges[:, 1]
+        # The last interval starting before the end of each range
+        last = np.searchsorted(self.starts, upper, side="left") - 1
+        found = last >= 0
+        ends = np.zeros(len(ranges), dtype=np.int64)
+        ends[found] = self.ends[last[found]]
+        return found & (ends > lower) & (upper > lower)
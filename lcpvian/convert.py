@@ -6,8 +6,8 @@ object, which holds kwic, collocation and frequency results, plus query
 metadata and prepared_segment objects.
 
 If a query has res1=kwic, res2=collocation, res3=freq, two objects would
-be created. First, the non-kwic data would be made by _aggregate_results
-via callbacks._query:
+be created. First, the non-kwic data would be summed over the batches by
+StatsStore (see stats_store.py, which uses _frequency_totals) and read as:
 
 {0: query_metadata, 2: collocation_data, 3: freq_data}
 
@@ -29,6 +29,10 @@ the kwic line from matching token ids plus the relevant prepared_segment.
 """
 
 import operator
+import os
+
+import numpy as np
+import pandas as pd
 
 from collections import defaultdict
 from collections.abc import Sequence
@@ -38,15 +42,13 @@ from redis import Redis as RedisConnection
 from rq.job import Job
 
 from .typed import (
-    Batch,
     QueryMeta,
     RawSent,
     ResultSents,
-    ResultsValue,
     Results,
     Sentence,
 )
-from .utils import _get_associated_query_job
+from .utils import TRUES, _get_associated_query_job
 
 OPS = {
     "<": operator.lt,
@@ -59,64 +61,11 @@ OPS = {
     ">=": operator.ge,
 }
 
-
-def _prepare_existing(
-    res: Results, kwics: set[int], colls: set[int], result_set: list
-) -> dict[int, dict[str, tuple[int, float]]]:
-    out: dict[int, Any] = {}
-    for k, v in res.items():
-        k = int(k)
-        if k < 1 or k in kwics:
-            continue
-        if k not in out:
-            out[k] = {}
-        v = cast(list, v)
-        if k in colls:
-            for text, total, e in v:
-                if text not in out[k]:
-                    out[k][text] = (total, e)
-                else:
-                    print("Todo: if this happens, we need to combine scores")
-                    pretotal, pree = out[k][text]
-                    out[k][text] = (total + pretotal, (e + pree / 2))
-        else:
-            total_info = result_set[k - 1].get("total", [])
-            attrs = result_set[k - 1].get("attributes", [])
-            for r in v:
-                attrs_to_pass = attrs
-                if r[0] in (True, "True"):
-                    attrs_to_pass = total_info
-                body, totals_this_batch = _body_totals(r, attrs_to_pass)
-                # body = r[:-1]
-                tk = tuple(body)
-                if tk not in out[k]:
-                    out[k][tk] = [0 for _ in totals_this_batch]
-                out[k][tk] = [
-                    out[k][tk][n] + totals_this_batch[n]  # type: ignore
-                    for n, _ in enumerate(totals_this_batch)
-                ]
-    return out
-
-
-def _unfold(exist: dict, kwics: set[int], colls: set[int]) -> Results:
-    out: Results = {}
-    for k, v in exist.items():
-        k = int(k)
-        if k < 1:
-            continue
-        if k in kwics:
-            continue
-        if k not in out:
-            out[k] = []
-        if k in colls:
-            for text, (a, b) in v.items():
-                ok = cast(list, out[k])
-                ok.append([text, a, b])
-        else:
-            for body, scores in v.items():
-                ok = cast(list, out[k])
-                ok.append(list(body) + scores)
-    return out
+# Use pandas/numpy for the frequency tables and the filters (the row by row
+# implementations remain as fallbacks for the rows that pandas cannot handle)
+VECTORISED_STATS = os.getenv("VECTORISED_STATS", "true").strip().lower() in TRUES
+# Below this number of rows, the row by row implementations are faster
+VECTORISED_MIN_ROWS = int(os.getenv("VECTORISED_MIN_ROWS", 1000))
 
 
 def _body_totals(rest: list, attrs: list[dict]) -> tuple[list, list[int]]:
@@ -134,97 +83,85 @@ def _body_totals(rest: list, attrs: list[dict]) -> tuple[list, list[int]]:
     return body, totals_this_batch
 
 
-def _aggregate_results(
-    result: list,
-    existing: Results,
-    meta_json: QueryMeta,
-    post_processes: dict[int, Any],
-    current: Any,
-    done: list[Batch] | None = None,
-) -> tuple[Results, Results, int, bool, bool]:
+def _frequency_totals(
+    rows: list, result_set: dict, totals: dict[tuple, list] | None = None
+) -> dict[tuple, list]:
     """
-    Combine non-kwic results for storing and for sending to frontend
+    Sum the aggregate columns of the rows of a frequency result set by body
+    (in order of first appearance), adding them to the totals if provided
     """
-    results_to_send: Results = {0: meta_json}
-    n_results = 0
-    rs = meta_json["result_sets"]
-    kwics = set([i for i, r in enumerate(rs, start=1) if r.get("type") == "plain"])
-    freqs = set([i for i, r in enumerate(rs, start=1) if r.get("type") == "analysis"])
-    colls = set(
-        [i for i, r in enumerate(rs, start=1) if r.get("type") == "collocation"]
-    )
-    counts: defaultdict[int, int | list[int]] = defaultdict(int)
-
-    minus_one: ResultsValue = existing.get(-1, cast(ResultsValue, {}))
-    zero: ResultsValue = existing.get(0, cast(ResultsValue, {}))
-
-    precalcs: dict = _prepare_existing(existing, kwics, colls, rs)
-
-    for line in result:
-        key = int(line[0])
-        rest: list[Any] = line[1]
-        if not key and not n_results:
-            n_results = rest[0]
-            continue
-        if key in kwics:
-            counts[key] += 1  # type: ignore
-            continue
-        if key not in existing:
-            existing[key] = []
-        if key not in precalcs:
-            precalcs[key] = {}
-        if key in colls:
-            text, total_this_batch, e = rest
-            preexist, preexist_e = precalcs[key].get(text, (0, 0))
-            combined = preexist + total_this_batch
-            counts[key] = combined
-            combined_e = _combine_e(e, preexist_e, current, done)
-            precalcs[key][text] = (combined, combined_e)
-            continue
-        # frequency table:
-        attrs: list[dict] = cast(dict, rs[key - 1]).get("attributes", [])
-        if rest[0] in (True, "True"):
-            attrs = cast(dict, rs[key - 1]).get("total", [])
-        body, totals_this_batch = _body_totals(rest, attrs)
-        # need_update = body in precalcs[key]
-        preexist = precalcs[key].get(
-            tuple(body), [0 for n, _ in enumerate(totals_this_batch)]
+    out: dict[tuple, list] = totals if totals is not None else {}
+    grouped: Any = None
+    if VECTORISED_STATS and len(rows) >= VECTORISED_MIN_ROWS:
+        grouped = _group_frequencies(rows, result_set)
+    if grouped is None:
+        attrs = result_set.get("attributes", [])
+        total_info = result_set.get("total", [])
+        grouped = (
+            _body_totals(r, total_info if r[0] in (True, "True") else attrs)
+            for r in rows
         )
-        combined = [
+    for body, totals_this_batch in grouped:
+        tk = tuple(body)
+        preexist = out.get(tk)
+        if preexist is None:
+            out[tk] = [0 + t for t in totals_this_batch]
+            continue
+        out[tk] = [
             preexist[n] + totals_this_batch[n] for n, _ in enumerate(totals_this_batch)
         ]
-        precalcs[key][tuple(body)] = combined
-        counts[key] = combined
-
-    existing = _unfold(precalcs, kwics, colls)
-    existing[-1] = minus_one
-    existing[0] = zero
-
-    results_to_send = _apply_filters(existing, post_processes)
-
-    show_total = bool(kwics) or (not kwics and len(freqs) == 1)
-
-    return existing, results_to_send, n_results, not bool(kwics), show_total
+    return out
 
 
-def _combine_e(
-    this_time_e: int | float,
-    e_so_far: int | float,
-    current: Batch | None,
-    done: list[Batch] | None,
-):
+def _group_frequencies(rows: list, result_set: dict) -> list[tuple[tuple, list]] | None:
     """
-    Get the combined E value for collocation
+    Vectorised equivalent of _body_totals summed by body with pandas.
+    Return None if the rows cannot be summed exactly this way (non-integer
+    aggregates, rows of unexpected lengths), for the caller to fall back on Python
     """
-    assert current is not None and done is not None
-    done_minus_current = [x for x in done if x != current]
-    if not done_minus_current:
-        return this_time_e
-    current_size: int = current[-1]
-    done_size = sum(d[-1] for d in done_minus_current if d != current)
-    prop = this_time_e * current_size
-    done_prop = e_so_far * done_size
-    return (prop + done_prop) / (current_size + done_size)
+    is_total = np.fromiter(
+        (r[0] in (True, "True") for r in rows), dtype=np.bool_, count=len(rows)
+    )
+    parts: list[tuple[int, tuple, list]] = []
+    for flag, attrs in (
+        (False, result_set.get("attributes", [])),
+        (True, result_set.get("total", [])),
+    ):
+        positions = np.flatnonzero(is_total == flag)
+        if not len(positions):
+            continue
+        types = ["totals", *(a.get("type") for a in attrs)]
+        subset = [rows[i] for i in positions]
+        if any(len(r) != len(types) for r in subset):
+            return None
+        frame = pd.DataFrame(subset, dtype=object)
+        body_cols = [f"b{n}" for n, t in enumerate(types) if t != "aggregate"]
+        agg_cols = [f"a{n}" for n, t in enumerate(types) if t == "aggregate"]
+        data: dict[str, Any] = {"_pos": positions}
+        for n, t in enumerate(types):
+            if t != "aggregate":
+                # same as str(x) for each cell, like _body_totals
+                data[f"b{n}"] = frame[n].astype(str).to_numpy()
+                continue
+            values = np.array(frame[n].tolist())
+            if values.dtype.kind != "i":
+                # floats could be summed in another order, bools would become ints
+                return None
+            data[f"a{n}"] = values
+        aggs: dict[str, Any] = {"_pos": ("_pos", "min")}
+        aggs.update({c: (c, "sum") for c in agg_cols})
+        summed = (
+            pd.DataFrame(data).groupby(body_cols, sort=False).agg(**aggs).reset_index()
+        )
+        bodies = zip(*(summed[c].tolist() for c in body_cols))
+        sums = (
+            zip(*(summed[c].tolist() for c in agg_cols))
+            if agg_cols
+            else ([] for _ in range(len(summed)))
+        )
+        parts.extend(zip(summed["_pos"].tolist(), bodies, (list(t) for t in sums)))
+    parts.sort(key=lambda x: x[0])
+    return [(body, totals) for _, body, totals in parts]
 
 
 def _format_kwics(
@@ -433,6 +370,10 @@ def _apply_filter(result: list, name: str, op: str, num: int | str | float) -> l
             num = float(num)
         except:
             raise TypeError(f"The filter value {num} is not a valid numerical value")
+    if VECTORISED_STATS and len(result) >= VECTORISED_MIN_ROWS:
+        filtered = _apply_filter_vectorised(result, op, num)
+        if filtered is not None:
+            return filtered
     for r in result:
         total = r[-1]
         res = OPS[op](total, num)
@@ -441,6 +382,29 @@ def _apply_filter(result: list, name: str, op: str, num: int | str | float) -> l
     return out
 
 
+def _apply_filter_vectorised(result: list, op: str, num: int | float) -> list | None:
+    """
+    Same as the loop of _apply_filter, with a numpy mask and a set for the duplicates.
+    Return None if the totals are not numbers or the rows are not hashable
+    """
+    totals = np.array([r[-1] for r in result])
+    if totals.dtype.kind not in "iuf":
+        return None
+    out: list = []
+    seen: set[tuple] = set()
+    try:
+        for n in np.flatnonzero(OPS[op](totals, num)).tolist():
+            r = result[n]
+            frozen = tuple(r)
+            if frozen in seen:
+                continue
+            seen.add(frozen)
+            out.append(r)
+    except TypeError:
+        return None
+    return out
+
+
 def _fix_freq(v: list[list]) -> list[list]:
     """
     Sum frequency objects and remove duplicate
@@ -5,27 +5,47 @@ as defined in the CQPWeb manual at https://cwb.sourceforge.io/files/CQP_Manual/2
 
 from typing import Any, cast
 from lark import Lark
+from lark.exceptions import LarkError
 from lark.lexer import Token
 
 import os
-import re
 
 from .typed import CorpusConfig
 from .utils import _get_all_labels, _layer_contains
 
 PARSER_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "parser"))
-PARSER_FILES = [os.path.join(PARSER_PATH, f) for f in sorted(os.listdir(PARSER_PATH))]
 
-cqp_grammar_fn: str = next(
-    (f for f in PARSER_FILES if re.match(r".*cqp[^/]*\.lark$", f)), ""
-)
+# by name: other grammars (e.g. cqp_lalr.lark) also start with cqp
+cqp_grammar_fn: str = os.path.join(PARSER_PATH, "cqp.lark")
 assert os.path.isfile(
     cqp_grammar_fn
-), f"Could not find a valid CQP lark file in the current directory"
+), f"Could not find the CQP grammar at {cqp_grammar_fn}"
 cqp_grammar: str = open(cqp_grammar_fn).read()
 
 cqp_parser = Lark(cqp_grammar, parser="earley", start="top")
 
+# LALR variant of the grammar, for the queries whose parse tree is unambiguous
+# (see the grammar). Its parsing tables are cached next to the grammar: the cache
+# is built with the package (see parser/update.sh), or when first imported
+cqp_lalr_fn: str = os.path.join(PARSER_PATH, "cqp_lalr.lark")
+cqp_lalr_cache: str | bool = f"{cqp_lalr_fn}.cache"
+if not os.path.exists(cqp_lalr_cache) and not os.access(PARSER_PATH, os.W_OK):
+    cqp_lalr_cache = True  # in the temp directory
+cqp_lalr_parser = Lark(
+    open(cqp_lalr_fn).read(), parser="lalr", start="top", cache=cqp_lalr_cache
+)
+
+
+def parse_cqp(cqp: str) -> Any:
+    """
+    Parse with the LALR parser, or the Earley parser if the LALR grammar does not
+    cover the query (errors are reported by the Earley parser)
+    """
+    try:
+        return cqp_lalr_parser.parse(cqp)
+    except LarkError:
+        return cqp_parser.parse(cqp)
+
 
 def get_leaf_value(node: Any) -> str:
     out: str
@@ -286,7 +306,7 @@ def cqp_to_json(cqp: str, conf: dict[str, Any] = {}) -> tuple[dict, list[dict]]:
     Take a CQP string and generate just the sequence (or single token) part
     """
 
-    cqp_parsed: Any = cqp_parser.parse(cqp)
+    cqp_parsed: Any = parse_cqp(cqp)
 
     members: list = []
     nodes = cqp_parsed.children[0].children  # expr > _
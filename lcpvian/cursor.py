@@ -0,0 +1,156 @@
+"""
+cursor.py: opaque pagination cursors
+
+A cursor points to the next kwic line of a query: the hash of its QueryInfo, the
+batch containing that line and the position of the line among the kwic lines of
+the batch. The lines of a query are numbered across its batches in the order in
+which they were run (QueryInfo.query_batches), so the cursor also records the
+batches up to its own, in that order, with their hash and number of kwic lines.
+
+A request resuming from a cursor starts at its batch and line directly. If the
+QueryInfo expired in the meantime, the batches of the cursor are recorded again
+so that the numbering of the lines stays the same, and only the batch of the
+cursor runs again (do_batch re-runs the batches that are not in the cache).
+
+Since those batches are trusted when resuming, a cursor is signed with an HMAC
+of CURSOR_SECRET: a cursor that was not issued by the server is rejected.
+Without a CURSOR_SECRET, the secret is derived from JWT_SECRET_KEY, so that the
+key of the auth tokens never signs anything else.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import zlib
+
+from typing import TYPE_CHECKING, cast
+
+if TYPE_CHECKING:
+    from .query_classes import QueryInfo
+
+CURSOR_VERSION = 2
+
+
+def _cursor_secret() -> bytes:
+    """
+    CURSOR_SECRET, else a key derived from JWT_SECRET_KEY for cursors only,
+    else a random key
+    """
+    if secret := os.getenv("CURSOR_SECRET"):
+        return secret.encode("utf-8")
+    if jwt_key := os.getenv("JWT_SECRET_KEY"):
+        return hmac.new(jwt_key.encode("utf-8"), b"lcp-cursor", hashlib.sha256).digest()
+    logging.warning(
+        "Neither CURSOR_SECRET nor JWT_SECRET_KEY is set: the cursors are only "
+        "valid for the process that issued them"
+    )
+    return secrets.token_bytes(32)
+
+
+# All the instances serving a query need the same secret to accept its cursors
+CURSOR_SECRET = _cursor_secret()
+
+
+def _b64(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode((text + "=" * (-len(text) % 4)).encode("ascii"))
+
+
+def _signature(packed: str) -> str:
+    return _b64(
+        hmac.new(CURSOR_SECRET, packed.encode("ascii"), hashlib.sha256).digest()
+    )
+
+
+class Cursor:
+    """
+    Position of a kwic line in the results of a query
+    """
+
+    def __init__(
+        self, qhash: str, batch: str, position: int, batches: list[list[str | int]]
+    ):
+        self.qhash = qhash
+        self.batch = batch
+        self.position = position
+        # [batch name, batch hash, number of kwic lines] up to the batch of the cursor
+        self.batches = batches
+
+    @classmethod
+    def at(cls, qi: "QueryInfo", offset: int) -> "Cursor | None":
+        """
+        The cursor of the line at offset in the batches that ran so far,
+        or of the end of the last batch if there are not that many lines
+        """
+        batches: list[list[str | int]] = []
+        lines_before = 0
+        position = 0
+        for name, (batch_hash, n_lines) in qi.query_batches.items():
+            batches.append([name, batch_hash, int(n_lines)])
+            position = min(offset - lines_before, int(n_lines))
+            if offset < lines_before + int(n_lines):
+                break
+            lines_before += int(n_lines)
+        if not batches:
+            return None
+        return cls(qi.hash, cast(str, batches[-1][0]), position, batches)
+
+    def encode(self) -> str:
+        raw = json.dumps(
+            [CURSOR_VERSION, self.qhash, self.batch, self.position, self.batches],
+            separators=(",", ":"),
+        )
+        packed = _b64(zlib.compress(raw.encode("utf-8")))
+        return f"{packed}.{_signature(packed)}"
+
+    @classmethod
+    def decode(cls, token: str) -> "Cursor":
+        """
+        Raise ValueError if the token is not a valid cursor signed by the server
+        """
+        packed, _, signature = token.rpartition(".")
+        if not (token.isascii() and packed):
+            raise ValueError("Invalid cursor")
+        if not hmac.compare_digest(signature, _signature(packed)):
+            raise ValueError("Invalid cursor: bad signature")
+        try:
+            raw = zlib.decompress(_unb64(packed))
+            version, qhash, batch, position, batches = json.loads(raw)
+        except Exception as err:
+            raise ValueError(f"Invalid cursor: {err}") from err
+        valid = (
+            version == CURSOR_VERSION
+            and isinstance(position, int)
+            and isinstance(batches, list)
+            and all(isinstance(b, list) and len(b) == 3 for b in batches)
+            and batches
+            and batches[-1][0] == batch
+        )
+        if not valid:
+            raise ValueError("Invalid cursor")
+        return cls(str(qhash), str(batch), position, batches)
+
+    def resume(self, qi: "QueryInfo") -> int:
+        """
+        Record the batches of the cursor that the QueryInfo does not know about
+        (e.g. because it expired) and return the offset of the line of the cursor
+        """
+        if qi.hash != self.qhash:
+            raise ValueError("The cursor belongs to another query")
+        words = {str(name): int(n) for name, n in qi.all_batches}
+        for batch, batch_hash, n_lines in self.batches:
+            name = str(batch)
+            if name in qi.query_batches or name not in words:
+                continue
+            qi.query_batches[name] = (batch_hash, n_lines)
+            if name not in qi.done_batches:
+                qi.done_batches[name] = words[name]
+        lines_before, _ = qi.get_lines_batch(self.batch)
+        return lines_before + self.position
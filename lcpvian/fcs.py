@@ -3,13 +3,15 @@ import json
 import os
 
 from aiohttp import web
+from collections.abc import AsyncIterator, Iterator
+from functools import lru_cache
 from typing import cast
 from xml.sax.saxutils import escape
 
 from .authenticate import Authentication
 from .cql_to_json import CqlToJson
 from .textsearch_to_json import textsearch_to_json
-from .query_classes import QueryInfo, Request
+from .query_classes import wait_for_request
 from .query import process_query
 from .typed import JSONObject
 from .utils import _get_iso639_3, LCPApplication
@@ -19,6 +21,10 @@ FCS_PORT = "443"
 FCS_DB = "LCP public corpora"
 PID_PREFIX = f"https://{FCS_HOST}/"
 DEFAULT_MAX_KWIC_LINES = os.getenv("DEFAULT_MAX_KWIC_LINES", 9999)
+# Max number of corpora queried at once by a searchRetrieve request
+FCS_MAX_CONCURRENT = int(os.getenv("FCS_MAX_CONCURRENT", 4))
+# Number of CQL queries whose conversion to JSON is kept, per segment/token layers
+FCS_QUERY_CACHE_SIZE = int(os.getenv("FCS_QUERY_CACHE_SIZE", 256))
 SRU = {"1.2": "sru", "2.0": "sruResponse"}
 SRU_URL = {
     "1.2": "http://www.loc.gov/zing/srw/",
@@ -81,27 +87,28 @@ def _get_descriptions(conf: dict) -> str:
     return ret
 
 
-async def _check_request_complete(
-    qi: QueryInfo,
-    request: Request,
-    app: web.Application,
-    request_ids: dict[str, dict],
-    requested: int,
-):
-    while 1:
-        await asyncio.sleep(0.5)
-        if not qi.has_request(request):
-            request_ids[request.id]["done"] = True
-            break
-        n_results = sum(
-            len(app["query_buffers"].get(rid, {}).get("1", []))
-            for rid, rprops in request_ids.items()
-            if rprops.get("done")
-        )
-        if n_results >= requested:
-            qi.stop_request(request)
-            break
-    return
+@lru_cache(maxsize=FCS_QUERY_CACHE_SIZE)
+def _cql_to_json(segment: str, token: str, query: str) -> str:
+    """
+    The JSON query of a CQL query, for corpora with these segment and token layers
+    """
+    return json.dumps(CqlToJson(segment=segment, token=token, query=query).convert())
+
+
+async def _search_corpus(
+    app: LCPApplication, corpus: dict, data: dict, budget: asyncio.Semaphore
+) -> None:
+    """
+    Query one corpus once the concurrency budget allows it and wait for its results.
+    Cancelling the task stops the request, or never sends it if it is still waiting
+    """
+    async with budget:
+        req, qi, job = process_query(app, data)
+        corpus["rid"] = req.id
+        # No job means no request is running: delete it
+        if job is None and qi.has_request(req):
+            qi.delete_request(req)
+        await wait_for_request(qi, req)
 
 
 def _get_record_headers(version: str = "1.2", operation: str = "explain") -> str:
@@ -121,65 +128,52 @@ def _get_record_headers(version: str = "1.2", operation: str = "explain") -> str
     return first_line + second_line
 
 
-def _make_search_response(
-    buffers,
-    request_ids: dict[str, dict],
-    startRecord: int = 0,
-    requested: int = 50,
-    version: str = "2.0",
-) -> str:
-    resp = """<?xml version='1.0' encoding='utf-8'?>
-<{sru}:searchRetrieveResponse xmlns:{sru}="{sru_url}">
-  <{sru}:version>{version}</{sru}:version>""".format(
-        version=version, sru=SRU[version], sru_url=SRU_URL[version]
+def _make_records(
+    payload: dict, corpus: dict, first_position: int = 1, version: str = "2.0"
+) -> Iterator[str]:
+    """
+    The records of the results of one corpus, numbered from first_position
+    """
+    if "1" not in payload or "-1" not in payload:
+        return
+    cid = corpus["cid"]
+    lg = corpus["lg"]
+    shortname = corpus["conf"]["shortname"]
+    column_names: list[str] = (
+        corpus["conf"]["mapping"]["layer"]
+        .get(corpus["conf"]["segment"])
+        .get("prepared", {})
+        .get("columnHeaders", corpus["conf"]["column_names"])
     )
-    records: list[str] = []
-    for rid, corpus in request_ids.items():
-        if not corpus.get("done"):
-            continue
-        if len(records) >= requested:
-            break
-        payload = buffers[rid]
-        cid = corpus["cid"]
-        lg = corpus["lg"]
-        shortname = corpus["conf"]["shortname"]
-        column_names: list[str] = (
-            corpus["conf"]["mapping"]["layer"]
-            .get(corpus["conf"]["segment"])
-            .get("prepared", {})
-            .get("columnHeaders", corpus["conf"]["column_names"])
-        )
-        space_after_id = (
-            column_names.index("spaceAfter") if "spaceAfter" in column_names else -1
-        )
-        form_id = column_names.index("form")
-        if "1" not in payload or "-1" not in payload:
-            continue
-        for rp, (sid, hits, *_) in enumerate(payload["1"], start=1):
-            offset, tokens, *annotations = payload["-1"][sid]
-            prep_seg = ""
-            in_hit = False
-            for n, token in enumerate(tokens):
-                token_str = escape(token[form_id]) if token[form_id] else ""
-                is_hit = offset + n in hits or offset + n in [
-                    y for x in hits if isinstance(x, list) for y in x
-                ]
-                if in_hit and not is_hit:
-                    after_space = prep_seg and prep_seg[-1] == " "
-                    prep_seg = (
-                        prep_seg.rstrip() + "</hits:Hit>" + (" " if after_space else "")
-                    )
-                if not in_hit and is_hit:
-                    token_str = f"<hits:Hit>{token_str}"
-                in_hit = is_hit
-                if space_after_id < 0 or token[space_after_id] == "1":
-                    token_str += " "
-                prep_seg += token_str
-            prep_seg = prep_seg.strip()
-            if in_hit:
-                prep_seg += "</hits:Hit>"
-            ref = f"{PID_PREFIX}query/{cid}/{shortname}"
-            records.append(f"""
+    space_after_id = (
+        column_names.index("spaceAfter") if "spaceAfter" in column_names else -1
+    )
+    form_id = column_names.index("form")
+    for rp, (sid, hits, *_) in enumerate(payload["1"], start=first_position):
+        offset, tokens, *annotations = payload["-1"][sid]
+        prep_seg = ""
+        in_hit = False
+        for n, token in enumerate(tokens):
+            token_str = escape(token[form_id]) if token[form_id] else ""
+            is_hit = offset + n in hits or offset + n in [
+                y for x in hits if isinstance(x, list) for y in x
+            ]
+            if in_hit and not is_hit:
+                after_space = prep_seg and prep_seg[-1] == " "
+                prep_seg = (
+                    prep_seg.rstrip() + "</hits:Hit>" + (" " if after_space else "")
+                )
+            if not in_hit and is_hit:
+                token_str = f"<hits:Hit>{token_str}"
+            in_hit = is_hit
+            if space_after_id < 0 or token[space_after_id] == "1":
+                token_str += " "
+            prep_seg += token_str
+        prep_seg = prep_seg.strip()
+        if in_hit:
+            prep_seg += "</hits:Hit>"
+        ref = f"{PID_PREFIX}query/{cid}/{shortname}"
+        yield f"""
     <{SRU[version]}:record>
       {_get_record_headers(version, 'searchRetrieve')}
       <{SRU[version]}:recordData>
@@ -193,18 +187,64 @@ def _make_search_response(
           </fcs:ResourceFragment>
         </fcs:Resource>
       </{SRU[version]}:recordData>
-      <{SRU[version]}:recordPosition>{startRecord+rp}</{SRU[version]}:recordPosition>
-    </{SRU[version]}:record>""")
-            if len(records) >= requested:
-                break
-    if len(records) == 0:
+      <{SRU[version]}:recordPosition>{rp}</{SRU[version]}:recordPosition>
+    </{SRU[version]}:record>"""
+
+
+async def _federated_search(
+    app: LCPApplication,
+    corpora: list[tuple[dict, dict]],
+    startRecord: int = 0,
+    requested: int = 50,
+    version: str = "2.0",
+) -> AsyncIterator[str]:
+    """
+    Query the corpora concurrently, at most FCS_MAX_CONCURRENT at a time, and yield
+    their records in the order of the corpora as soon as the previous corpora are
+    done. The corpora not needed once enough records were yielded are stopped
+    """
+    budget = asyncio.Semaphore(FCS_MAX_CONCURRENT)
+    tasks = [
+        asyncio.ensure_future(_search_corpus(app, corpus, data, budget))
+        for corpus, data in corpora
+    ]
+    n_records = 0
+    try:
+        for (corpus, _), task in zip(corpora, tasks):
+            await task
+            payload = app["query_buffers"].pop(corpus.get("rid", ""), {})
+            for record in _make_records(
+                payload, corpus, startRecord + n_records + 1, version
+            ):
+                yield record
+                n_records += 1
+                if n_records >= requested:
+                    return
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for corpus, _ in corpora:
+            app.get("query_buffers", {}).pop(corpus.get("rid", ""), None)
+
+
+async def _make_search_response(
+    records: AsyncIterator[str], version: str = "2.0"
+) -> str:
+    resp = """<?xml version='1.0' encoding='utf-8'?>
+<{sru}:searchRetrieveResponse xmlns:{sru}="{sru_url}">
+  <{sru}:version>{version}</{sru}:version>""".format(
+        version=version, sru=SRU[version], sru_url=SRU_URL[version]
+    )
+    collected: list[str] = [record async for record in records]
+    if len(collected) == 0:
         resp += f"""
   <{SRU[version]}:numberOfRecords>0</{SRU[version]}:numberOfRecords>
 """
     else:
         resp += f"""
-  <{SRU[version]}:numberOfRecords>{len(records)}</{SRU[version]}:numberOfRecords>
-  <{SRU[version]}:records>{''.join(records)}
+  <{SRU[version]}:numberOfRecords>{len(collected)}</{SRU[version]}:numberOfRecords>
+  <{SRU[version]}:records>{''.join(collected)}
   </{SRU[version]}:records>
 """
     return resp + f"</{SRU[version]}:searchRetrieveResponse>"
@@ -250,51 +290,28 @@ async def search_retrieve(
     except:
         startRecord = 0
 
-    request_ids: dict[str, dict] = {}
-    async with asyncio.TaskGroup() as tg:
-        for cid, conf, lg in corpora:
-            langs = [lg if "partitions" in conf else "en"]
-            json_query: str = json.dumps(
-                CqlToJson(
-                    segment=conf["firstClass"]["segment"],
-                    token=conf["firstClass"]["token"],
-                    query=query,
-                ).convert()
-                if queryType == "cql"
-                else textsearch_to_json(query, conf)
+    searches: list[tuple[dict, dict]] = []
+    for cid, conf, lg in corpora:
+        langs = [lg if "partitions" in conf else "en"]
+        json_query: str = (
+            _cql_to_json(
+                conf["firstClass"]["segment"], conf["firstClass"]["token"], query
             )
-            req, qi, job = process_query(
-                app,
-                {
-                    "appType": "lcp",
-                    "corpus": cid,
-                    "query": json_query,
-                    "languages": langs,
-                    "offset": startRecord,
-                    "requested": requested,
-                    "synchronous": True,
-                },
-            )
-            request_ids[req.id] = {
-                "cid": cid,
-                "conf": conf,
-                "lg": lg,
-                "n_results": 0,
-                "done": False,
-            }
-            # No job means no request is running: delete it
-            if job is None and qi.has_request(req):
-                qi.delete_request(req)
-            tg.create_task(
-                _check_request_complete(qi, req, app, request_ids, requested)
-            )
-    return _make_search_response(
-        app["query_buffers"],
-        request_ids,
-        startRecord=startRecord,
-        requested=requested,
-        version=version,
-    )
+            if queryType == "cql"
+            else json.dumps(textsearch_to_json(query, conf))
+        )
+        data = {
+            "appType": "lcp",
+            "corpus": cid,
+            "query": json_query,
+            "languages": langs,
+            "offset": startRecord,
+            "requested": requested,
+            "synchronous": True,
+        }
+        searches.append(({"cid": cid, "conf": conf, "lg": lg}, data))
+    records = _federated_search(app, searches, startRecord, requested, version)
+    return await _make_search_response(records, version=version)
 
 
 async def explain(app: LCPApplication, request: web.Request, **extra_params) -> str:
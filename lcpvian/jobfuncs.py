@@ -4,7 +4,7 @@ import os
 import shutil
 import traceback
 
-from typing import Any, cast
+from typing import Any, Awaitable, Callable, cast
 
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.sql import text
@@ -110,7 +110,7 @@ async def _export_db(
 
     query = export_query.format(**export_params)
 
-    async with get_current_job()._wpool.begin() as conn:  # type: ignore
+    async with get_current_job().engines.connect("web", begin=True) as conn:  # type: ignore
         raw = await conn.get_raw_connection()
         con = raw._connection
         async with con.transaction():
@@ -137,7 +137,7 @@ async def _create_schema(
     extra = {"user": user, "room": room, "schema": schema_name}
 
     # todo: figure out how to make this block a little nicer :P
-    async with get_current_job()._upool.begin() as conn:  # type: ignore
+    async with get_current_job().engines.connect("upload", begin=True) as conn:  # type: ignore
         raw = await conn.get_raw_connection()
         con = raw._connection
         async with con.transaction():
@@ -158,6 +158,8 @@ async def _db_query(
     is_main: bool = False,  # is the query related to the schame 'main'?
     is_import: bool = False,  # is the query related to the import pipeline?
     has_return: bool = True,
+    on_chunk: Callable[[list[tuple[Any, ...]]], Awaitable[None]] | None = None,
+    chunk_size: int = 1000,
     **kwargs: str | None | int | float | bool | list[str],
 ) -> (
     list[tuple[Any, ...]]
@@ -171,6 +173,9 @@ async def _db_query(
 ):
     """
     The function queued by RQ, which executes our DB query
+
+    If on_chunk is provided, the results are fetched with a server-side cursor
+    and passed to on_chunk chunk_size rows at a time instead of being returned
     """
     # this can only be done after the previous job finished...
     if "depends_on" in kwargs and "sentences_query" in kwargs:
@@ -185,13 +190,13 @@ async def _db_query(
         params = {"ids": ids}
 
     name = (
-        "_upool"
+        "upload"
         if (store or delete or is_import)
-        else ("_wpool" if (config or is_main) else "_pool")
+        else ("web" if (config or is_main) else "query")
     )
     job = get_current_job()
-    pool = getattr(job, name)
-    method = "begin" if (store or delete or is_import) else "connect"
+    engines = job.engines  # type: ignore
+    begin = bool(store or delete or is_import)
 
     first_job_id = cast(str, kwargs.get("first_job", ""))
     if first_job_id:
@@ -207,8 +212,14 @@ async def _db_query(
     if job and cast(dict, job.kwargs).get("refresh_config", None):
         await refresh_config()
 
-    async with getattr(pool, method)() as conn:
+    async with engines.connect(name, begin=begin, job=job) as conn:
         try:
+            if on_chunk is not None:
+                stream = await conn.stream(text(query), params)
+                async for rows in stream.partitions(chunk_size):
+                    await on_chunk([tuple(i) for i in rows])
+                return None
+
             res = await conn.execute(text(query), params)
 
             if store or delete:
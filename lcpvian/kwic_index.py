@@ -0,0 +1,125 @@
+"""
+kwic_index.py: compact index of the kwic lines of a batch
+
+When a batch completes, run_query_on_batch records for each kwic line (in the
+order in which lines are counted across all the plain result sets):
+
+* its position among all the rows cached for the batch
+* the id of its segment
+* the char range of its context, if the result set has one
+
+Requests can then find the rows of their window of lines, and the segments
+in it, with array slices instead of walking all the cached rows of the batch.
+"""
+
+import numpy as np
+
+from io import BytesIO
+from typing import Any, Iterable
+
+
+class KwicIndex:
+    """
+    Positions, segment ids and char ranges of the kwic lines of a batch
+    """
+
+    def __init__(
+        self,
+        positions: np.ndarray,
+        sids: np.ndarray,
+        ranges: np.ndarray,
+        has_range: np.ndarray,
+    ):
+        self.positions = positions
+        self.sids = sids
+        self.ranges = ranges
+        self.has_range = has_range
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def rows(self, offset: int = 0, upper: int | None = None) -> list[int]:
+        """
+        The positions in the cached batch of the kwic lines offset:upper
+        """
+        return self.positions[offset:upper].tolist()
+
+    def count_segments(self, offset: int = 0, upper: int | None = None) -> int:
+        return len(np.unique(self.sids[offset:upper]))
+
+    def segment_ids(
+        self, offset: int = 0, upper: int | None = None
+    ) -> dict[str, int | list[int]]:
+        """
+        Same as QueryInfo.segment_ids_in_results for the kwic lines offset:upper
+        """
+        sids = self.sids[offset:upper].tolist()
+        ranges = self.ranges[offset:upper].tolist()
+        has_range = self.has_range[offset:upper].tolist()
+        return {
+            sid: (cr if has else 1) for sid, cr, has in zip(sids, ranges, has_range)
+        }
+
+    def to_bytes(self) -> bytes:
+        out = BytesIO()
+        np.savez(
+            out,
+            positions=self.positions,
+            sids=self.sids,
+            ranges=self.ranges,
+            has_range=self.has_range,
+        )
+        return out.getvalue()
+
+    @classmethod
+    def from_bytes(cls, raw: bytes) -> "KwicIndex":
+        with np.load(BytesIO(raw), allow_pickle=False) as arrays:
+            return cls(
+                arrays["positions"],
+                arrays["sids"],
+                arrays["ranges"],
+                arrays["has_range"],
+            )
+
+
+class KwicIndexBuilder:
+    """
+    Build a KwicIndex from the rows of a batch, possibly received in chunks
+    """
+
+    def __init__(self, lookups: dict[str, tuple[int | None, bool]]):
+        # kwic key -> (index of the char range in the hits, widen it by 2 chars)
+        self._lookups = lookups
+        self._n_rows = 0
+        self._positions: list[int] = []
+        self._sids: list[str] = []
+        self._ranges: list[tuple[int, int]] = []
+        self._has_range: list[bool] = []
+
+    def add(self, rows: Iterable[Any]) -> None:
+        for position, (key, hit) in enumerate(rows, start=self._n_rows):
+            self._n_rows += 1
+            lookup = self._lookups.get(str(key))
+            if lookup is None:
+                continue
+            cr_index, widen = lookup
+            self._positions.append(position)
+            self._sids.append(str(hit[0]))
+            cr = hit[cr_index] if cr_index else None
+            if not cr:
+                self._ranges.append((0, 0))
+                self._has_range.append(False)
+                continue
+            lower, upper = int(cr[0]), int(cr[1])
+            if widen:
+                lower, upper = lower - 2, upper + 2
+            self._ranges.append((lower, upper))
+            self._has_range.append(True)
+
+    def finish(self) -> KwicIndex:
+        return KwicIndex(
+            np.array(self._positions, dtype=np.int64),
+            np.array(self._sids, dtype=np.str_),
+            np.array(self._ranges, dtype=np.int64).reshape(-1, 2),
+            np.array(self._has_range, dtype=np.bool_),
+        )
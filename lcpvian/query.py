@@ -1,11 +1,10 @@
-import asyncio
 import json
 import logging
-import re
 import traceback
 
+import numpy as np
+
 from aiohttp import web
-from intervaltree import IntervalTree
 from redis import Redis as RedisConnection
 from rq.job import get_current_job, Job
 from typing import cast, Any
@@ -14,21 +13,24 @@ from uuid import uuid4
 from .abstract_query.create import json_to_sql
 from .abstract_query.typed import QueryJSON
 from .authenticate import Authentication
+from .char_ranges import RangeMatcher
+from .cursor import Cursor
 from .dqd_parser import convert
-from .query_classes import QueryInfo, Request
-from .redis_proxies import RedisDict
+from .jobfuncs import _db_query
+from .query_classes import QueryInfo, Request, wait_for_request
+from .redis_proxies import RedisDict, retry_on_conflict
+from .segment_cache import SegmentCache, dedupe_rows, rows_by_segment
 from .utils import (
     _get_query_batches,
     get_segment_meta_script,
     hasher,
     push_msg,
-    range_from_str,
     CustomEncoder,
     LCPApplication,
 )
 
 
-def batch_callback(job: Job, connection: RedisConnection, batch_name: str):
+def batch_callback(job: Job, connection: RedisConnection, batch_name: str | list[str]):
     """
     Publish a message that we got some results (to be captured by the requests)
     then schedule the query on the next batch
@@ -38,41 +40,56 @@ def batch_callback(job: Job, connection: RedisConnection, batch_name: str):
     if not batch_name:
         return
 
+    # speculative batches can complete several batches at once
+    batch_names: list[str] = (
+        [batch_name] if isinstance(batch_name, str) else list(batch_name)
+    )
+
     qhash: str = job.args[0]
     qi: QueryInfo = QueryInfo(qhash, connection)
 
     # do next batch if needed (all already scheduled if full)
     if not qi.full:
-        schedule_next_batch(qhash, connection, batch_name)
+        schedule_next_batch(qhash, connection, batch_names[-1])
 
-    # run needed segment+meta queries
-    lines_before, lines_now = qi.get_lines_batch(batch_name)
-    lines_so_far = lines_before + lines_now
+    for name in batch_names:
+        _schedule_segments(qi, name)
 
-    # send sentences if needed
-    if not qi.kwic_keys or all(r.raw_hits for r in qi.requests):
-        return
 
-    min_offset = min(r.offset for r in qi.requests) if qi.requests else 0
-    # Send only if this batch exceeds the offset and this batch starts before what's required
-    need_segments_this_batch = (
-        lines_now > 0
-        and lines_so_far >= min_offset
-        and (qi.full or qi.required > lines_before)
-    )
-    print(
-        f"need segments for {batch_name}?",
-        min_offset,
-        lines_so_far,
-        need_segments_this_batch,
-    )
-    if not need_segments_this_batch:
-        return
+@retry_on_conflict
+def _schedule_segments(qi: QueryInfo, batch_name: str) -> None:
+    """
+    Run the segment+meta queries needed for the lines of the batch
+    """
+    with qi.snapshot():
+        # run needed segment+meta queries
+        lines_before, lines_now = qi.get_lines_batch(batch_name)
+        lines_so_far = lines_before + lines_now
 
-    offset_this_batch = max(0, min_offset - lines_so_far)
-    lines_this_batch = (
-        lines_now if qi.full else min(lines_now, qi.required - lines_before)
-    )
+        # send sentences if needed
+        if not qi.kwic_keys or all(r.raw_hits for r in qi.requests):
+            return
+
+        min_offset = min(r.offset for r in qi.requests) if qi.requests else 0
+        # Send only if this batch exceeds the offset and this batch starts before what's required
+        need_segments_this_batch = (
+            lines_now > 0
+            and lines_so_far >= min_offset
+            and (qi.full or qi.required > lines_before)
+        )
+        print(
+            f"need segments for {batch_name}?",
+            min_offset,
+            lines_so_far,
+            need_segments_this_batch,
+        )
+        if not need_segments_this_batch:
+            return
+
+        offset_this_batch = max(0, min_offset - lines_so_far)
+        lines_this_batch = (
+            lines_now if qi.full else min(lines_now, qi.required - lines_before)
+        )
     qi.enqueue(
         do_segment_and_meta,
         qi.hash,
@@ -102,7 +119,24 @@ async def do_segment_and_meta(
     if all(r.raw_hits for r in qi.requests):
         return
     batch_hash, _ = qi.query_batches[batch_name]
-    batch_results: list = qi.get_from_cache(batch_hash)
+    # Calculate which lines from res should be sent to each request
+    reqs_offsets = {r.id: r.lines_for_batch(qi, batch_name) for r in qi.requests}
+    # Only deserialize the kwic lines spanning all the requests' windows
+    windows = [(o, l) for o, l in reqs_offsets.values() if l > 0]
+    windows.append((offset_this_batch, lines_this_batch))
+    lower: int = min(o for o, _ in windows)
+    upper: int = max(o + l for o, l in windows)
+    index = qi.kwic_index(batch_hash)
+    batch_results: list = (
+        []
+        if index is not None
+        else qi.rows_from_cache(batch_hash, qi.kwic_keys, lower, upper)
+    )
+
+    def segment_ids(start: int, end: int) -> dict[str, int | list[int]]:
+        if index is not None:
+            return index.segment_ids(start, end)
+        return qi.segment_ids_in_results(batch_results, start - lower, end - lower)
 
     segment: str = qi.config["firstClass"]["segment"]
     export_to_xml = any(
@@ -125,10 +159,8 @@ async def do_segment_and_meta(
         qi.config, qi.languages, batch_name, context=context
     )
 
-    all_segment_ids: dict[str, int | list[int]] = qi.segment_ids_in_results(
-        batch_results,
-        offset_this_batch,
-        offset_this_batch + lines_this_batch,
+    all_segment_ids: dict[str, int | list[int]] = segment_ids(
+        offset_this_batch, offset_this_batch + lines_this_batch
     )
     segments_this_batch = qi.segments_for_batch.get(batch_name, {})
     if isinstance(segments_this_batch, RedisDict):
@@ -154,49 +186,64 @@ async def do_segment_and_meta(
     else:
         qi.qi["meta_labels"] = meta_labels
         squery_id = str(uuid4())
+        # Wide contexts for XML exports are not shared with the other queries
+        segment_cache: SegmentCache | None = None
+        if not export_to_xml or context == segment:
+            segment_cache = SegmentCache(connection, qi.config, qi.languages, context)
+        cached: dict[str, list] = (
+            segment_cache.get_many(list(needed_sids)) if segment_cache else {}
+        )
+        missing_sids = [sid for sid in needed_sids if sid not in cached]
         print(
-            f"Running new segment query for {batch_name} -- {squery_id} ({len(needed_sids)} sids)"
+            f"Running new segment query for {batch_name} -- {squery_id} ({len(missing_sids)} sids, {len(cached)} from the corpus cache)"
         )
-        await qi.query(squery_id, script, params={"sids": [sid for sid in needed_sids]})
+        if not cached:
+            new_lines = await qi.query(squery_id, script, params={"sids": missing_sids})
+            qi.set_segment_ranges(squery_id, list(new_lines or []))
+        else:
+            new_lines = []
+            if missing_sids:
+                new_lines = await _db_query(script, params={"sids": missing_sids})
+            cached_lines = [line for sid in cached for line in cached[sid]]
+            segment_lines = dedupe_rows(cached_lines + list(new_lines or []))
+            qi.set_cache(squery_id, segment_lines)
+            qi.set_segment_ranges(squery_id, segment_lines)
+        if segment_cache and missing_sids:
+            segment_cache.set_many(
+                rows_by_segment(
+                    list(new_lines or []),
+                    {sid: all_segment_ids[sid] for sid in missing_sids},
+                )
+            )
         if batch_name not in qi.segments_for_batch:
             qi.segments_for_batch[batch_name] = {}
         qi.segments_for_batch[batch_name][squery_id] = needed_sids
-    # Calculate which lines from res should be sent to each request
-    reqs_offsets = {r.id: r.lines_for_batch(qi, batch_name) for r in qi.requests}
     reqs_sids: dict[str, dict[str, int | list[int]]] = {
-        req_id: qi.segment_ids_in_results(batch_results, o, o + l)
-        for req_id, (o, l) in reqs_offsets.items()
+        req_id: segment_ids(o, o + l) for req_id, (o, l) in reqs_offsets.items()
+    }
+    reqs_matchers: dict[str, RangeMatcher] = {
+        req_id: RangeMatcher(
+            cast(list[int], cr) for cr in sids_to_crs.values() if isinstance(cr, list)
+        )
+        for req_id, sids_to_crs in reqs_sids.items()
     }
-    reqs_itvls: dict[str, IntervalTree] = {}
-    for req_id, sids_to_crs in reqs_sids.items():
-        reqs_itvls[req_id] = IntervalTree()
-        for char_range in sids_to_crs.values():
-            reqs_itvls[req_id][range(*cast(list[int], char_range))] = 1
     segments_this_batch = cast(RedisDict, qi.segments_for_batch[batch_name]).to_dict()
     for sqid in segments_this_batch:
-        reqs_nlines: dict[str, dict[str, int]] = {req_id: {} for req_id in reqs_sids}
-        lines: list
-        try:
-            lines = qi.get_from_cache(sqid)
-        except:
-            sids = [si for si in segments_this_batch[sqid]]
-            lines = await qi.query(sqid, script, params={"sids": sids})
-        # Be smart about which lines to include
-        for nline, (rtype, content) in enumerate(lines):
-            for req_id, sids_in_req in reqs_sids.items():
-                # No longer using sids_in_req here since we're using char_range
-                cr: str | dict = content[-1]
-                if isinstance(cr, dict):
-                    cr = cr.get("char_range", "")
-                if not isinstance(cr, str) or not re.match(r"\[\d+,\d+\)", cr):
-                    continue
-                if not reqs_itvls[req_id][range_from_str(cast(str, cr))]:
-                    continue
-                reqs_nlines[req_id][str(nline)] = 1
+        ranges = qi.segment_ranges(sqid) if qi.in_cache(sqid) else None
+        if ranges is None:
+            lines: list
+            try:
+                lines = qi.get_from_cache(sqid)
+            except:
+                sids = [si for si in segments_this_batch[sqid]]
+                lines = await qi.query(sqid, script, params={"sids": sids})
+            ranges = qi.set_segment_ranges(sqid, lines)
+        # Only include the lines that overlap the hits of each request
         for r in qi.requests:
-            if sqid in r.segment_lines_for_hash:
+            if sqid in r.segment_lines_for_hash or r.id not in reqs_matchers:
                 continue
-            r.segment_lines_for_hash[sqid] = reqs_nlines[r.id]
+            nlines = np.flatnonzero(reqs_matchers[r.id].overlaps(ranges))
+            r.segment_lines_for_hash[sqid] = {str(n): 1 for n in nlines.tolist()}
     qi.publish(batch_name, "segments")
 
 
@@ -217,21 +264,37 @@ async def do_batch(qhash: str, batch: list):
         return
     # Now this is the running batch
     qi.running_batch = batch_name
+    speculative = batch_name in qi.speculative_batches
     try:
         assert batch_name in qi.query_batches
         batch_hash, _ = qi.query_batches[batch_name]
-        qi.get_from_cache(batch_hash)
-        print(f"Retrieved query from cache: {batch_name} -- {batch_hash}")
+        assert qi.in_cache(batch_hash)
+        truncated = qi.needs_rerun(batch_name)
+        if not truncated:
+            print(f"Retrieved query from cache: {batch_name} -- {batch_hash}")
     except:
+        truncated = False
         print(f"No job in cache for {batch_name}, running it now")
         await qi.run_query_on_batch(batch)
         batch_hash, _ = qi.query_batches.get(batch_name, ("", 0))
+    if truncated:
+        print(f"Batch {batch_name} was truncated, running it entirely now")
+        await qi.run_query_on_batch(batch, budgeted=False)
+        batch_hash, _ = qi.query_batches.get(batch_name, ("", 0))
     min_offset = min(r.offset for r in qi.requests) if qi.requests else 0
-    await qi.run_aggregate(min_offset, batch)
-    qi.publish(batch_name, "main")
-    return batch_name
+    if not speculative:
+        await qi.run_aggregate(min_offset, batch)
+        qi.publish(batch_name, "main")
+        return batch_name
+    # commit the batches whose predecessors have all completed, in scheduling order
+    committed = qi.commit_speculative()
+    for name in committed:
+        await qi.run_aggregate(min_offset, [name, qi.done_batches[name]])
+        qi.publish(name, "main")
+    return committed
 
 
+@retry_on_conflict
 def schedule_next_batch(
     qhash: str,
     connection: RedisConnection,
@@ -242,24 +305,44 @@ def schedule_next_batch(
     and return the corresponding job (None if no next batch)
     """
     qi = QueryInfo(qhash, connection=connection)
-    if not qi.requests:
-        return None
-    if previous_batch_name and not qi.full:
-        lines_before, lines_batch = qi.get_lines_batch(previous_batch_name)
-        if lines_before + lines_batch >= qi.required:
+    with qi.snapshot():
+        if not qi.requests:
+            return None
+        if previous_batch_name and not qi.full:
+            lines_before, lines_batch = qi.get_lines_batch(previous_batch_name)
+            if lines_before + lines_batch >= qi.required:
+                qi.running_batch = ""
+                qi.cancel_speculative()
+                return None
+        if qi.speculation_saturated():
+            # the batches running speculatively will schedule the next ones
+            return None
+        next_batch = qi.decide_next_batch(previous_batch_name)
+        min_offset = min(r.offset for r in qi.requests) if qi.requests else 0
+        while next_batch and min_offset > 0 and next_batch[0] in qi.done_batches:
+            lines_before_batch, lines_next_batch = qi.get_lines_batch(next_batch[0])
+            if min_offset <= lines_before_batch + lines_next_batch:
+                break
+            next_batch = qi.decide_next_batch(next_batch[0])
+        if not next_batch:
             qi.running_batch = ""
             return None
-    next_batch = qi.decide_next_batch(previous_batch_name)
-    min_offset = min(r.offset for r in qi.requests) if qi.requests else 0
-    while next_batch and min_offset > 0 and next_batch[0] in qi.done_batches:
-        lines_before_batch, lines_next_batch = qi.get_lines_batch(next_batch[0])
-        if min_offset <= lines_before_batch + lines_next_batch:
-            break
-        next_batch = qi.decide_next_batch(next_batch[0])
-    if not next_batch:
-        qi.running_batch = ""
-        return None
-    return qi.enqueue(do_batch, qhash, list(next_batch), callback=batch_callback)
+        if next_batch[0] in qi.speculative_batches:
+            # already running: its results will be published when it completes
+            return None
+        extra_batches: list[list] = []
+        is_new = next_batch[0] not in qi.done_batches
+        if is_new:
+            extra_batches = qi.speculative_plan(next_batch)
+        if is_new and (extra_batches or qi.speculative_batches):
+            # mark them before enqueuing, in the order their results will be committed
+            for b in [next_batch, *extra_batches]:
+                qi.speculative_batches[b[0]] = 1
+    job = qi.enqueue(do_batch, qhash, list(next_batch), callback=batch_callback)
+    for b in extra_batches:
+        print(f"Speculatively scheduling batch {b[0]} along with {next_batch[0]}")
+        qi.enqueue(do_batch, qhash, list(b), callback=batch_callback)
+    return job
 
 
 def process_query(
@@ -300,6 +383,7 @@ def process_query(
         batch=cast(str, first_batch[0]),  # batch_name
         config=config,
         lang=lang,
+        connection=app["redis"],
     )
     print("SQL query:", sql_query)
     shash = hasher(sql_query)
@@ -318,6 +402,12 @@ def process_query(
     )
     # if local_kind and local_kind not in qi.local_queries:
     #     qi.update({"local_queries": {**qi.local_queries, local_kind: local_query}})
+    if cursor_token := request_data.get("cursor"):
+        # resume from the batch and line of the cursor instead of the offset
+        try:
+            request.offset = Cursor.decode(str(cursor_token)).resume(qi)
+        except ValueError as err:
+            raise web.HTTPBadRequest(reason=str(err))
     job: Job | None = None
     should_run: bool = True
     if request.to_export and request.user:
@@ -415,11 +505,10 @@ async def post_query(request: web.Request) -> web.Response:
         )
 
     if req.synchronous:
-        while 1:
-            await asyncio.sleep(0.5)
-            if not qi.has_request(req):
-                break
-        res = app["query_buffers"].pop(req.id, None)
+        try:
+            await wait_for_request(qi, req)
+        finally:
+            res = app["query_buffers"].pop(req.id, None)
         print(f"[{req.id}] Done with synchronous request")
         serializer = CustomEncoder()
         return web.json_response(serializer.default(res))
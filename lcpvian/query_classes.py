@@ -2,11 +2,15 @@ import asyncio
 import json
 import traceback
 import os
+import time
+
+import numpy as np
 
 from aiohttp import web
+from collections.abc import AsyncGenerator, Iterator
+from contextlib import contextmanager
 from redis import Redis as RedisConnection
 from rq import Callback, Queue
-from rq.command import send_stop_job_command
 from rq.job import Job
 from types import TracebackType
 from typing import cast, Any, Callable
@@ -15,16 +19,23 @@ from uuid import uuid4
 from .abstract_query.create import json_to_sql
 from .abstract_query.typed import QueryJSON
 from .callbacks import _general_failure
-from .convert import _aggregate_results
+from .char_ranges import line_ranges, ranges_from_bytes, ranges_to_bytes
+from .cursor import Cursor
 from .jobfuncs import _db_query, _export_db
-from .redis_proxies import RedisDict, RedisList
-from .typed import JSONObject, Batch
+from .kwic_index import KwicIndex, KwicIndexBuilder
+from .redis_proxies import RedisDict, RedisList, RedisSnapshot, retry_on_conflict
+from .result_cache import decode_results, encode_results, slice_results
+from .selectivity import SelectivityModel
+from .stats_store import StatsStore
+from .typed import JSONObject
 from .utils import (
     _get_query_batches,
+    _job_stopped,
+    _notify,
     _publish_msg,
+    _stop_job,
     hasher,
     push_msg,
-    CustomEncoder,
 )
 
 MESSAGE_TTL = int(os.getenv("REDIS_WS_MESSSAGE_TTL", 5000))
@@ -32,6 +43,33 @@ QUERY_TTL = int(os.getenv("QUERY_TTL", 5000))
 QUERY_TIMEOUT = int(os.getenv("QUERY_TIMEOUT", 1000))
 FULL_QUERY_TIMEOUT = int(os.getenv("QUERY_ENTIRE_CORPUS_CALLBACK_TIMEOUT", 99999))
 MAX_KWIC_LINES = int(os.getenv("DEFAULT_MAX_KWIC_LINES", 9999999))
+# Number of rows fetched at a time from the DB when streaming batch queries (0 = no streaming)
+QUERY_STREAM_CHUNK_SIZE = int(os.getenv("QUERY_STREAM_CHUNK_SIZE", 0))
+# Max number of batches of a non-full query to run at once (1 = no speculation)
+QUERY_SPECULATIVE_BATCHES = int(os.getenv("QUERY_SPECULATIVE_BATCHES", 1))
+# Push the number of required lines into the SQL of kwic-only non-full queries
+KWIC_ROW_BUDGET = os.getenv("QUERY_KWIC_ROW_BUDGET", "true").lower() in (
+    "true",
+    "1",
+    "yes",
+)
+# Suffix of the cache key that receives the chunks of a batch query still running
+STREAMING_SUFFIX = "::streaming"
+KWIC_INDEX_SUFFIX = "::kwic_index"
+CHAR_RANGES_SUFFIX = "::char_ranges"
+# Max number of seconds a synchronous request waits for its results
+SYNC_REQUEST_TIMEOUT = float(os.getenv("SYNC_REQUEST_TIMEOUT", FULL_QUERY_TIMEOUT))
+# Seconds between checks of redis, in case the notification of a request was missed
+SYNC_REQUEST_RECHECK = 5.0
+REQUEST_DONE_ACTION = "request_done"
+# Max number of payloads of a streamed request waiting to be written to the client:
+# a client that falls further behind gets its stream closed
+SYNC_STREAM_BUFFER = 32
+
+# Futures of the synchronous requests awaited in this process, by request id
+_request_waiters: dict[str, asyncio.Future] = {}
+# Payloads of the synchronous requests streamed by this process, by request id
+_request_streams: dict[str, asyncio.Queue] = {}
 
 SERIALIZABLES = (
     int,
@@ -55,6 +93,10 @@ def _qi_job_failure(
     value: BaseException,
     trace: TracebackType,
 ) -> None:
+    if _job_stopped(connection, job):
+        # e.g. a surplus speculative batch: its requests are not affected
+        print(f"Job {job.id} was stopped")
+        return None
     qi_hash: str = job.meta.get("qi_hash", "")
     qi: QueryInfo = QueryInfo(qi_hash, connection)
     tb = traceback.format_exc()
@@ -62,6 +104,112 @@ def _qi_job_failure(
     return _general_failure(job, connection, typ, value, trace)
 
 
+def _set_done(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def _request_done(request_id: str) -> bool:
+    """
+    Resolve the future of a request awaited in this process, if any
+    """
+    future = _request_waiters.get(request_id)
+    if future is None:
+        return False
+    future.get_loop().call_soon_threadsafe(_set_done, future)
+    return True
+
+
+async def wait_for_request(
+    qi: "QueryInfo", request: "Request", timeout: float = SYNC_REQUEST_TIMEOUT
+) -> bool:
+    """
+    Wait until a synchronous request is deleted from its QueryInfo, i.e. it got
+    all its results, or was stopped or failed. The request is stopped when the
+    wait times out or is cancelled (e.g. the client disconnected).
+    Return whether the request completed in time
+    """
+    future = asyncio.get_running_loop().create_future()
+    _request_waiters[request.id] = future
+    try:
+        async with asyncio.timeout(timeout):
+            # the request may have completed before the future was registered
+            while qi.has_request(request):
+                try:
+                    await asyncio.wait_for(
+                        asyncio.shield(future), timeout=SYNC_REQUEST_RECHECK
+                    )
+                except TimeoutError:
+                    continue
+        return True
+    except TimeoutError:
+        print(f"[{request.id}] Synchronous request timed out after {timeout}s")
+        qi.stop_request(request)
+        return False
+    except asyncio.CancelledError:
+        qi.stop_request(request)
+        raise
+    finally:
+        _request_waiters.pop(request.id, None)
+
+
+def open_request_stream(request_id: str) -> asyncio.Queue:
+    """
+    Register the stream of a synchronous request (see stream_request). Open it
+    before the request is started when its first payloads can come right away
+    (e.g. a cached query): until then they would go to its buffer, if any
+    """
+    queue: asyncio.Queue = asyncio.Queue(SYNC_STREAM_BUFFER)
+    _request_streams[request_id] = queue
+    return queue
+
+
+def close_request_stream(request_id: str) -> None:
+    """
+    Unregister the stream of a request, if any, and drop the payloads not read yet
+    """
+    queue = _request_streams.pop(request_id, None)
+    while queue is not None and not queue.empty():
+        queue.get_nowait()
+
+
+async def stream_request(
+    qi: "QueryInfo", request: "Request", timeout: float = SYNC_REQUEST_TIMEOUT
+) -> AsyncGenerator[dict, None]:
+    """
+    Yield the payloads of a synchronous request as Request.respond produces them,
+    instead of merging them into its buffer, until the request completes.
+    The stream is registered here unless open_request_stream was called before.
+    Request.send_sync never waits for the client: when SYNC_STREAM_BUFFER payloads
+    are not consumed yet, the stream ends with a failure and the request is stopped.
+    Close the generator (e.g. with contextlib.aclosing) when the client goes away:
+    the stream is then unregistered and drained, and the payloads still produced
+    for it are dropped
+    """
+    queue = _request_streams.get(request.id)
+    if queue is None:
+        queue = open_request_stream(request.id)
+    done = asyncio.ensure_future(wait_for_request(qi, request, timeout))
+    try:
+        while not done.done():
+            get = asyncio.ensure_future(queue.get())
+            await asyncio.wait((get, done), return_when=asyncio.FIRST_COMPLETED)
+            if not get.done():
+                get.cancel()
+                continue
+            yield get.result()
+            if _request_streams.get(request.id) is not queue and queue.empty():
+                # closed by Request.send_sync: the client did not keep up
+                return
+        while not queue.empty():
+            yield queue.get_nowait()
+    finally:
+        close_request_stream(request.id)
+        # stops the request if the client went away
+        done.cancel()
+        await asyncio.gather(done, return_exceptions=True)
+
+
 def _merge_results(exisitng: dict, incoming: dict):
     for k in incoming:
         if isinstance(exisitng.get(k), dict):
@@ -77,11 +225,17 @@ class Request:
     Received POST requests
     """
 
-    def __init__(self, connection: RedisConnection, request: dict = {}):
+    def __init__(
+        self,
+        connection: RedisConnection,
+        request: dict = {},
+        snapshot: RedisSnapshot | None = None,
+    ):
         self._connection = connection
         request = cast(dict, request)
         id: str = str(request.get("id") or f"request::{uuid4()}")
-        redis_request = RedisDict(connection, id)
+        proxies: RedisConnection | RedisSnapshot = snapshot or connection
+        redis_request = RedisDict(proxies, id)
         self._redis_request = redis_request
 
         if "hash" in redis_request:
@@ -106,7 +260,7 @@ class Request:
         self.room: str = cast(str, redis_request.get("room", ""))
         languages: RedisList = cast(
             RedisList,
-            redis_request.get("languages", RedisList(connection, f"{id}:languages")),
+            redis_request.get("languages", RedisList(proxies, f"{id}:languages")),
         )
         self.languages: RedisList = languages
         self.query: str = cast(str, redis_request.get("query", ""))
@@ -118,15 +272,18 @@ class Request:
         # job1: [200,400,30] --> sent lines 200 through 400, need 30 segments
         self.lines_batch: RedisDict = cast(
             RedisDict,
-            redis_request.get(
-                "lines_batch", RedisDict(connection, f"{id}:lines_batch")
-            ),
+            redis_request.get("lines_batch", RedisDict(proxies, f"{id}:lines_batch")),
         )
         # keep track of which hashes were already sent ({hash: 1, hash: 0})
         self.sent_hashes: RedisDict = cast(
+            RedisDict,
+            redis_request.get("sent_hashes", RedisDict(proxies, f"{id}:sent_hashes")),
+        )
+        # batches whose lines were sent before the query on them completed ({hash: 1})
+        self.partial_hashes: RedisDict = cast(
             RedisDict,
             redis_request.get(
-                "sent_hashes", RedisDict(connection, f"{id}:sent_hashes")
+                "partial_hashes", RedisDict(proxies, f"{id}:partial_hashes")
             ),
         )
         # {hash: {N: M}}
@@ -134,7 +291,7 @@ class Request:
             RedisDict,
             redis_request.get(
                 "segment_lines_for_hash",
-                RedisDict(connection, f"{id}:segment_lines_for_hash"),
+                RedisDict(proxies, f"{id}:segment_lines_for_hash"),
             ),
         )
 
@@ -251,7 +408,28 @@ class Request:
         offset_and_lines_for_req = (offset_for_req, lines_for_req)
         return offset_and_lines_for_req
 
+    @retry_on_conflict
     def get_payload(self, qi: "QueryInfo", batch_name: str = "") -> dict:
+        with qi.snapshot(), self.through(qi):
+            return self._get_payload(qi, batch_name)
+
+    @contextmanager
+    def through(self, qi: "QueryInfo") -> Iterator["Request"]:
+        """
+        Read and write the request through the snapshot of the QueryInfo, if any,
+        so that it agrees with the requests the QueryInfo reads from its snapshot
+        """
+        live = self._redis_request
+        if qi._snapshot is None:
+            yield self
+            return
+        self._redis_request = RedisDict(qi._snapshot, live._redis_key)
+        try:
+            yield self
+        finally:
+            self._redis_request = live
+
+    def _get_payload(self, qi: "QueryInfo", batch_name: str = "") -> dict:
         ret: dict = {
             "job": qi.hash,
             "user": self.user,
@@ -282,9 +460,12 @@ class Request:
         len_all_batches = len(qi.all_batches)
         ret["batches_done"] = f"{len_done_batches}/{len_all_batches}"
         ret["percentage_done"] = 100.0 * len_done_batches / len_all_batches
-        ret["projected_results"] = int(
-            100 * (ret["total_results_so_far"] / (ret["percentage_words_done"] or 100))
+        ret["projected_results"] = max(
+            ret["total_results_so_far"], int(qi.hit_rate(done_batches) * total_words)
         )
+        if any(name in qi.truncated_batches for name, _ in done_batches):
+            # the batches ran with a row budget: there are more lines than counted
+            ret["truncated"] = True
         batch_hash, _ = qi.query_batches.get(batch_name) or [None, None]
         if (
             batch_hash
@@ -296,6 +477,10 @@ class Request:
             ret["percentage_words_done"] = 100.0
             ret["batches_done"] = len(qi.query_batches)
             ret["status"] = "finished"
+        if not self.full:
+            # where the next page starts (see Cursor)
+            cursor = Cursor.at(qi, self.offset + self.lines_sent_so_far)
+            ret["cursor"] = cursor.encode() if cursor else None
         return ret
 
     async def send_segments(
@@ -316,10 +501,9 @@ class Request:
             if seg_hash in self.sent_hashes:
                 continue
             seg_lines: dict[int, int] = self.segment_lines_for_hash[seg_hash].to_dict()  # type: ignore
-            all_lines = qi.get_from_cache(seg_hash)
-            seg_res: list = [
-                line for nline, line in enumerate(all_lines) if str(nline) in seg_lines
-            ]
+            seg_res: list = qi.rows_from_cache(
+                seg_hash, positions=sorted(int(nline) for nline in seg_lines)
+            )
             # prep_seg_lines = [line for rtype, *line in seg_res if rtype == -1]
             prep_seg_lines = {
                 sid: line for rtype, (sid, *line) in seg_res if rtype == -1
@@ -359,8 +543,7 @@ class Request:
             export = app["exporters"][xp_format].export
             qi.enqueue(export, self.id, self.hash, payload)
         elif self.synchronous:
-            req_buffer = app["query_buffers"][self.id]
-            _merge_results(req_buffer, results)
+            await self.send_sync(app, results, payload)
         else:
             await push_msg(
                 app["websockets"],
@@ -378,7 +561,13 @@ class Request:
         """
         print(f"[{self.id}] send query {batch_name}")
         batch_hash, _ = qi.query_batches[batch_name]
+        is_partial = batch_name not in qi.done_batches
         if batch_hash in self.sent_hashes:
+            if batch_hash in self.partial_hashes and not is_partial:
+                # the lines were sent while the batch was streaming: only send the update
+                self.partial_hashes.pop(batch_hash, None)
+                await self.send_batch_update(app, qi, batch_name)
+                return
             if len(qi.query_batches) > len(self.sent_hashes) and all(
                 bh == batch_hash for (bh, _) in qi.query_batches.values()
             ):
@@ -394,62 +583,80 @@ class Request:
                 )
             # If some lines were already sent for this job
             return
-        batch_res: list = qi.get_from_cache(batch_hash)
         offset_this_batch, lines_this_batch = self.lines_for_batch(qi, batch_name)
+        is_full = True if self.full else False
+        kwic_keys = [str(k) for k in qi.kwic_keys]
+        index = None if is_partial else qi.kwic_index(batch_hash)
+        # only deserialize the kwic lines that this request needs
+        kwic_res: list
         n_seg_ids: int = 0
-        if lines_this_batch > 0 and qi.kwic_keys:
-            n_seg_ids = len(
-                qi.segment_ids_in_results(
-                    batch_res,
+        if index is not None:
+            kwic_res = qi.rows_from_cache(
+                batch_hash,
+                positions=(
+                    index.rows()
+                    if is_full
+                    else index.rows(
+                        offset_this_batch, offset_this_batch + lines_this_batch
+                    )
+                ),
+            )
+            if lines_this_batch > 0 and kwic_keys:
+                n_seg_ids = index.count_segments(
+                    offset_this_batch, offset_this_batch + lines_this_batch
+                )
+        else:
+            kwic_res = (
+                qi.rows_from_cache(batch_hash, kwic_keys)
+                if is_full
+                else qi.rows_from_cache(
+                    batch_hash,
+                    kwic_keys,
                     offset_this_batch,
                     offset_this_batch + lines_this_batch,
                 )
             )
+            if lines_this_batch > 0 and kwic_keys:
+                seg_offset = offset_this_batch if is_full else 0
+                n_seg_ids = len(
+                    qi.segment_ids_in_results(
+                        kwic_res, seg_offset, seg_offset + lines_this_batch
+                    )
+                )
         self.lines_batch[batch_hash] = [offset_this_batch, lines_this_batch, n_seg_ids]
         _, results = qi.get_stats_results()  # fetch any stats results first
-        is_full = True if self.full else False
-        lines_so_far = -1
-        kwic_keys = [str(k) for k in qi.kwic_keys]
-        for k, v in batch_res:
-            sk = str(k)
-            if sk not in kwic_keys:
-                continue
-            if sk not in results:
-                results[sk] = []
-            lines_so_far += 1
-            if not is_full and lines_so_far < offset_this_batch:
-                continue
-            if not is_full and lines_so_far >= offset_this_batch + lines_this_batch:
-                continue
-            results[sk].append(v)
+        if kwic_keys and qi.get_lines_batch(batch_name)[1] > 0:
+            for sk in kwic_keys:
+                results.setdefault(sk, [])
+        for k, v in kwic_res:
+            results[str(k)].append(v)
         self.sent_hashes[batch_hash] = len(results)
+        if is_partial:
+            self.partial_hashes[batch_hash] = 1
         results["0"] = {
             "result_sets": qi.result_sets,
             "meta_labels": qi.meta_labels,
         }
+        if bounds := qi.stats.bounds():
+            results["0"]["approximate"] = bounds
         for k in results["0"]:
             if isinstance(results["0"][k], RedisList):
                 results["0"][k] = results["0"][k].to_list()
             if isinstance(results["0"][k], RedisDict):
                 results["0"][k] = results["0"][k].to_dict()
-        try:
-            stats_key = f"{qi.hash}::stats"
-            _, stats_res = qi.get_from_cache(stats_key)
-            results.update(stats_res)
-        except:
-            pass
+        results.update(qi.stats_results())
         payload = self.get_payload(qi, batch_name)
         payload.update({"action": "query_result", "result": results})
         more_in_batch = (
             offset_this_batch + lines_this_batch < qi.get_lines_batch(batch_name)[1]
         )
-        payload["more_data_available"] = more_in_batch
+        payload["more_data_available"] = more_in_batch or is_partial
         to_msg = (
             "to sync request"
             if self.synchronous
             else f"to user '{self.user}' room '{self.room}'"
         )
-        actual_nlines = lines_so_far + 1 - offset_this_batch
+        actual_nlines = len(kwic_res)
         print(
             f"[{self.id}] Sending {actual_nlines} results lines for batch {batch_name} ({batch_hash}; QI {qi.hash}) {to_msg}"
         )
@@ -458,8 +665,7 @@ class Request:
             export = app["exporters"][xp_format].export
             qi.enqueue(export, self.id, self.hash, payload)
         elif self.synchronous:
-            req_buffer = app["query_buffers"][self.id]
-            _merge_results(req_buffer, results)
+            await self.send_sync(app, results, payload)
         else:
             await push_msg(
                 app["websockets"],
@@ -470,6 +676,57 @@ class Request:
             )
         print(f"[{self.id}] sent {actual_nlines} results lines for batch {batch_name}")
 
+    async def send_batch_update(
+        self, app: web.Application, qi: "QueryInfo", batch_name: str
+    ):
+        """
+        Send the stats and counts of a batch whose lines were sent while it was streaming
+        """
+        results: dict[str, Any] = qi.stats_results()
+        print(f"[{self.id}] Sending update for streamed batch {batch_name}")
+        payload = self.get_payload(qi, batch_name)
+        if bounds := qi.stats.bounds():
+            results["0"] = {"approximate": bounds}
+        payload.update({"action": "query_result", "result": results})
+        offset_this_batch, lines_this_batch = self.lines_for_batch(qi, batch_name)
+        payload["more_data_available"] = (
+            offset_this_batch + lines_this_batch < qi.get_lines_batch(batch_name)[1]
+        )
+        if self.synchronous:
+            await self.send_sync(app, results, payload)
+            return
+        await push_msg(
+            app["websockets"],
+            self.room,
+            cast(JSONObject, payload),
+            skip=None,
+            just=(self.room, self.user),
+        )
+
+    async def send_sync(self, app: web.Application, results: dict, payload: dict):
+        """
+        Pass the payload on if the request is streamed by this process (see
+        stream_request), otherwise merge the results into the request's buffer.
+        This runs in a handler of the MessageDispatcher, shared with other
+        queries: a stream that is full is closed rather than waited for
+        """
+        stream = _request_streams.get(self.id)
+        buffers: dict[str, dict] = app.get("query_buffers") or {}
+        if stream is not None:
+            try:
+                stream.put_nowait(payload)
+            except asyncio.QueueFull:
+                print(f"[{self.id}] Closing the stream of a client that fell behind")
+                close_request_stream(self.id)
+                error = "The client did not read the results fast enough"
+                stream.put_nowait(
+                    {"action": "failed", "status": "failed", "error": error}
+                )
+        elif self.id in buffers:
+            _merge_results(buffers[self.id], results)
+            if payload.get("cursor"):
+                buffers[self.id]["cursor"] = payload["cursor"]
+
     async def error(
         self, app: web.Application, qi: "QueryInfo", error: str = "unknown"
     ):
@@ -486,11 +743,8 @@ class Request:
                 message=error,
             )
         if self.synchronous:
-            try:
-                req_buffer = app["query_buffers"][self.id]
-                req_buffer["error"] = error
-            except:
-                pass
+            failed = {"action": "failed", "status": "failed", "error": error}
+            await self.send_sync(app, {"error": error}, failed)
         else:
             payload = {
                 "status": "failed",
@@ -552,6 +806,10 @@ class QueryInfo:
         local_queries: dict = {},
     ):
         self._connection = connection
+        self._snapshot: RedisSnapshot | None = None
+        self._selectivity: SelectivityModel | None = None
+        self._kwic_lookups: dict[str, tuple[int | None, bool]] | None = None
+        self._stats: StatsStore | None = None
         self.hash = qhash
         qi = self.qi
         self._json_query = qi.setdefault("json_query", json.dumps(json_query) or "")
@@ -597,6 +855,7 @@ class QueryInfo:
         on_success: Callback | None = (
             Callback(callback, QUERY_TIMEOUT) if callback else None
         )
+        self.flush_snapshot()
         j = q.enqueue(
             method,
             on_success=on_success,
@@ -612,13 +871,51 @@ class QueryInfo:
         return j
 
     def set_cache(self, key: str, data: Any):
-        self._connection.set(key, json.dumps(data, cls=CustomEncoder))
-        self._connection.expire(key, QUERY_TTL)
+        self._connection.set(key, encode_results(data), ex=QUERY_TTL)
+
+    def _cached_chunks(self, key: str) -> list[bytes]:
+        """
+        Return the serialized entry for key, as a list of chunks if it was streamed;
+        fall back on the chunks received so far if the query is still streaming
+        """
+        kind: bytes = cast(bytes, self._connection.type(key))
+        if kind == b"string":
+            self._connection.expire(key, QUERY_TTL)
+            return [cast(bytes, self._connection.get(key))]
+        if kind == b"list":
+            self._connection.expire(key, QUERY_TTL)
+            return cast(list[bytes], self._connection.lrange(key, 0, -1))
+        chunks = cast(
+            list[bytes], self._connection.lrange(f"{key}{STREAMING_SUFFIX}", 0, -1)
+        )
+        if not chunks:
+            raise KeyError(key)
+        return chunks
 
     def get_from_cache(self, key: str) -> list:
-        res_json: str = cast(str, self._connection.get(key))
-        self._connection.expire(key, QUERY_TTL)
-        return cast(list, json.loads(res_json))
+        return cast(list, decode_results(self._cached_chunks(key)))
+
+    def in_cache(self, key: str) -> bool:
+        """
+        Check whether the key is in the cache without deserializing it
+        """
+        return bool(self._connection.expire(key, QUERY_TTL))
+
+    def rows_from_cache(
+        self,
+        key: str,
+        rtypes: list[int] | list[str] | None = None,
+        offset: int = 0,
+        upper: int | None = None,
+        positions: list[int] | None = None,
+    ) -> list:
+        """
+        Only deserialize the cached [rtype, row] pairs at the given positions,
+        or those in offset:upper among the rows of the given rtypes
+        """
+        chunks = self._cached_chunks(key)
+        int_rtypes = None if rtypes is None else [int(r) for r in rtypes]
+        return slice_results(chunks, int_rtypes, offset, upper, positions)
 
     async def query(self, qhash: str, script: str, params: dict = {}) -> Any:
         """
@@ -628,6 +925,61 @@ class QueryInfo:
         self.set_cache(qhash, res)
         return res
 
+    async def query_stream(
+        self, qhash: str, script: str, batch_name: str, params: dict = {}
+    ) -> dict[str, int]:
+        """
+        Like query, but append the results to the cache chunk by chunk as they come
+        and publish the batch as soon as it has the kwic lines needed by the requests.
+        Return the number of lines for each kwic key
+        """
+        streaming_key = f"{qhash}{STREAMING_SUFFIX}"
+        self._connection.delete(qhash, streaming_key)
+        kwic_keys = [str(k) for k in self.kwic_keys]
+        lines_before, _ = self.get_lines_batch(batch_name)
+        needed = self.required - lines_before
+        published = (
+            self.full
+            or batch_name in self.speculative_batches
+            or needed <= 0
+            or not kwic_keys
+            or any(r.to_export for r in self.requests)
+        )
+        n_res = 0
+        counts: dict[str, int] = {k: 0 for k in kwic_keys}
+        index = KwicIndexBuilder(self.kwic_lookups())
+
+        async def on_chunk(rows: list[tuple[Any, ...]]) -> None:
+            nonlocal n_res, published
+            pipe = self._connection.pipeline(transaction=False)
+            pipe.rpush(streaming_key, encode_results(rows))
+            pipe.expire(streaming_key, QUERY_TTL)
+            pipe.execute()
+            index.add(rows)
+            for r, *_ in rows:
+                if str(r) in counts:
+                    counts[str(r)] += 1
+                    n_res += 1
+            if published or n_res < needed:
+                return
+            published = True
+            print(f"Publishing {n_res} lines of {batch_name} while streaming")
+            self.query_batches[batch_name] = (qhash, n_res)
+            self.publish(batch_name, "main")
+
+        await _db_query(
+            script,
+            params=params,
+            on_chunk=on_chunk,
+            chunk_size=QUERY_STREAM_CHUNK_SIZE,
+        )
+        if self._connection.exists(streaming_key):
+            self._connection.rename(streaming_key, qhash)
+        else:
+            self.set_cache(qhash, [])
+        self.set_kwic_index(qhash, index.finish())
+        return counts
+
     def publish(self, batch_name: str, typ: str, custom_payload: dict[str, Any] = {}):
         """
         Notify the app that results are available
@@ -645,6 +997,7 @@ class QueryInfo:
                 payload.pop(k, None)
                 continue
             payload[k] = v
+        self.flush_snapshot()
         _publish_msg(
             self._connection,
             payload,
@@ -660,6 +1013,29 @@ class QueryInfo:
         )
         return batch_name
 
+    def kwic_lookups(self) -> dict[str, tuple[int | None, bool]]:
+        """
+        For each kwic key, the index of the char range in its hits (if any)
+        and whether it needs to be widened by 2 chars (segment contexts)
+        """
+        if self._kwic_lookups is not None:
+            return self._kwic_lookups
+        segment = self.config["firstClass"]["segment"]
+        lookups: dict[str, tuple[int | None, bool]] = {}
+        for n, rs in enumerate(self.result_sets, start=1):
+            if rs.get("type") != "plain":
+                continue
+            attributes = rs.get("attributes", [])
+            char_ranges = next(
+                (n for n, y in enumerate(attributes) if y.get("name") == "char_ranges"),
+                None,
+            )
+            ctx = next((y for y in attributes if y.get("name") == "identifier"), None)
+            widen = bool(char_ranges and ctx and ctx.get("layer") == segment)
+            lookups[str(n)] = (char_ranges, widen)
+        self._kwic_lookups = lookups
+        return lookups
+
     def segment_ids_in_results(
         self,
         results: list,
@@ -670,34 +1046,12 @@ class QueryInfo:
         Return the unique segment IDs listed in the results for the provided offset+upper.
         If the hits include a char_range for the context, it will be the value, else 1
         """
-        config = self.config
-        if isinstance(config, RedisDict):
-            config = config.to_dict()
-        kwic_keys: list[str] = self.kwic_keys
-        result_sets = self.result_sets
-        char_ranges: list[int | None] = [
-            next(
-                (
-                    n
-                    for n, y in enumerate(x.get("attributes", []))
-                    if y.get("name") == "char_ranges"
-                ),
-                None,
-            )
-            for x in result_sets
-        ]
-        contexts = [
-            next(
-                (y for y in x.get("attributes", []) if y.get("name") == "identifier"),
-                None,
-            )
-            for x in result_sets
-        ]
+        lookups = self.kwic_lookups()
         counter = -1
         segment_ids: dict[str, int | list[int]] = {}
         for key, hit in results:
             sid, *_ = hit
-            if str(key) not in kwic_keys:
+            if str(key) not in lookups:
                 continue
             counter += 1
             if counter < offset:
@@ -705,14 +1059,46 @@ class QueryInfo:
             if upper is not None and counter >= upper:
                 break
             v: int | list[int] = 1
-            if char_ranges[key - 1]:
-                v = cast(list[int], hit[char_ranges[key - 1]])
-                ctx = contexts[key - 1]
-                if ctx and ctx.get("layer") == config["firstClass"]["segment"]:
+            char_ranges, widen = lookups[str(key)]
+            if char_ranges:
+                v = cast(list[int], hit[char_ranges])
+                if widen:
                     v = [v[0] - 2, v[1] + 2]
             segment_ids[str(sid)] = v
         return segment_ids
 
+    def kwic_index(self, batch_hash: str) -> KwicIndex | None:
+        """
+        The index of the kwic lines of a completed batch, if it was built
+        """
+        key = f"{batch_hash}{KWIC_INDEX_SUFFIX}"
+        raw = cast(bytes | None, self._connection.get(key))
+        if raw is None:
+            return None
+        self._connection.expire(key, QUERY_TTL)
+        return KwicIndex.from_bytes(raw)
+
+    def set_kwic_index(self, batch_hash: str, index: KwicIndex) -> None:
+        key = f"{batch_hash}{KWIC_INDEX_SUFFIX}"
+        self._connection.set(key, index.to_bytes(), ex=QUERY_TTL)
+
+    def segment_ranges(self, key: str) -> np.ndarray | None:
+        """
+        The char ranges of the lines of a segment query, as an (n, 2) array
+        """
+        ranges_key = f"{key}{CHAR_RANGES_SUFFIX}"
+        raw = cast(bytes | None, self._connection.get(ranges_key))
+        if raw is None:
+            return None
+        self._connection.expire(ranges_key, QUERY_TTL)
+        return ranges_from_bytes(raw)
+
+    def set_segment_ranges(self, key: str, lines: list) -> np.ndarray:
+        ranges = line_ranges(lines)
+        ranges_key = f"{key}{CHAR_RANGES_SUFFIX}"
+        self._connection.set(ranges_key, ranges_to_bytes(ranges), ex=QUERY_TTL)
+        return ranges
+
     # Getters and setters to keep in sync with redis
     @property
     def enqueued_jobs(self) -> dict[str, int]:
@@ -753,6 +1139,33 @@ class QueryInfo:
         for k, v in value.items():
             self.qi["done_batches"][k] = v
 
+    @property
+    def truncated_batches(self) -> dict[str, int]:
+        """
+        Map the batches that ran with a row budget which was reached to that budget
+        """
+        if "truncated_batches" not in self.qi:
+            self.qi["truncated_batches"] = {}
+        return cast(dict[str, int], self.qi["truncated_batches"])
+
+    @property
+    def speculative_batches(self) -> dict[str, int]:
+        """
+        Batches scheduled speculatively and not committed yet, in scheduling order
+        """
+        if "speculative_batches" not in self.qi:
+            self.qi["speculative_batches"] = {}
+        return cast(dict[str, int], self.qi["speculative_batches"])
+
+    @property
+    def pending_batches(self) -> dict[str, list]:
+        """
+        Map speculative batches that completed to [batch_hash, n_kwic_lines, n_words]
+        """
+        if "pending_batches" not in self.qi:
+            self.qi["pending_batches"] = {}
+        return cast(dict[str, list], self.qi["pending_batches"])
+
     @property
     def query_batches(self) -> dict:
         """
@@ -803,6 +1216,11 @@ class QueryInfo:
         if idx < 0:
             return
         self.qi["requests"].pop(idx)
+        if not _request_done(request.id) and getattr(request, "synchronous", False):
+            # the request may be awaited by another process (see wait_for_request)
+            notification = {"action": REQUEST_DONE_ACTION, "request": request.id}
+            self.flush_snapshot()
+            _notify(self._connection, json.dumps(notification))
 
     def stop_request(self, request: Request):
         """
@@ -817,7 +1235,7 @@ class QueryInfo:
                 job = Job.fetch(jid, self._connection)
                 if job.is_started or job.is_scheduled or job.is_queued:
                     job.cancel()
-                    send_stop_job_command(self._connection, jid)
+                    _stop_job(self._connection, job)
                     self.enqueued_jobs.pop(jid, "")
             except:
                 self.enqueued_jobs.pop(jid, "")
@@ -865,8 +1283,11 @@ class QueryInfo:
         available (so more results go to the frontend faster).
         """
         first_batch = self.all_batches[0]
+        if not previous_batch and len(self.done_batches) > 0:
+            # replay the batches in the order in which they were run
+            return next([b, n] for b, n in self.done_batches.items())
         if not previous_batch or len(self.done_batches) == 0:
-            return first_batch
+            return self._predicted_first_batch() or first_batch
 
         # return the batch after 'previous' in done_batches if it's in there
         list_done_batches = [[b, n] for b, n in self.done_batches.items()]
@@ -884,31 +1305,192 @@ class QueryInfo:
         buffer = 0.1  # set to zero for picking smaller batches
         while len(self.done_batches) < len(self.all_batches):
             so_far = self.total_results_so_far
-            # set here ensures we don't double count, even though it should not happen
-            total_words_processed_so_far = (
-                sum([int(x) for x in self.done_batches.values()]) or 1
-            )
-            proportion_that_matches = so_far / total_words_processed_so_far
+            # truncated batches only hold the lines that were required from them
+            proportion_that_matches = self.hit_rate()
             first_not_done: list[str | int] | None = None
             for batch in self.all_batches:
                 batch_name = batch[0]
                 if batch_name in self.done_batches:
                     continue
+                if batch_name in self.speculative_batches:
+                    continue
                 if self.full:
                     return batch
                 if not first_not_done:
                     first_not_done = batch
-                expected = cast(int, batch[-1]) * proportion_that_matches
+                expected = self.expected_hits(batch, so_far, proportion_that_matches)
                 if float(expected) >= float(self.required + (self.required * buffer)):
                     return batch
             return cast(list, first_not_done)
 
         return []
 
+    def expected_hits(self, batch: list, so_far: int, proportion: float) -> float:
+        """
+        Predict the number of hits of the batch, given the hits so far
+        and the proportion of words that matched in the done batches
+        """
+        model = self.selectivity
+        batch_name, words = cast(str, batch[0]), cast(int, batch[-1])
+        exact = model.exact_hits(batch_name)
+        if exact is not None:
+            # the same query already ran on this batch before
+            return exact
+        if so_far == 0 and (prediction := model.predict(batch_name, words)):
+            # no hit so far: rely on what the same query shape usually yields
+            return prediction[0]
+        return words * proportion
+
+    def speculation_saturated(self) -> bool:
+        """
+        Whether as many batches as allowed are already running speculatively
+        """
+        return 0 < QUERY_SPECULATIVE_BATCHES <= len(self.speculative_batches)
+
+    def speculative_plan(self, next_batch: list) -> list[list]:
+        """
+        Return the batches to run along with next_batch when it is not predicted
+        to yield the required number of lines on its own
+        """
+        if QUERY_SPECULATIVE_BATCHES <= 1 or self.full:
+            return []
+        room = QUERY_SPECULATIVE_BATCHES - len(self.speculative_batches) - 1
+        so_far = self.total_results_so_far
+        proportion = self.hit_rate()
+        missing = self.required - so_far
+        expected = self.expected_hits(next_batch, so_far, proportion)
+        extra: list[list] = []
+        for batch in self.all_batches:
+            if expected >= missing or len(extra) >= room:
+                break
+            batch_name = batch[0]
+            if batch_name == next_batch[0] or batch_name in self.done_batches:
+                continue
+            if batch_name in self.speculative_batches:
+                continue
+            extra.append(batch)
+            expected += self.expected_hits(batch, so_far, proportion)
+        return extra
+
+    def commit_speculative(self) -> list[str]:
+        """
+        Register the completed speculative batches whose predecessors all completed,
+        in the order in which they were scheduled, and return their names
+        """
+        committed: list[str] = []
+        with self._connection.lock(f"{self.hash}::commit", timeout=QUERY_TIMEOUT):
+            for batch_name in self.speculative_batches:
+                pending = self.pending_batches.get(batch_name)
+                if not pending:
+                    break
+                batch_hash, n_res, batch_n = pending
+                self.query_batches[batch_name] = (batch_hash, n_res)
+                if batch_name not in self.done_batches:
+                    self.done_batches[batch_name] = batch_n
+                self.pending_batches.pop(batch_name, None)
+                self.speculative_batches.pop(batch_name, None)
+                committed.append(batch_name)
+        return committed
+
+    def cancel_speculative(self) -> None:
+        """
+        Stop the speculative batches that are no longer needed
+        """
+        surplus = [b for b in self.speculative_batches]
+        if not surplus:
+            return
+        for jid in [jid for jid in self.enqueued_jobs]:
+            try:
+                job = Job.fetch(jid, self._connection)
+                if not job.func_name.endswith("do_batch"):
+                    continue
+                if job.args[1][0] not in surplus:
+                    continue
+                if job.is_started or job.is_scheduled or job.is_queued:
+                    print(f"Cancelling speculative batch {job.args[1][0]}")
+                    job.cancel()
+                    _stop_job(self._connection, job)
+                self.enqueued_jobs.pop(jid, "")
+            except:
+                self.enqueued_jobs.pop(jid, "")
+        for batch_name in surplus:
+            self.speculative_batches.pop(batch_name, None)
+            self.pending_batches.pop(batch_name, None)
+
+    def _predicted_first_batch(self) -> list | None:
+        """
+        Before any batch ran, pick the fastest batch predicted to yield enough hits
+        based on previous queries on the corpus; None if there is no such batch
+        """
+        if self.full:
+            return None
+        model = self.selectivity
+        if not model.known:
+            return None
+        buffer = 0.1
+        needed = self.required + (self.required * buffer)
+        best: tuple[float, list] | None = None
+        for batch in self.all_batches:
+            prediction = model.predict(cast(str, batch[0]), cast(int, batch[-1]))
+            if prediction is None:
+                return None
+            hits, runtime = prediction
+            if hits < needed:
+                continue
+            if best is None or runtime < best[0]:
+                best = (runtime, batch)
+        return best[1] if best else None
+
+    @property
+    def selectivity(self) -> SelectivityModel:
+        if self._selectivity is None:
+            self._selectivity = SelectivityModel(
+                self._connection,
+                str(self.config.get("schema_path", "")),
+                self.json_query,
+            )
+        return self._selectivity
+
+    @contextmanager
+    def snapshot(self) -> Iterator["QueryInfo"]:
+        """
+        Read the QueryInfo and its requests from a local snapshot, loaded with
+        a few pipelined calls, and write back the changes in one transaction
+        (see RedisSnapshot.flush). The changes are also written before a job is
+        enqueued or a message sent, so that they are seen by whoever handles it.
+        Writing them raises SnapshotConflict if another process changed the same
+        values: the callers run again with retry_on_conflict. The changes left
+        when the body raises are discarded.
+
+        A Request that was not obtained from qi.requests reads and writes the
+        snapshot within Request.through
+        """
+        if self._snapshot is not None:
+            yield self
+            return
+        qi_key = f"query_info::{self.hash}"
+        snapshot = RedisSnapshot(self._connection).load(qi_key)
+        rids = RedisDict(snapshot, qi_key).get("requests") or []
+        snapshot.load(*[str(rid) for rid in rids])
+        self._snapshot = snapshot
+        try:
+            yield self
+        finally:
+            self._snapshot = None
+        snapshot.flush()
+
+    def flush_snapshot(self) -> None:
+        """
+        Write the changes buffered by the current snapshot, if any
+        """
+        if self._snapshot is not None:
+            self._snapshot.flush()
+
     # Pseudo-attributes (no need to keep in sync)
     @property
     def qi(self) -> dict:
-        qi = cast(dict, RedisDict(self._connection, f"query_info::{self.hash}"))
+        proxies = self._snapshot or self._connection
+        qi = cast(dict, RedisDict(proxies, f"query_info::{self.hash}"))
         return qi
 
     @property
@@ -920,7 +1502,9 @@ class QueryInfo:
         reqs: list[Request] = []
         for rid in self.qi["requests"]:
             try:
-                reqs.append(Request(self._connection, {"id": rid}))
+                reqs.append(
+                    Request(self._connection, {"id": rid}, snapshot=self._snapshot)
+                )
             except:
                 # Do no create a Request object if the ID isn't in redis
                 pass
@@ -967,10 +1551,44 @@ class QueryInfo:
             max(r.offset + r.requested for r in self.requests) if self.requests else 0
         )
 
+    def row_budget(self, batch_name: str) -> int | None:
+        """
+        The max number of kwic lines to fetch from the batch, when all the result sets
+        are plain and no request is full; None if the batch needs to run entirely
+        """
+        if not KWIC_ROW_BUDGET or self.full or not self.kwic_keys or self.stats_keys:
+            return None
+        lines_before, _ = self.get_lines_batch(batch_name)
+        return max(1, self.required - lines_before)
+
+    def needs_rerun(self, batch_name: str) -> bool:
+        """
+        Whether a batch that ran with a row budget is missing lines that are now required
+        """
+        if batch_name not in self.truncated_batches:
+            return False
+        if self.full or self.stats_keys:
+            return True
+        lines_before, lines_batch = self.get_lines_batch(batch_name)
+        return self.required > lines_before + lines_batch
+
     @property
     def total_results_so_far(self) -> int:
         return sum(nlines for _, nlines in self.query_batches.values())
 
+    def hit_rate(self, batches: list[list] | None = None) -> float:
+        """
+        Proportion of words that matched in the given done batches (all by default),
+        leaving out the truncated ones unless there are only truncated batches
+        """
+        if batches is None:
+            batches = [[b, n] for b, n in self.done_batches.items()]
+        complete = [b for b in batches if b[0] not in self.truncated_batches]
+        counted = complete or batches
+        lines = sum(self.get_lines_batch(str(b[0]))[1] for b in counted)
+        words = sum(int(b[1]) for b in counted) or 1
+        return lines / words
+
     # methods called from worker
 
     async def run_aggregate(
@@ -979,57 +1597,47 @@ class QueryInfo:
         batch: list,
     ):
         """
-        Aggregate the stats results, or fetch from cache
+        Add the stats results of a batch to the running totals, unless already done
         """
         if not self.stats_keys:
             return
         batch_name: str = batch[0]
-        stats_key = f"{self.hash}::stats"
-        try:
-            stats_batches, stats_results = self.get_from_cache(stats_key)
-            if batch_name in stats_batches:
-                # No need to run aggregate: cache already has this batch
-                return
-        except:
-            stats_batches, stats_results = [], {}
-        new_stats_batches = [b for b in stats_batches] + [batch_name]
-        meta_json: dict = self.meta_json
-        post_processes: dict = self.post_processes
+        if batch_name in self.stats.batches():
+            # No need to run aggregate: the totals already include this batch
+            return
         batch_hash, _ = self.query_batches[batch_name]
-        res: list = self.get_from_cache(batch_hash)
-        # lines_so_far, n_res = self.get_lines_batch(batch_name)
-        # if n_res == 0 or lines_so_far + n_res < offset:
-        #     # Indicate we have processed this batch
-        #     self.set_cache(stats_key, [new_stats_batches, stats_results])
-        #     return
-        done_batches = cast(
-            list[Batch],
-            [
-                (1, self.config.get("schema_path", ""), b, n)  # dummy corpus id
-                for b, n in self.done_batches.items()
-            ],
-        )
-        _, to_send, _, _, _ = _aggregate_results(
-            res,
-            stats_results,
-            meta_json,
-            post_processes,
-            batch,
-            done_batches,
-        )
-        new_stats_results = {
-            k: v for k, v in to_send.items() if str(k) in self.stats_keys
-        }
-        self.set_cache(stats_key, [new_stats_batches, new_stats_results])
+        # the kwic lines are not needed here, only deserialize the stats rows
+        res: list = self.rows_from_cache(batch_hash, self.stats_keys)
+        self.stats.add_batch(batch_name, int(batch[1]), res)
         return
 
-    async def run_query_on_batch(self, batch) -> str:
+    @property
+    def stats(self) -> StatsStore:
+        if self._stats is None:
+            self._stats = StatsStore(self._connection, self.hash, self.result_sets)
+        return self._stats
+
+    def stats_results(self) -> dict[str, list]:
+        """
+        The stats result sets aggregated so far, filtered with the post processes
+        """
+        if not self.stats_keys:
+            return {}
+        post_processes = self.post_processes
+        if isinstance(post_processes, RedisDict):
+            post_processes = post_processes.to_dict()
+        return self.stats.results(post_processes)
+
+    async def run_query_on_batch(self, batch, budgeted: bool = True) -> str:
         """
         Send and run a SQL query againt the DB
         then update the QueryInfo and Request's accordingly
         and launch any required sentence/meta queries
         """
         batch_name, batch_n = batch
+        # the lines are ordered with or without a budget: a truncated batch re-run
+        # without one keeps the lines sent so far in place
+        row_budget: int | None = self.row_budget(batch_name) if budgeted else None
         config = self.config
         if isinstance(config, RedisDict):
             config = config.to_dict()
@@ -1042,12 +1650,37 @@ class QueryInfo:
             batch=batch_name,
             config=config,
             lang=self.languages[0] if self.languages else None,
+            connection=self._connection,
+            row_budget=row_budget,
         )
         batch_hash = hasher(sql_query)
-        res = await self.query(batch_hash, sql_query)
-        res = res if res else []
-        kwic_keys = [str(k) for k in self.kwic_keys]
-        n_res = sum(1 if str(r) in kwic_keys else 0 for r, *_ in res)
+        counts: dict[str, int]
+        start = time.monotonic()
+        if QUERY_STREAM_CHUNK_SIZE > 0:
+            counts = await self.query_stream(batch_hash, sql_query, batch_name)
+        else:
+            res = await self.query(batch_hash, sql_query)
+            res = res if res else []
+            counts = {str(k): 0 for k in self.kwic_keys}
+            for r, *_ in res:
+                if str(r) in counts:
+                    counts[str(r)] += 1
+            index = KwicIndexBuilder(self.kwic_lookups())
+            index.add(res)
+            self.set_kwic_index(batch_hash, index.finish())
+        n_res = sum(counts.values())
+        if row_budget and any(n >= row_budget for n in counts.values()):
+            # some lines were left out: the batch needs to run again for later pages
+            self.truncated_batches[batch_name] = row_budget
+        else:
+            self.truncated_batches.pop(batch_name, None)
+            self.selectivity.record(
+                batch_name, n_res, int(batch_n), time.monotonic() - start
+            )
+        if batch_name in self.speculative_batches:
+            # wait for the batches scheduled before this one to be committed first
+            self.pending_batches[batch_name] = [batch_hash, n_res, batch_n]
+            return batch_hash
         self.query_batches[batch_name] = (batch_hash, n_res)
         if batch_name not in self.done_batches:
             self.done_batches[batch_name] = batch_n
@@ -33,7 +33,6 @@ from typing import Any, final, cast
 from aiohttp import web
 from redis import Redis as RedisConnection
 from rq import Callback
-from rq.command import send_stop_job_command
 from rq.exceptions import InvalidJobOperation, NoSuchJobError
 from rq.job import Job
 
@@ -63,6 +62,7 @@ from .utils import (
     _get_all_attributes,
     _format_config_query,
     _set_config,
+    _stop_job,
     get_aligned_annotations,
     get_corpus_int_range,
     hasher,
@@ -880,12 +880,9 @@ class QueryService:
         Cancel a running job
         """
         if isinstance(job, str):
-            job_id = job
             job = Job.fetch(job, connection=self.app["redis"])
-        else:
-            job_id = job.id
         job.cancel()
-        send_stop_job_command(self.app["redis"], job_id)
+        _stop_job(self.app["redis"], job)
         if job not in self.app["canceled"]:
             self.app["canceled"].append(job)
         return job.get_status()
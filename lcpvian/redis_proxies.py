@@ -1,12 +1,289 @@
 import json
 
+from contextvars import ContextVar
+from functools import wraps
 from hashlib import md5
 from redis import Redis
-from typing import Any
+from redis.exceptions import WatchError
+from typing import Any, Callable, TypeVar
+
+R = TypeVar("R")
+
+SNAPSHOT_RETRIES = 3
+
+# Set while retry_on_conflict makes its last call: flush() then writes anyway
+_force_flush: ContextVar[bool] = ContextVar("force_flush", default=False)
+
+
+def _pointed_key(data: bytes | str | None) -> tuple[str, bool] | None:
+    """
+    Return the key (and whether it is a list) that a serialized proxy value points to
+    """
+    if data is None:
+        return None
+    try:
+        parsed: Any = json.loads(data)
+    except:
+        return None
+    if isinstance(parsed, dict) and parsed.get("key"):
+        return (str(parsed["key"]), False)
+    if isinstance(parsed, list) and parsed and isinstance(parsed[0], str):
+        return (parsed[0], True)
+    return None
+
+
+class SnapshotConflict(Exception):
+    """
+    Raised by RedisSnapshot.flush when other processes changed values that the
+    snapshot writes since it read them: none of its writes were sent
+    """
+
+    def __init__(self, keys: list[str]):
+        super().__init__(f"Keys changed concurrently: {', '.join(keys)}")
+        self.keys = keys
+
+
+def retry_on_conflict(func: Callable[..., R]) -> Callable[..., R]:
+    """
+    Run func again, so that it reads redis anew and re-applies its changes,
+    while the snapshots it writes conflict with other processes. The last run
+    writes its changes even if they conflict, rather than failing the query
+    """
+
+    @wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> R:
+        for _ in range(SNAPSHOT_RETRIES):
+            try:
+                return func(*args, **kwargs)
+            except SnapshotConflict as err:
+                print(f"Running {func.__name__} again: {err}")
+        token = _force_flush.set(True)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _force_flush.reset(token)
+
+    return wrapper
+
+
+class RedisSnapshot:
+    """
+    Stand-in for the redis client of RedisDict/RedisList that reads from a local
+    snapshot and buffers the writes until flush() sends them in one MULTI/EXEC.
+
+    The transaction is optimistic: the writes are only sent if the hash fields
+    and keys that they change still hold the values that the snapshot read, so
+    that concurrent writes to other fields of the same hash are no conflict.
+    Otherwise flush() raises SnapshotConflict, so that values computed from
+    stale reads never overwrite what was written since the load; the caller
+    runs again on a new snapshot (see retry_on_conflict).
+
+    load() fetches whole trees of proxies (hashes, lists, pointers) with one
+    pipeline per nesting level; keys that were not loaded are fetched on first access.
+    Only the commands used by the proxies are implemented.
+    """
+
+    def __init__(self, redis_client: Redis):
+        self._redis = redis_client
+        self._hashes: dict[str, dict[bytes, bytes]] = {}
+        self._strings: dict[str, bytes | None] = {}
+        self._writes: list[tuple[str, tuple]] = []
+        # value of each hash field before the snapshot first writes it
+        self._field_bases: dict[str, dict[bytes, bytes | None]] = {}
+        # value of each deleted or set key before the first write: a dict for hashes
+        self._bases: dict[str, dict[bytes, bytes] | bytes | None] = {}
+
+    def load(self, *keys: str) -> "RedisSnapshot":
+        """
+        Load the hashes at keys and everything they point to
+        """
+        hashes: list[str] = [k for k in keys if k and k not in self._hashes]
+        lists: list[str] = []  # list prefixes whose length is unknown
+        entries: list[tuple[str, int]] = []  # list prefixes of known length
+        while hashes or lists or entries:
+            pipe = self._redis.pipeline(transaction=False)
+            for h in hashes:
+                pipe.hgetall(h)
+                pipe.hgetall(f"{h}::pointers")
+            for l in lists:
+                pipe.get(f"{l}:length")
+                pipe.hgetall(f"{l}::pointers")
+            for l, n in entries:
+                pipe.mget([f"{l}:{i}" for i in range(n)])
+            res = pipe.execute()
+            pointed: list[bytes | None] = []
+            new_entries: list[tuple[str, int]] = []
+            for h in hashes:
+                self._hashes[h] = res.pop(0) or {}
+                self._hashes[f"{h}::pointers"] = res.pop(0) or {}
+                pointed += self._hashes[h].values()
+            for l in lists:
+                length: bytes | None = res.pop(0)
+                self._strings[f"{l}:length"] = length
+                self._hashes[f"{l}::pointers"] = res.pop(0) or {}
+                if length and int(length) > 0:
+                    new_entries.append((l, int(length)))
+            for l, n in entries:
+                values: list[bytes | None] = res.pop(0)
+                for i, v in enumerate(values):
+                    self._strings[f"{l}:{i}"] = v
+                pointed += values
+            hashes, lists, entries = [], [], new_entries
+            for data in pointed:
+                child = _pointed_key(data)
+                if not child:
+                    continue
+                key, is_list = child
+                if is_list and f"{key}:length" not in self._strings:
+                    self._strings[f"{key}:length"] = None  # placeholder
+                    lists.append(key)
+                elif not is_list and key not in self._hashes:
+                    self._hashes[key] = {}  # placeholder
+                    hashes.append(key)
+        return self
+
+    def flush(self) -> None:
+        """
+        Send the buffered writes in a single transaction, or raise SnapshotConflict
+        without sending any if a value written was changed since the snapshot read it
+        """
+        if not self._writes:
+            return
+        keys = sorted({*self._bases, *self._field_bases})
+        force = _force_flush.get()
+        pipe = self._redis.pipeline(transaction=True)
+        try:
+            while True:
+                try:
+                    # WATCH is per key: a write to another field only fails
+                    # the transaction, which compares the fields again
+                    pipe.watch(*keys)
+                    changed = self._changed()
+                    if changed and force:
+                        print(f"Overwriting concurrent changes to {', '.join(changed)}")
+                    if not changed or force:
+                        pipe.multi()
+                        for method, args in self._writes:
+                            getattr(pipe, method)(*args)
+                        pipe.execute()
+                    break
+                except WatchError:
+                    continue
+        finally:
+            pipe.reset()
+        self._writes = []
+        self._bases = {}
+        self._field_bases = {}
+        if changed and not force:
+            raise SnapshotConflict(changed)
+
+    def _changed(self) -> list[str]:
+        """
+        Return the keys with a written field or value that no longer holds what
+        the snapshot read (the keys are WATCHed: later changes fail the transaction)
+        """
+        pipe = self._redis.pipeline(transaction=False)
+        fields = sorted(self._field_bases.items())
+        for key, bases in fields:
+            pipe.hmget(key, list(bases))
+        wholes = sorted(self._bases.items())
+        for key, base in wholes:
+            if isinstance(base, dict):
+                pipe.hgetall(key)
+            else:
+                pipe.get(key)
+        current = pipe.execute()
+        changed = {
+            key
+            for (key, bases), values in zip(fields, current)
+            if list(bases.values()) != values
+        }
+        changed.update(
+            key
+            for (key, base), value in zip(wholes, current[len(fields) :])
+            if value != base
+        )
+        return sorted(changed)
+
+    def _field_base(self, key: str, field: bytes) -> None:
+        """
+        Record the value of the hash field before the snapshot first writes it
+        """
+        if key in self._bases:
+            return  # the whole key is compared
+        bases = self._field_bases.setdefault(key, {})
+        if field not in bases:
+            bases[field] = self._hash(key).get(field)
+
+    def _base(self, key: str) -> None:
+        """
+        Record the value of the key before the snapshot first deletes or sets it
+        """
+        if key in self._bases:
+            return
+        if key in self._hashes:
+            base = dict(self._hashes[key])
+            # undo the writes to single fields made so far
+            for field, value in self._field_bases.pop(key, {}).items():
+                if value is None:
+                    base.pop(field, None)
+                else:
+                    base[field] = value
+            self._bases[key] = base
+        else:
+            self._bases[key] = self.get(key)
+
+    def _hash(self, key: str) -> dict[bytes, bytes]:
+        if key not in self._hashes:
+            self._hashes[key] = self._redis.hgetall(key) or {}
+        return self._hashes[key]
+
+    @staticmethod
+    def _encode(value: Any) -> bytes:
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode("utf-8")
+
+    def hget(self, key: str, field: str) -> bytes | None:
+        return self._hash(key).get(self._encode(field))
+
+    def hkeys(self, key: str) -> list[bytes]:
+        return list(self._hash(key))
+
+    def hset(self, key: str, field: str, value: Any) -> None:
+        self._field_base(key, self._encode(field))
+        self._hash(key)[self._encode(field)] = self._encode(value)
+        self._writes.append(("hset", (key, field, value)))
+
+    def hdel(self, key: str, field: str) -> None:
+        self._field_base(key, self._encode(field))
+        self._hash(key).pop(self._encode(field), None)
+        self._writes.append(("hdel", (key, field)))
+
+    def get(self, key: str) -> bytes | None:
+        if key not in self._strings:
+            self._strings[key] = self._redis.get(key)
+        return self._strings[key]
+
+    def set(self, key: str, value: Any) -> None:
+        self._base(key)
+        self._strings[key] = self._encode(value)
+        self._writes.append(("set", (key, value)))
+
+    def exists(self, key: str) -> int:
+        if key in self._hashes:
+            return int(bool(self._hashes[key]))
+        return int(self.get(key) is not None)
+
+    def delete(self, key: str) -> None:
+        self._base(key)
+        self._hashes[key] = {}
+        self._strings[key] = None
+        self._writes.append(("delete", (key,)))
 
 
 class RedisDict(dict):
-    def __init__(self, redis_client: Redis, redis_key: str):
+    def __init__(self, redis_client: Redis | RedisSnapshot, redis_key: str):
         self._redis = redis_client
         self._redis_key = redis_key
 
@@ -152,12 +429,26 @@ class RedisDict(dict):
             return default
         return val
 
+    def pop(self, key: str, *default):
+        # The nested values are deleted with the key: return plain copies of them
+        if key not in self:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        val = self.__getattr__(key)
+        if isinstance(val, RedisDict):
+            val = val.to_dict()
+        elif isinstance(val, RedisList):
+            val = val.to_list()
+        self.__delattr__(key)
+        return val
+
     def items(self):
         return [(k, self.__getattr__(k)) for k in self.keys()]
 
 
 class RedisList(list):
-    def __init__(self, redis_client: Redis, redis_key_prefix: str):
+    def __init__(self, redis_client: Redis | RedisSnapshot, redis_key_prefix: str):
         self._redis = redis_client
         self._prefix = redis_key_prefix
         self._length_key: str = f"{self._prefix}:length"
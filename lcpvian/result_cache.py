@@ -0,0 +1,210 @@
+"""
+result_cache.py: codecs used to store query results in redis
+
+Batch results, segment results and the like are lists of [rtype, row] pairs,
+where rtype is the index of the result set (0 for the number of results,
+-1 and -2 for prepared segments and meta). The codec is picked with the
+QUERY_CACHE_CODEC env variable:
+
+* "json": the whole list serialized as one JSON string
+* "arrow": an Arrow IPC stream with one int16 column for the rtypes and one binary
+  column with each row serialized separately, so that a slice of the results
+  (e.g. 50 KWIC lines out of 500k) can be decoded without decoding everything
+
+Reading does not depend on the configured codec: the format is detected from
+the stored bytes, so cache entries written with another codec remain readable.
+Anything that is not a list of [rtype, row] pairs is always stored as JSON.
+
+Streamed queries store their results as a list of separately serialized chunks:
+the functions below accept either one serialized entry or a list of chunks.
+"""
+
+import json
+import os
+
+import numpy as np
+import pyarrow as pa
+
+from typing import Any, cast
+
+from .utils import CustomEncoder
+
+QUERY_CACHE_CODEC = os.getenv("QUERY_CACHE_CODEC", "arrow").strip().lower()
+
+
+def _is_rows(data: Any) -> bool:
+    return isinstance(data, (list, tuple)) and all(
+        isinstance(r, (list, tuple))
+        and len(r) == 2
+        and isinstance(r[0], int)
+        and not isinstance(r[0], bool)
+        for r in data
+    )
+
+
+class JSONCodec:
+    """
+    Serialize the rows as a single JSON string (no random access)
+    """
+
+    name = "json"
+    magic = b""
+
+    def encode(self, data: Any) -> bytes:
+        return json.dumps(data, cls=CustomEncoder).encode("utf-8")
+
+    def decode(self, raw: bytes) -> Any:
+        return json.loads(raw)
+
+    def take(
+        self,
+        raw: bytes,
+        rtypes: list[int] | None = None,
+        offset: int = 0,
+        upper: int | None = None,
+        positions: list[int] | None = None,
+    ) -> list:
+        return self.take_rows(self.decode(raw), rtypes, offset, upper, positions)
+
+    def take_rows(
+        self,
+        rows: list,
+        rtypes: list[int] | None = None,
+        offset: int = 0,
+        upper: int | None = None,
+        positions: list[int] | None = None,
+    ) -> list:
+        if positions is not None:
+            return [rows[p] for p in positions if p < len(rows)]
+        if rtypes is not None:
+            rows = [r for r in rows if int(r[0]) in rtypes]
+        return rows[offset:upper]
+
+
+class ArrowCodec:
+    """
+    Serialize the rows in a two-column Arrow table (rtype, JSON row)
+    """
+
+    name = "arrow"
+    magic = b"LCPARROW"
+
+    def encode(self, data: list) -> bytes:
+        table = pa.table(
+            {
+                "rtype": pa.array([int(r[0]) for r in data], type=pa.int16()),
+                "row": pa.array(
+                    [json.dumps(r[1], cls=CustomEncoder).encode() for r in data],
+                    type=pa.binary(),
+                ),
+            }
+        )
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return self.magic + sink.getvalue().to_pybytes()
+
+    def _table(self, raw: bytes) -> pa.Table:
+        buffer = pa.py_buffer(raw)[len(self.magic) :]
+        return pa.ipc.open_stream(buffer).read_all()
+
+    def decode(self, raw: bytes) -> list:
+        return self.take(raw)
+
+    def take(
+        self,
+        raw: bytes,
+        rtypes: list[int] | None = None,
+        offset: int = 0,
+        upper: int | None = None,
+        positions: list[int] | None = None,
+    ) -> list:
+        return self.take_table(self._table(raw), rtypes, offset, upper, positions)
+
+    def take_table(
+        self,
+        table: pa.Table,
+        rtypes: list[int] | None = None,
+        offset: int = 0,
+        upper: int | None = None,
+        positions: list[int] | None = None,
+    ) -> list:
+        idx: np.ndarray
+        if positions is not None:
+            idx = np.array([p for p in positions if p < table.num_rows], dtype=np.int64)
+        else:
+            kinds = table.column("rtype").to_numpy()
+            if rtypes is None:
+                idx = np.arange(len(kinds), dtype=np.int64)
+            else:
+                idx = np.flatnonzero(np.isin(kinds, rtypes))
+            idx = idx[offset:upper]
+        if not len(idx):
+            return []
+        sub = table.take(pa.array(idx))
+        kinds_sub = sub.column("rtype").to_pylist()
+        rows_sub = sub.column("row").to_pylist()
+        return [[k, json.loads(r)] for k, r in zip(kinds_sub, rows_sub)]
+
+
+CODECS: dict[str, JSONCodec | ArrowCodec] = {
+    "json": JSONCodec(),
+    "arrow": ArrowCodec(),
+}
+
+
+def _codec_for(raw: bytes) -> JSONCodec | ArrowCodec:
+    for codec in CODECS.values():
+        if codec.magic and raw.startswith(codec.magic):
+            return codec
+    return CODECS["json"]
+
+
+def encode_results(data: Any, codec: str = QUERY_CACHE_CODEC) -> bytes:
+    """
+    Serialize data for the cache, with the given codec if data is a list of rows
+    """
+    chosen = CODECS.get(codec, CODECS["json"])
+    if isinstance(chosen, ArrowCodec) and _is_rows(data):
+        return chosen.encode(list(data))
+    return CODECS["json"].encode(data)
+
+
+def _as_chunks(raw: bytes | str | list[bytes]) -> list[bytes]:
+    chunks: list[bytes | str] = list(raw) if isinstance(raw, list) else [raw]
+    return [c.encode("utf-8") if isinstance(c, str) else c for c in chunks]
+
+
+def decode_results(raw: bytes | str | list[bytes]) -> Any:
+    """
+    Deserialize everything that was stored in the cache
+    """
+    chunks = _as_chunks(raw)
+    if len(chunks) == 1:
+        return _codec_for(chunks[0]).decode(chunks[0])
+    return [row for c in chunks for row in _codec_for(c).decode(c)]
+
+
+def slice_results(
+    raw: bytes | str | list[bytes],
+    rtypes: list[int] | None = None,
+    offset: int = 0,
+    upper: int | None = None,
+    positions: list[int] | None = None,
+) -> list:
+    """
+    Deserialize only some of the cached rows: either the rows at the given positions,
+    or the rows offset:upper among those whose rtype is in rtypes (all if None)
+    """
+    chunks = _as_chunks(raw)
+    kwargs: dict[str, Any] = dict(
+        rtypes=rtypes, offset=offset, upper=upper, positions=positions
+    )
+    if len(chunks) == 1:
+        return _codec_for(chunks[0]).take(chunks[0], **kwargs)
+    arrow = cast(ArrowCodec, CODECS["arrow"])
+    if all(_codec_for(c) is arrow for c in chunks):
+        table = pa.concat_tables([arrow._table(c) for c in chunks])
+        return arrow.take_table(table, **kwargs)
+    rows = [row for c in chunks for row in _codec_for(c).decode(c)]
+    return cast(JSONCodec, CODECS["json"]).take_rows(rows, **kwargs)
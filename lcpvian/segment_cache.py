@@ -0,0 +1,197 @@
+"""
+segment_cache.py: corpus-level cache of the prepared segments and meta of segment ids
+
+The segment+meta query of do_segment_and_meta returns, for a list of segment ids,
+the prepared segments around them (rtype -1) and their aligned meta (rtype -2).
+The rows are stored here per segment id, under keys that only depend on the corpus
+(schema, context layer and segment query variant, but not the batch), so that other
+batches, queries, requests and users hitting the same segments reuse them instead
+of querying the DB again.
+
+Each corpus has a byte budget (SEGMENT_CACHE_MAX_BYTES): the entries are tracked
+in a sorted set by time of last access, with their sizes, and the least recently
+used ones are evicted when the budget is exceeded.
+"""
+
+import json
+import os
+import time
+
+from redis import Redis as RedisConnection
+from typing import cast
+
+from .char_ranges import parse_char_range
+from .result_cache import decode_results, encode_results
+from .utils import get_segment_meta_script, hasher
+
+SEGMENT_CACHE_MAX_BYTES = int(os.getenv("SEGMENT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+SEGMENT_CACHE_TTL = int(os.getenv("SEGMENT_CACHE_TTL", 60 * 60 * 24))
+
+# Number of entries to evict at a time
+EVICT_STEP = 64
+
+
+def rows_by_segment(
+    rows: list, segment_ranges: dict[str, int | list[int]]
+) -> dict[str, list]:
+    """
+    Attribute the rows of a segment query to the segment ids whose char range
+    overlaps theirs, which is how do_segment_and_meta filters them for requests.
+    Rows without a char range are never sent, so they are not attributed
+    """
+    ranges = {
+        sid: cast(list[int], cr)
+        for sid, cr in segment_ranges.items()
+        if isinstance(cr, list)
+    }
+    out: dict[str, list] = {sid: [] for sid in ranges}
+    for rtype, content in rows:
+        row_range = parse_char_range(content)
+        if row_range is None:
+            continue
+        lower, upper = row_range
+        for sid, (sid_lower, sid_upper) in ranges.items():
+            if lower < sid_upper and sid_lower < upper:
+                out[sid].append([rtype, content])
+    return out
+
+
+def dedupe_rows(rows: list) -> list:
+    """
+    Remove the rows attributed to several segment ids, keeping the first occurrence
+    """
+    seen: set[str] = set()
+    out: list = []
+    for row in rows:
+        dumped = json.dumps(row, sort_keys=True, default=str)
+        if dumped in seen:
+            continue
+        seen.add(dumped)
+        out.append(row)
+    return out
+
+
+class SegmentCache:
+    """
+    Rows of the segment query for individual segment ids of one corpus
+    """
+
+    def __init__(
+        self,
+        connection: RedisConnection,
+        config: dict,
+        languages: list[str],
+        context: str | None,
+    ):
+        self._connection = connection
+        schema = config["schema_path"]
+        # The segment script of a batch only differs from that of the first batch
+        # by the table where it looks up the segment ids, not by the rows it returns
+        # for an id: the variant only depends on the languages, context and config
+        first_batch = f"{str(config['token']).lower()}0"
+        script, _ = get_segment_meta_script(config, languages, first_batch, context)
+        self.prefix = f"segment::{schema}::{context or ''}::{hasher(script)}"
+        self.lru_key = f"segment_lru::{schema}"
+        self.sizes_key = f"segment_sizes::{schema}"
+        self.total_key = f"segment_bytes::{schema}"
+
+    def key(self, sid: str) -> str:
+        return f"{self.prefix}::{sid}"
+
+    def get_many(self, sids: list[str]) -> dict[str, list]:
+        """
+        Return the cached rows of the segment ids found in the cache
+        """
+        if not sids:
+            return {}
+        keys = [self.key(sid) for sid in sids]
+        raws = cast(list[bytes | None], self._connection.mget(keys))
+        found: dict[str, list] = {}
+        missing: list[str] = []
+        for sid, key, raw in zip(sids, keys, raws):
+            if raw is None:
+                missing.append(key)
+            else:
+                found[sid] = cast(list, decode_results(raw))
+        if found:
+            now = time.time()
+            self._connection.zadd(self.lru_key, {self.key(sid): now for sid in found})
+        if missing:
+            # Forget about the entries that expired on their own
+            scores = cast(
+                list[float | None], self._connection.zmscore(self.lru_key, missing)
+            )
+            stale = [key for key, score in zip(missing, scores) if score is not None]
+            if stale:
+                self._forget(stale)
+        return found
+
+    def set_many(self, rows: dict[str, list]) -> None:
+        """
+        Store the rows of each segment id, then evict entries beyond the budget
+        """
+        if not rows:
+            return
+        encoded = {self.key(sid): encode_results(r) for sid, r in rows.items()}
+        old_sizes = cast(
+            list[bytes | None], self._connection.hmget(self.sizes_key, list(encoded))
+        )
+        delta = sum(len(v) for v in encoded.values()) - sum(
+            int(s) for s in old_sizes if s is not None
+        )
+        now = time.time()
+        pipe = self._connection.pipeline(transaction=False)
+        for key, value in encoded.items():
+            pipe.set(key, value, ex=SEGMENT_CACHE_TTL)
+        pipe.zadd(self.lru_key, {key: now for key in encoded})
+        pipe.hset(self.sizes_key, mapping={k: len(v) for k, v in encoded.items()})
+        pipe.incrby(self.total_key, delta)
+        for key in (self.lru_key, self.sizes_key, self.total_key):
+            pipe.expire(key, SEGMENT_CACHE_TTL)
+        pipe.execute()
+        self._evict()
+
+    def _forget(self, keys: list[str]) -> None:
+        sizes = cast(list[bytes | None], self._connection.hmget(self.sizes_key, keys))
+        pipe = self._connection.pipeline(transaction=False)
+        pipe.delete(*keys)
+        pipe.zrem(self.lru_key, *keys)
+        pipe.hdel(self.sizes_key, *keys)
+        pipe.decrby(self.total_key, sum(int(s) for s in sizes if s is not None))
+        pipe.execute()
+
+    def _evict(self) -> None:
+        total = int(cast(bytes | None, self._connection.get(self.total_key)) or 0)
+        if total <= SEGMENT_CACHE_MAX_BYTES:
+            return
+        lock = self._connection.lock(f"{self.lru_key}::evict", timeout=30)
+        if not lock.acquire(blocking=False):
+            # Another worker is already evicting
+            return
+        try:
+            while total > SEGMENT_CACHE_MAX_BYTES:
+                oldest = [
+                    k.decode("utf-8")
+                    for k in cast(
+                        list[bytes],
+                        self._connection.zrange(self.lru_key, 0, EVICT_STEP - 1),
+                    )
+                ]
+                if not oldest:
+                    self._connection.set(self.total_key, 0, ex=SEGMENT_CACHE_TTL)
+                    break
+                sizes = cast(
+                    list[bytes | None], self._connection.hmget(self.sizes_key, oldest)
+                )
+                to_evict: list[str] = []
+                for key, size in zip(oldest, sizes):
+                    if total <= SEGMENT_CACHE_MAX_BYTES:
+                        break
+                    to_evict.append(key)
+                    total -= int(size or 0)
+                self._forget(to_evict)
+                total = int(
+                    cast(bytes | None, self._connection.get(self.total_key)) or 0
+                )
+        finally:
+            lock.release()
@@ -0,0 +1,117 @@
+"""
+selectivity.py: per-corpus record of how many hits queries yield on each batch
+
+Every completed batch adds its number of hits, its number of words and the time
+its query took, under two keys: one for the exact query, and one for the shape
+of the query (the same query with all the literal values blanked out). The
+scheduler uses these to predict the yield of batches before running them.
+"""
+
+import os
+
+from redis import Redis as RedisConnection
+from typing import Any, cast
+
+from .utils import hasher
+
+SELECTIVITY_TTL = int(os.getenv("SELECTIVITY_TTL", 60 * 60 * 24 * 30))
+
+# Keys whose values are literals or arbitrary names, irrelevant to the shape of a query
+LITERAL_KEYS = {"string", "pattern", "number", "value", "label", "partOfStream"}
+
+FIELDS = ("hits", "words", "runtime", "n")
+
+
+def query_shape(query: Any) -> Any:
+    """
+    Return the query with all the literal values blanked out
+    """
+    if isinstance(query, dict):
+        return {
+            k: "?" if k in LITERAL_KEYS else query_shape(v) for k, v in query.items()
+        }
+    if isinstance(query, list):
+        return [query_shape(x) for x in query]
+    return query
+
+
+class SelectivityModel:
+    """
+    Hits, words and runtimes recorded for a query and its shape on one corpus
+    """
+
+    def __init__(self, connection: RedisConnection, corpus: str, json_query: dict):
+        self._connection = connection
+        query_part = json_query.get("query", json_query)
+        self.exact_key = f"selectivity::{corpus}::query::{hasher(query_part)}"
+        self.shape_key = (
+            f"selectivity::{corpus}::shape::{hasher(query_shape(query_part))}"
+        )
+        self._stats: dict[str, dict[str, dict[str, float]]] | None = None
+
+    def record(self, batch: str, hits: int, words: int, runtime: float) -> None:
+        """
+        Add the outcome of running the query on a batch
+        """
+        pipe = self._connection.pipeline(transaction=False)
+        for key in (self.exact_key, self.shape_key):
+            for field, value in zip(FIELDS, (hits, words, runtime, 1)):
+                pipe.hincrbyfloat(key, f"{batch}:{field}", value)
+            pipe.expire(key, SELECTIVITY_TTL)
+        pipe.execute()
+        self._stats = None
+
+    def _load(self) -> dict[str, dict[str, dict[str, float]]]:
+        if self._stats is not None:
+            return self._stats
+        pipe = self._connection.pipeline(transaction=False)
+        pipe.hgetall(self.exact_key)
+        pipe.hgetall(self.shape_key)
+        exact, shape = cast(list[dict[bytes, bytes]], pipe.execute())
+        self._stats = {"exact": _by_batch(exact), "shape": _by_batch(shape)}
+        return self._stats
+
+    @property
+    def known(self) -> bool:
+        stats = self._load()
+        return bool(stats["exact"] or stats["shape"])
+
+    def predict(self, batch: str, words: int) -> tuple[float, float] | None:
+        """
+        Predict the number of hits and the runtime of the query on a batch:
+        use what the same query did on that batch if available, else extrapolate
+        from the rates per word of the query, or of its shape
+        """
+        stats = self._load()
+        if batch in stats["exact"]:
+            batch_stats = stats["exact"][batch]
+            n = batch_stats["n"] or 1
+            return batch_stats["hits"] / n, batch_stats["runtime"] / n
+        for level in ("exact", "shape"):
+            if not stats[level]:
+                continue
+            words_so_far = sum(b["words"] for b in stats[level].values()) or 1
+            hits_so_far = sum(b["hits"] for b in stats[level].values())
+            runtime_so_far = sum(b["runtime"] for b in stats[level].values())
+            return (
+                words * hits_so_far / words_so_far,
+                words * runtime_so_far / words_so_far,
+            )
+        return None
+
+    def exact_hits(self, batch: str) -> float | None:
+        """
+        The number of hits that the same query yielded on the batch, if it ran before
+        """
+        batch_stats = self._load()["exact"].get(batch)
+        if not batch_stats:
+            return None
+        return batch_stats["hits"] / (batch_stats["n"] or 1)
+
+
+def _by_batch(raw: dict[bytes, bytes]) -> dict[str, dict[str, float]]:
+    out: dict[str, dict[str, float]] = {}
+    for k, v in raw.items():
+        batch, _, field = k.decode("utf-8").rpartition(":")
+        out.setdefault(batch, {f: 0.0 for f in FIELDS})[field] = float(v)
+    return out
@@ -12,7 +12,8 @@ The /ws endpoint is connected to sock().
 
 `listen_to_redis()` is running on a loop as a background job in the main process.
 When the worker process finishes processing DB data, it publishes the data to
-the Redis channel we are listening to. The main thread gets the message and
+the Redis channel we are listening to (or adds it to a Redis stream, when
+MESSAGE_TRANSPORT is "streams"). The main thread gets the message and
 broadcasts it to the correct user/room via websocket.
 """
 
@@ -20,10 +21,12 @@ import asyncio
 import json
 import logging
 import os
+import time
 import traceback
+import zlib
 
-from collections.abc import Coroutine
-from typing import Any, cast
+from collections.abc import Awaitable, Callable, Coroutine
+from typing import Any, TypeAlias, cast
 
 try:
     from aiohttp import WSCloseCode, WSMsgType, web
@@ -35,18 +38,22 @@ from aiohttp.http_websocket import WSMessage
 from rq.job import Job
 
 from redis.asyncio.client import PubSub
-from redis.exceptions import ConnectionError
+from redis.asyncio import Redis
+from redis.exceptions import ConnectionError, RedisError, ResponseError
 
 
 from .configure import _get_batches, CorpusConfig
 from .email import send_email
 from .query_service import QueryService
-from .query_classes import QueryInfo, Request
+from .query_classes import REQUEST_DONE_ACTION, QueryInfo, Request, _request_done
 from .utils import push_msg
-from .validate import validate
+from .validate import QueryValidator
+from .ws_codec import WS_COMPRESS, negotiate, stats as encoding_stats
 
 from .typed import JSON, JSONObject, RedisMessage, Websockets
 from .utils import (
+    MESSAGE_STREAM,
+    MESSAGE_TRANSPORT,
     PUBSUB_CHANNEL,
     _filter_corpora,
     _set_config,
@@ -57,28 +64,81 @@ MESSAGE_TTL = os.getenv("REDIS_WS_MESSSAGE_TTL", 5000)
 QUERY_TTL = os.getenv("QUERY_TTL", 5000)
 
 
-async def _process_message(
-    message: RedisMessage, channel: PubSub, app: web.Application
-) -> None:
+# number of tasks handling the messages from redis concurrently
+PUBSUB_HANDLERS = int(os.getenv("PUBSUB_HANDLERS", 8))
+# number of messages waiting for each handler before the listener blocks
+PUBSUB_QUEUE_SIZE = int(os.getenv("PUBSUB_QUEUE_SIZE", 256))
+# log the dispatcher stats when a message waited this long (seconds) for a handler
+PUBSUB_SLOW_DISPATCH = float(os.getenv("PUBSUB_SLOW_DISPATCH", 1.0))
+# how often (seconds) the bytes and time spent per websocket encoding are logged
+WS_STATS_INTERVAL = int(os.getenv("WS_STATS_INTERVAL", 3600))
+
+# consumer group reading MESSAGE_STREAM: instances in the same group share its
+# entries, so each instance serving websockets needs its own group. The name must
+# survive restarts (unlike the hostname of a container): a new group only receives
+# the entries added after it was created, an existing one resumes where it stopped.
+# The groups of retired instances are not removed automatically, see .env.example
+MESSAGE_STREAM_GROUP = os.getenv("MESSAGE_STREAM_GROUP", "")
+# the entries pending for the consumer of the previous run are replayed at once
+MESSAGE_STREAM_CONSUMER = os.getenv("MESSAGE_STREAM_CONSUMER") or MESSAGE_STREAM_GROUP
+# entries pending for longer than this (ms) are claimed from other consumers
+MESSAGE_STREAM_CLAIM_IDLE = int(os.getenv("MESSAGE_STREAM_CLAIM_IDLE", 60000))
+MESSAGE_STREAM_BATCH = 64
+
+# time queued, data, payload, channel, callback once handled
+Queued: TypeAlias = tuple[
+    float,
+    JSONObject,
+    JSONObject,
+    PubSub | None,
+    Callable[[], Awaitable[Any]] | None,
+]
+
+
+def _load_message(
+    message: RedisMessage, app: web.Application
+) -> tuple[JSONObject, JSONObject] | None:
     """
     Check that a WS message contains data, and is not a subscribe message,
-    then handle it if so.
+    then return its data and the payload it refers to, if any
     """
-    await asyncio.sleep(0.1)
     if not message or not isinstance(message, dict):
-        return
+        return None
     if message.get("type", "") == "subscribe":
-        return
+        return None
     if not message.get("data"):
-        return
+        return None
     data = json.loads(cast(bytes, message["data"]))
-    if "msg_id" in data:
-        raw: bytes = app["redis"].get(data["msg_id"])
-        if not raw and "shared_redis" in app:
-            raw = app["shared_redis"].get(data["msg_id"])
-        if not raw:
-            return None
-        payload: JSONObject = json.loads(raw)
+    if "msg_id" not in data:
+        return data, data
+    raw: bytes = app["redis"].get(data["msg_id"])
+    if not raw and "shared_redis" in app:
+        raw = app["shared_redis"].get(data["msg_id"])
+    if not raw:
+        return None
+    payload: JSONObject = json.loads(raw)
+    if not payload or not isinstance(payload, dict):
+        return None
+    return data, payload
+
+
+def _ordering_key(payload: JSONObject) -> str:
+    """
+    Messages with the same key must be handled in the order they were published
+    """
+    for key in ("hash", "request", "room", "user"):
+        if payload.get(key):
+            return f"{key}::{payload[key]}"
+    return ""
+
+
+async def _process_payload(
+    data: JSONObject, payload: JSONObject, channel: PubSub | None, app: web.Application
+) -> None:
+    """
+    Handle the payload of a message from redis
+    """
+    if data is not payload:
         if "callback_query" in payload:
             qi_hash: str = str(payload["hash"])
             qi = QueryInfo(qi_hash, app["redis"])
@@ -91,46 +151,153 @@ async def _process_message(
             # then sign the payload with the information contained in data
             _sign_payload(payload, data)
         payload["status"] = data.get("status", payload.get("status", ""))
-        if not payload or not isinstance(payload, dict):
-            return
-    else:
-        payload = data
     await _handle_message(payload, channel, app)
     return None
 
 
+class MessageDispatcher:
+    """
+    Bounded pool of tasks handling the messages from redis
+
+    Messages with the same ordering key (query hash, request, room...) always go to
+    the same handler, so they are handled in the order they were published, while
+    messages for different queries are handled concurrently
+    """
+
+    def __init__(
+        self,
+        app: web.Application,
+        n_handlers: int = PUBSUB_HANDLERS,
+        maxsize: int = PUBSUB_QUEUE_SIZE,
+    ):
+        self._app = app
+        self._queues: list[asyncio.Queue[Queued]] = [
+            asyncio.Queue(maxsize) for _ in range(max(1, n_handlers))
+        ]
+        self._tasks: list[asyncio.Task] = []
+        self.dispatched = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._handle(queue)) for queue in self._queues
+            ]
+
+    async def put(
+        self,
+        data: JSONObject,
+        payload: JSONObject,
+        channel: PubSub | None,
+        done: Callable[[], Awaitable[Any]] | None = None,
+    ) -> None:
+        """
+        Queue a message for its handler, waiting if the handler is too far behind.
+        done is awaited once the message was handled
+        """
+        self.start()
+        key = _ordering_key(payload)
+        queue = self._queues[zlib.crc32(key.encode("utf-8")) % len(self._queues)]
+        await queue.put((time.monotonic(), data, payload, channel, done))
+
+    async def join(self) -> None:
+        for queue in self._queues:
+            await queue.join()
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _handle(self, queue: asyncio.Queue[Queued]) -> None:
+        while True:
+            queued, data, payload, channel, done = await queue.get()
+            latency = time.monotonic() - queued
+            self.dispatched += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            if latency > PUBSUB_SLOW_DISPATCH:
+                print(f"Slow pubsub dispatch ({latency:.2f}s):", self.stats())
+            try:
+                await _process_payload(data, payload, channel, self._app)
+            except Exception as err:
+                formed = traceback.format_exc()
+                print(f"Error: {str(err)}\n{formed}")
+                extra = {"error": str(err), "status": "failed", "traceback": formed}
+                logging.error(str(err), extra=extra)
+            # the message only counts as handled (see join) once acknowledged
+            try:
+                if done is not None:
+                    await done()
+            except ConnectionError as err:
+                print("Could not acknowledge message", err)
+            finally:
+                queue.task_done()
+
+    def stats(self) -> dict[str, int | float | list[int]]:
+        """
+        Messages waiting for each handler, and the time messages waited for a handler
+        """
+        return {
+            "queued": [queue.qsize() for queue in self._queues],
+            "dispatched": self.dispatched,
+            "avg_latency": (
+                round(self.total_latency / self.dispatched, 4)
+                if self.dispatched
+                else 0.0
+            ),
+            "max_latency": round(self.max_latency, 4),
+        }
+
+
 async def handle_redis_response(
-    channel: PubSub, app: web.Application, test: bool = False, retries: int = 5
+    channel: PubSub,
+    app: web.Application,
+    test: bool = False,
+    retries: int = 5,
+    dispatcher: MessageDispatcher | None = None,
 ) -> None:
     """
     If redis publishes a message, it gets picked up here in an async loop
     and broadcast to the correct websockets.
 
+    The loop blocks on the pubsub connection and hands the messages over to
+    the handlers of the dispatcher, so it never waits for a message to be handled
+
     We need to know if we're running c-compiled code or not, because
     channel.get_message() fails when compiled to c for some reason
     """
     message: RedisMessage = None
+    if dispatcher is None:
+        dispatcher = MessageDispatcher(app)
+
+    async def dispatch(message: RedisMessage) -> None:
+        loaded = _load_message(message, app)
+        if loaded is not None:
+            await dispatcher.put(*loaded, channel)
+        if test is True:
+            await dispatcher.join()
 
     try:
         while True:
-            await asyncio.sleep(0.1)
             try:
                 if app.get("mypy", False) is True:
                     async for message in channel.listen():
                         if message is None:
                             continue
-                        await _process_message(message, channel, app)
+                        await dispatch(message)
                         if message and test is True:
                             return None
                 else:
                     while True:
-                        await asyncio.sleep(0.1)
                         message = await channel.get_message(
                             ignore_subscribe_messages=True, timeout=10.0
                         )
                         if message is None:
                             continue
-                        await _process_message(message, channel, app)
+                        await dispatch(message)
                         if message and test is True:
                             return None
             except ConnectionError as err:
@@ -149,6 +316,93 @@ async def handle_redis_response(
         logging.error(str(err), extra=extra)
 
 
+async def handle_stream_messages(
+    connection: Redis,
+    app: web.Application,
+    dispatcher: MessageDispatcher,
+    in_flight: set[bytes],
+    test: bool = False,
+) -> None:
+    """
+    Read the notifications of MESSAGE_STREAM as a consumer of MESSAGE_STREAM_GROUP
+    and hand them over to the dispatcher. An entry is acknowledged once it was
+    handled, so the entries that were delivered but not handled (disconnection,
+    restart...) are replayed first, and those left pending by other consumers
+    of the group are claimed after MESSAGE_STREAM_CLAIM_IDLE.
+    in_flight holds the ids of the entries queued in the dispatcher, which
+    must not be dispatched again when they are replayed after a reconnection
+    """
+    if not MESSAGE_STREAM_GROUP:
+        raise ValueError(
+            "MESSAGE_TRANSPORT=streams needs a MESSAGE_STREAM_GROUP that is stable "
+            "across restarts"
+        )
+    try:
+        await connection.xgroup_create(
+            MESSAGE_STREAM, MESSAGE_STREAM_GROUP, id="$", mkstream=True
+        )
+    except ResponseError as err:
+        if "BUSYGROUP" not in str(err):
+            raise err
+
+    async def ack(entry_id: bytes) -> None:
+        await connection.xack(MESSAGE_STREAM, MESSAGE_STREAM_GROUP, entry_id)
+        in_flight.discard(entry_id)
+
+    async def dispatch(entry_id: bytes, fields: dict[bytes, bytes]) -> None:
+        if entry_id in in_flight:
+            return
+        message: RedisMessage = {"type": "message", "data": fields.get(b"data")}
+        loaded = _load_message(message, app)
+        if loaded is None:
+            await ack(entry_id)
+            return
+        in_flight.add(entry_id)
+        await dispatcher.put(*loaded, None, lambda: ack(entry_id))
+        if test is True:
+            await dispatcher.join()
+
+    # "0" reads the entries already delivered to this consumer, ">" new ones
+    last_id: bytes | str = "0"
+    last_claim = 0.0
+    while True:
+        if last_id == ">" and time.monotonic() - last_claim > (
+            MESSAGE_STREAM_CLAIM_IDLE / 2000
+        ):
+            last_claim = time.monotonic()
+            _, claimed, *_ = await connection.xautoclaim(
+                MESSAGE_STREAM,
+                MESSAGE_STREAM_GROUP,
+                MESSAGE_STREAM_CONSUMER,
+                min_idle_time=MESSAGE_STREAM_CLAIM_IDLE,
+                count=MESSAGE_STREAM_BATCH,
+            )
+            for entry_id, fields in claimed:
+                if fields:
+                    await dispatch(entry_id, fields)
+        response = await connection.xreadgroup(
+            MESSAGE_STREAM_GROUP,
+            MESSAGE_STREAM_CONSUMER,
+            {MESSAGE_STREAM: last_id},
+            count=MESSAGE_STREAM_BATCH,
+            block=MESSAGE_STREAM_CLAIM_IDLE // 2 if last_id == ">" else None,
+        )
+        entries = response[0][1] if response else []
+        if last_id != ">":
+            if not entries:
+                last_id = ">"
+                continue
+            last_id = entries[-1][0]
+        for entry_id, fields in entries:
+            if not fields:
+                # trimmed from the stream before it was handled
+                await ack(entry_id)
+                continue
+            await dispatch(entry_id, fields)
+            if test is True:
+                return None
+
+
 async def listen_to_redis(
     app: web.Application, instance: str, test: bool = False
 ) -> None:
@@ -159,32 +413,48 @@ async def listen_to_redis(
     ainstance = f"a{instance}"
     if instance not in app or ainstance not in app:
         return
-    while True:
-        try:
-            async with app[ainstance].pubsub() as channel:
-                await channel.subscribe(PUBSUB_CHANNEL)
-                await handle_redis_response(channel, app, test=test)
-        except ConnectionError as err:
-            print("Connection error in listen_to_redis", err)
-        except KeyboardInterrupt:
-            pass
-        except Exception as err:
-            raise err
-        try:
-            print("Attempt unsubscribe")
-            await channel.unsubscribe(PUBSUB_CHANNEL)
-            print("unsubscribe success")
-        except:
-            pass
-        try:
-            await app["aredis"].quit()
-        except Exception:
-            pass
-        try:
-            app["redis"].quit()
-        except Exception:
-            pass
-        await asyncio.sleep(0.1)
+    dispatcher = MessageDispatcher(app)
+    # stream entries queued in the dispatcher but not acknowledged yet
+    in_flight: set[bytes] = set()
+    try:
+        while True:
+            channel: PubSub | None = None
+            try:
+                if MESSAGE_TRANSPORT == "streams":
+                    await handle_stream_messages(
+                        app[ainstance], app, dispatcher, in_flight, test=test
+                    )
+                    return None
+                async with app[ainstance].pubsub() as pubsub:
+                    channel = pubsub
+                    await pubsub.subscribe(PUBSUB_CHANNEL)
+                    await handle_redis_response(
+                        pubsub, app, test=test, dispatcher=dispatcher
+                    )
+            except ConnectionError as err:
+                print("Connection error in listen_to_redis", err)
+            except KeyboardInterrupt:
+                pass
+            except Exception as err:
+                raise err
+            if channel is not None:
+                try:
+                    print("Attempt unsubscribe")
+                    await channel.unsubscribe(PUBSUB_CHANNEL)
+                    print("unsubscribe success")
+                except RedisError as err:
+                    print("Could not unsubscribe", err)
+            try:
+                await app["aredis"].quit()
+            except Exception:
+                pass
+            try:
+                app["redis"].quit()
+            except Exception:
+                pass
+            await asyncio.sleep(0.1)
+    finally:
+        await dispatcher.close()
     return None
 
 
@@ -204,7 +474,7 @@ async def _handle_error(
 
 
 async def _handle_message(
-    payload: JSONObject, channel: PubSub, app: web.Application
+    payload: JSONObject, channel: PubSub | None, app: web.Application
 ) -> None:
     """
     Build a message, do any extra needed actions and send on to the right websocket(s)
@@ -234,6 +504,11 @@ async def _handle_message(
         "interrupted",  # not currently used, maybe when rooms have multiple users
     )
 
+    # a synchronous request completed in another process
+    if action == REQUEST_DONE_ACTION:
+        _request_done(cast(str, payload.get("request", "")))
+        return None
+
     # for non-errors, we attach a msg_id to all messages, and store the message with
     # this key in redis so that the FE can retrieve it by /get_message endpoint anytime
     if (
@@ -290,13 +565,8 @@ LCP"""
         return await _set_config(payload, app)
 
     if action == "export_notifs":
-        room = ""
-        for rid, users in app["websockets"].items():
-            for _, uid in users:
-                if uid != user:
-                    continue
-                room = rid
-                break
+        rooms = app["websockets"].rooms_of(user)
+        room = rooms[0] if rooms else ""
         if room:
             await push_msg(
                 app["websockets"],
@@ -340,7 +610,7 @@ async def sock(request: web.Request) -> web.WebSocketResponse:
     Socket has to handle incoming messages, but also send a message when
     queries have finished processing
     """
-    ws = web.WebSocketResponse(autoping=True, heartbeat=17)
+    ws = web.WebSocketResponse(autoping=True, heartbeat=17, compress=WS_COMPRESS)
 
     await ws.prepare(request)
 
@@ -400,25 +670,25 @@ async def _handle_sock(
 
     # user opens the query page/joins a room
     if action == "joined":
-        originally = len(sockets[session_id])
-        sockets[session_id].add((ws, user_id))
+        encoding = negotiate(payload.get("encodings"))
+        joined = sockets.join(session_id, ws, user_id, encoding)
+        if "encodings" in payload:
+            # tell the client which encoding its binary frames will use
+            response = {"action": "encoding", "encoding": encoding}
+            await push_msg(sockets, session_id, response, just=ident)
         currently = len(sockets[session_id])
-        if session_id and originally != currently:
+        if session_id and joined:
             response = {"joined": user_id, "room": session_id, "n_users": currently}
             await push_msg(sockets, session_id, response, skip=ident)
 
     # user closes page or leaves a room
     elif action == "left":
         await ws.close(code=WSCloseCode.GOING_AWAY, message=b"User left")
-        try:
-            sockets[session_id].remove((ws, user_id))
-        except KeyError:
+        if not sockets.leave(session_id, ws, user_id):
             return None
-        currently = len(sockets[session_id])
+        currently = len(sockets.get(session_id, ()))
         if not currently:
             qs.cancel_running_jobs(user_id, session_id)
-            if session_id:
-                sockets.pop(session_id)
         elif session_id:
             response = {"left": user_id, "room": session_id, "n_users": currently}
             await push_msg(sockets, session_id, response, skip=ident)
@@ -451,9 +721,19 @@ async def _handle_sock(
 
     # user edited a query, triggering auto-validation of the DQD/JSON
     elif action == "validate":
-        payload["config"] = conf
-        resp = validate(**payload)
-        await push_msg(sockets, session_id, resp, just=ident)
+        validator: QueryValidator = app["validator"]
+
+        async def respond() -> None:
+            resp = await validator.validate(
+                conf,
+                payload.get("corpus"),
+                payload.get("query", ""),
+                payload.get("kind", "json"),
+            )
+            await push_msg(sockets, session_id, resp, just=ident)
+
+        # a newer query from the same user in the room replaces this one
+        validator.debounce(ident, respond())
 
     # used in simultaneous mode only: once FE sees enough results, cancel
     # any other ongoing jobs
@@ -480,7 +760,7 @@ async def ws_cleanup(sockets: Websockets) -> None:
     """
     interval = 3600 * 48
     while True:
-        for room, conns in sockets.items():
+        for room, conns in list(sockets.items()):
             to_close = set()
             for ws, user in conns:
                 if ws.closed:
@@ -489,7 +769,7 @@ async def ws_cleanup(sockets: Websockets) -> None:
                 msg = f"Removing stale WS connection: {room}/{user}"
                 print(msg)
                 logging.info(msg)
-                conns.remove(conn)
+                sockets.leave(room, *conn)
             n_users = len(conns)
             if not n_users or not to_close:
                 continue
@@ -502,3 +782,18 @@ async def ws_cleanup(sockets: Websockets) -> None:
                 await push_msg(sockets, room, response)
         await asyncio.sleep(interval)
     return None
+
+
+async def log_encoding_stats() -> None:
+    """
+    Periodically log the bytes and time spent on each encoding of the messages
+    sent over /ws, to compare the binary encodings with JSON
+    """
+    while True:
+        await asyncio.sleep(WS_STATS_INTERVAL)
+        report = encoding_stats.report()
+        if not report:
+            continue
+        msg = f"Websocket encoding stats: {json.dumps(report)}"
+        print(msg)
+        logging.info(msg)
@@ -0,0 +1,264 @@
+"""
+stats_store.py: incremental aggregation of the non-kwic result sets of a query
+
+The running totals of the frequency (analysis) and collocation result sets are
+kept in redis hashes, one field per row body, so that each batch only touches
+the keys it contains (HINCRBY/HINCRBYFLOAT) instead of reloading, merging and
+rewriting all the stats accumulated so far. The filters (post_processes) are
+applied when the stats are read, on the totals over all the aggregated batches.
+
+Keys, for the query hash H and the result set k:
+
+* H::stats::batches   batch name -> number of words, for the aggregated batches
+* H::stats::k::n      row body -> running total of the nth aggregate column
+* H::stats::k::e      collocation text -> sum of the E values weighted by batch size
+* H::stats::k::bound  error bound of an approximate result set (see below)
+* H::stats::k::merge  lock held while a batch is merged into an approximate result set
+
+Result sets with "approximate": {"top": n} in their metadata only keep heavy
+hitters: after each batch, only the STATS_APPROXIMATE_FACTOR * n rows with the
+highest counts (the last aggregate column, or O for collocations) are kept, and
+the highest count dropped is added to the bound. A reported count is thus at
+most `bound` below the true count, and a row that is not reported has a true
+count of at most `bound`. The grand total rows of frequency tables are exact.
+"""
+
+import json
+import os
+
+from collections import defaultdict
+from redis import Redis as RedisConnection
+from typing import Any, cast
+
+from .convert import _apply_filters, _frequency_totals
+from .utils import QUERY_TTL
+
+# Number of rows kept for each row reported by an approximate result set
+STATS_APPROXIMATE_FACTOR = int(os.getenv("STATS_APPROXIMATE_FACTOR", 4))
+
+
+def _number(raw: bytes) -> int | float:
+    try:
+        return int(raw)
+    except ValueError:
+        return float(raw)
+
+
+class StatsStore:
+    """
+    Running totals of the stats result sets of a query
+    """
+
+    def __init__(self, connection: RedisConnection, qhash: str, result_sets: list):
+        self._connection = connection
+        self.prefix = f"{qhash}::stats"
+        self.batches_key = f"{self.prefix}::batches"
+        self.result_sets = result_sets
+        self.freqs = {
+            i for i, r in enumerate(result_sets, start=1) if r.get("type") == "analysis"
+        }
+        self.colls = {
+            i
+            for i, r in enumerate(result_sets, start=1)
+            if r.get("type") == "collocation"
+        }
+        # result set -> number of rows to report
+        self.approximate: dict[int, int] = {
+            i: int(r["approximate"]["top"])
+            for i, r in enumerate(result_sets, start=1)
+            if i in self.freqs | self.colls and r.get("approximate")
+        }
+
+    def column_key(self, key: int, column: int | str) -> str:
+        return f"{self.prefix}::{key}::{column}"
+
+    def batches(self) -> dict[str, int]:
+        raw = cast(dict[bytes, bytes], self._connection.hgetall(self.batches_key))
+        return {k.decode("utf-8"): int(v) for k, v in raw.items()}
+
+    def add_batch(self, batch_name: str, size: int, rows: list) -> bool:
+        """
+        Add the stats rows of a batch to the running totals, unless the batch
+        was already aggregated. Return whether the rows were added
+        """
+        if not self._connection.hsetnx(self.batches_key, batch_name, size):
+            return False
+        try:
+            self._add_rows(rows, size)
+        except Exception:
+            self._connection.hdel(self.batches_key, batch_name)
+            raise
+        return True
+
+    def _add_rows(self, rows: list, size: int) -> None:
+        # Sum the rows of the batch first, so that each field is incremented once
+        increments: defaultdict[int, dict[str, list[int | float]]] = defaultdict(dict)
+        freq_rows: defaultdict[int, list] = defaultdict(list)
+        for line in rows:
+            key = int(line[0])
+            rest: list[Any] = line[1]
+            if key in self.colls:
+                text, total, e = rest
+                field = json.dumps(text)
+                # E is divided by the size of all the aggregated batches when read
+                prev = increments[key].get(field, [0, 0.0])
+                increments[key][field] = [prev[0] + total, prev[1] + e * size]
+                continue
+            if key in self.freqs:
+                freq_rows[key].append(rest)
+        for key, krows in freq_rows.items():
+            rs = cast(dict, self.result_sets[key - 1])
+            for body, totals in _frequency_totals(krows, rs).items():
+                increments[key][json.dumps(list(body))] = totals
+        pipe = self._connection.pipeline(transaction=False)
+        for key, fields in increments.items():
+            if key in self.approximate:
+                self._merge_top(key, fields)
+                continue
+            columns = self._columns(key, fields)
+            for field, values in fields.items():
+                for column, value in zip(columns, values):
+                    if isinstance(value, int):
+                        pipe.hincrby(self.column_key(key, column), field, value)
+                    else:
+                        pipe.hincrbyfloat(self.column_key(key, column), field, value)
+            for column in columns:
+                pipe.expire(self.column_key(key, column), QUERY_TTL)
+        pipe.expire(self.batches_key, QUERY_TTL)
+        pipe.execute()
+
+    def _columns(self, key: int, fields: dict[str, list]) -> list[int | str]:
+        if key in self.colls:
+            return [0, "e"]
+        return list(range(max((len(v) for v in fields.values()), default=0)))
+
+    def _merge_top(self, key: int, fields: dict[str, list[int | float]]) -> None:
+        """
+        Add the rows of a batch to an approximate result set and only keep the top ones.
+        The totals are read, merged and rewritten under a lock, so that the batches
+        aggregated concurrently by other workers are not lost
+        """
+        lock = self._connection.lock(self.column_key(key, "merge"), timeout=30)
+        with lock:
+            self._merge_top_locked(key, fields)
+
+    def _merge_top_locked(self, key: int, fields: dict[str, list[int | float]]) -> None:
+        merged: dict[str, list[int | float]] = {
+            k.decode("utf-8"): v for k, v in self._read(key).items()
+        }
+        for field, values in fields.items():
+            prev = merged.get(field)
+            merged[field] = (
+                values if prev is None else [p + v for p, v in zip(prev, values)]
+            )
+        weight = 0 if key in self.colls else -1
+        exact = {f: v for f, v in merged.items() if f.startswith('["True"')}
+        ranked = sorted(
+            (f for f in merged if f not in exact),
+            key=lambda f: merged[f][weight],
+            reverse=True,
+        )
+        capacity = self.approximate[key] * STATS_APPROXIMATE_FACTOR
+        kept = {f: merged[f] for f in ranked[:capacity]}
+        kept.update(exact)
+        dropped = merged[ranked[capacity]][weight] if len(ranked) > capacity else 0
+        columns = self._columns(key, kept)
+        pipe = self._connection.pipeline(transaction=True)
+        for n, column in enumerate(columns):
+            column_key = self.column_key(key, column)
+            pipe.delete(column_key)
+            mapping: dict[str | bytes, int | float] = {
+                f: v[n] for f, v in kept.items() if len(v) > n
+            }
+            if mapping:
+                pipe.hset(column_key, mapping=mapping)
+                pipe.expire(column_key, QUERY_TTL)
+        bound_key = self.column_key(key, "bound")
+        pipe.incrbyfloat(bound_key, dropped)
+        pipe.expire(bound_key, QUERY_TTL)
+        pipe.execute()
+
+    def _read(self, key: int) -> dict[bytes, list[int | float]]:
+        """
+        The running totals of a result set: row body -> values of each column
+        """
+        if key in self.colls:
+            totals, es = [
+                cast(
+                    dict[bytes, bytes],
+                    self._connection.hgetall(self.column_key(key, c)),
+                )
+                for c in cast(list[int | str], [0, "e"])
+            ]
+            return {
+                field: [_number(total), _number(es.get(field, b"0"))]
+                for field, total in totals.items()
+            }
+        columns: list[dict[bytes, bytes]] = []
+        while True:
+            column = cast(
+                dict[bytes, bytes],
+                self._connection.hgetall(self.column_key(key, len(columns))),
+            )
+            if not column:
+                break
+            columns.append(column)
+        out: dict[bytes, list[int | float]] = {}
+        for field in columns[0] if columns else {}:
+            values: list[int | float] = []
+            for column in columns:
+                if field not in column:
+                    break
+                values.append(_number(column[field]))
+            out[field] = values
+        return out
+
+    def results(self, post_processes: dict[int, Any] | None = None) -> dict[str, list]:
+        """
+        The rows of each stats result set so far (the body of frequency rows
+        followed by their totals, [text, total, E] for collocations), with the
+        filters applied
+        """
+        out: dict[int, list] = {}
+        total_size = sum(self.batches().values()) or 1
+        for key in sorted(self.freqs | self.colls):
+            totals = self._read(key)
+            if not totals:
+                continue
+            rows: list
+            if key in self.colls:
+                rows = [
+                    [json.loads(field), total, e / total_size]
+                    for field, (total, e) in totals.items()
+                ]
+            else:
+                rows = [json.loads(field) + values for field, values in totals.items()]
+            if key in self.approximate:
+                rows = self._top(key, rows)
+            out[key] = rows
+        filtered = _apply_filters(cast(Any, out), post_processes or {})
+        return {str(k): cast(list, v) for k, v in filtered.items()}
+
+    def _top(self, key: int, rows: list) -> list:
+        weight = 1 if key in self.colls else -1
+        exact = [r for r in rows if key in self.freqs and r[0] == "True"]
+        ranked = sorted(
+            (r for r in rows if not (key in self.freqs and r[0] == "True")),
+            key=lambda r: r[weight],
+            reverse=True,
+        )
+        return exact + ranked[: self.approximate[key]]
+
+    def bounds(self) -> dict[str, dict[str, int | float]]:
+        """
+        The error bounds of the approximate result sets
+        """
+        out: dict[str, dict[str, int | float]] = {}
+        for key, top in self.approximate.items():
+            bound = self._connection.get(self.column_key(key, "bound"))
+            out[str(key)] = {
+                "top": top,
+                "kept": top * STATS_APPROXIMATE_FACTOR,
+                "max_error": _number(bound) if bound else 0,
+            }
+        return out
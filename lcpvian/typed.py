@@ -11,6 +11,7 @@ from collections.abc import Awaitable, Callable
 from datetime import datetime
 from typing import Any, Mapping, TypeAlias, TypedDict
 from uuid import UUID
+from weakref import WeakKeyDictionary
 
 from aiohttp import web
 from rq.job import Job
@@ -25,8 +26,61 @@ JSON: TypeAlias = JsonValue
 # json when we know it is an object at least
 JSONObject: TypeAlias = dict[str, JSON]
 
-# all websocket connections to the app -- {room_id: {(ws_connection, user_id)...}}
-Websockets: TypeAlias = defaultdict[str, set[tuple[web.WebSocketResponse, str]]]
+
+class Websockets(defaultdict[str, set[tuple[web.WebSocketResponse, str]]]):
+    """
+    All websocket connections to the app -- {room_id: {(ws_connection, user_id)...}}
+
+    Connections should be added and removed with join() and leave(), which also
+    maintain the routing index used by utils.push_msg:
+    {(room_id, user_id): {ws_connection...}} and {room_id: {user_id...}},
+    as well as the encoding negotiated by each connection (see ws_codec)
+    """
+
+    def __init__(self) -> None:
+        super().__init__(set)
+        self.connections: dict[tuple[str, str], set[web.WebSocketResponse]] = {}
+        self.users: dict[str, set[str]] = {}
+        self.encodings: WeakKeyDictionary[web.WebSocketResponse, str] = (
+            WeakKeyDictionary()
+        )
+
+    def join(
+        self, room: str, ws: web.WebSocketResponse, user: str, encoding: str = "json"
+    ) -> bool:
+        """
+        Register a connection, return whether it is new
+        """
+        self.encodings[ws] = encoding
+        if (ws, user) in self.get(room, ()):
+            return False
+        self[room].add((ws, user))
+        self.connections.setdefault((room, user), set()).add(ws)
+        self.users.setdefault(room, set()).add(user)
+        return True
+
+    def leave(self, room: str, ws: web.WebSocketResponse, user: str) -> bool:
+        """
+        Unregister a connection, return whether it was registered
+        """
+        conns = self.get(room)
+        if conns is None or (ws, user) not in conns:
+            return False
+        conns.remove((ws, user))
+        if not conns:
+            self.pop(room, None)
+        user_conns = self.connections.get((room, user), set())
+        user_conns.discard(ws)
+        if not user_conns:
+            self.connections.pop((room, user), None)
+            self.users.get(room, set()).discard(user)
+        if not self.users.get(room, True):
+            self.users.pop(room, None)
+        return True
+
+    def rooms_of(self, user: str) -> list[str]:
+        return [room for room, users in self.users.items() if user in users]
+
 
 # {corpus_id: corpus_config} shared between frontend and backend. keys are numbers cast to string
 Config: TypeAlias = dict[str, CorpusConfig]
@@ -135,7 +189,10 @@ Iteration: TypeAlias = tuple[
 
 # one of the main endpoint functions like query(), upload()
 Endpoint: TypeAlias = Callable[
-    [web.Request], Awaitable[web.Response | web.WebSocketResponse | web.FileResponse]
+    [web.Request],
+    Awaitable[
+        web.Response | web.WebSocketResponse | web.FileResponse | web.StreamResponse
+    ],
 ]
 
 
@@ -23,7 +23,7 @@ from io import BytesIO
 from typing import Any, cast, TypeAlias
 from rq.registry import FinishedJobRegistry
 
-from aiohttp import web
+from aiohttp import WSCloseCode, web
 
 # here we remove __slots__ from these superclasses because mypy can't handle them...
 from redis import Redis as RedisConnection
@@ -39,7 +39,7 @@ else:
 
 ParserClass = DefaultParser
 
-from rq.command import PUBSUB_CHANNEL_TEMPLATE
+from rq.command import PUBSUB_CHANNEL_TEMPLATE, send_command, send_stop_job_command
 from rq.connections import get_current_connection
 from rq.job import Job
 
@@ -59,6 +59,7 @@ from .typed import (
     Websockets,
 )
 from .abstract_query.utils import SQLCorpus, sql_str, literal_sql
+from .ws_codec import EncodedMessage
 
 CSV_DELIMITERS = [",", "\t"]
 CSV_QUOTES = ['"', "\b"]
@@ -69,6 +70,9 @@ RESULTS_DIR = os.getenv("RESULTS", "results")
 
 PUBSUB_CHANNEL = PUBSUB_CHANNEL_TEMPLATE % "lcpvian"
 
+# seconds before giving up on sending a message to one websocket connection
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", 10))
+
 PSQL_NAMEDATALEN = int(os.getenv("PSQL_NAMEDATALEN", 64))
 
 TRUES = {"true", "1", "y", "yes"}
@@ -76,6 +80,20 @@ FALSES = {"", "0", "null", "none"}
 
 MESSAGE_TTL = int(os.getenv("REDIS_WS_MESSSAGE_TTL", 5000))
 
+# How the workers notify the app: "pubsub" (PUBSUB_CHANNEL) or "streams" (MESSAGE_STREAM)
+MESSAGE_TRANSPORT = os.getenv("MESSAGE_TRANSPORT", "pubsub").lower()
+MESSAGE_STREAM = "lcpvian::messages"
+MESSAGE_STREAM_MAXLEN = int(os.getenv("MESSAGE_STREAM_MAXLEN", 10000))
+
+# Where a job records the postgres backend running its query, the application
+# name of that backend while it serves the job, and the worker command (see
+# MyWorker.handle_payload) that cancels that backend
+PG_BACKEND_KEY = "pg_backend::%s"
+PG_APPLICATION_NAME = "lcpvian:%s"
+CANCEL_BACKEND_COMMAND = "cancel-backend"
+# Set when a job is stopped on purpose, so that its failure is not reported
+JOB_STOPPED_KEY = "job_stopped::%s"
+
 # The query in get_config is complex because we inject the possible values of the global attributes in corpus_template
 CONFIG_SELECT = """
 mc.corpus_id,
@@ -324,7 +342,7 @@ async def _general_error_handler(
     logging.warning(msg, extra=jso)
     if user:
         connection = request.app["redis"]
-        connection.publish(PUBSUB_CHANNEL, json.dumps(jso, cls=CustomEncoder))
+        _notify(connection, json.dumps(jso, cls=CustomEncoder))
     return None
 
 
@@ -417,6 +435,38 @@ async def gather(
         raise err
 
 
+async def _send_ws(
+    sockets: Websockets,
+    conn: web.WebSocketResponse,
+    data: str | bytes,
+    room: str,
+    user_id: str,
+) -> None:
+    """
+    Send to one connection, and drop it from the sockets if it is gone or too slow.
+    A slow connection is also closed, so that its client knows to reconnect
+    """
+    try:
+        if isinstance(data, bytes):
+            send = conn.send_bytes(data)
+        else:
+            send = conn.send_str(data)
+        await asyncio.wait_for(send, timeout=WS_SEND_TIMEOUT)
+        return
+    except ConnectionResetError:
+        print(f"Connection reset: {room}/{user_id}")
+        sockets.leave(room, conn, user_id)
+        return
+    except asyncio.TimeoutError:
+        print(f"Timed out sending to: {room}/{user_id}")
+    sockets.leave(room, conn, user_id)
+    try:
+        close = conn.close(code=WSCloseCode.GOING_AWAY, message=b"Too slow")
+        await asyncio.wait_for(close, timeout=WS_SEND_TIMEOUT)
+    except (ConnectionResetError, asyncio.TimeoutError):
+        pass
+
+
 async def push_msg(
     sockets: Websockets,
     session_id: str,
@@ -428,31 +478,41 @@ async def push_msg(
     Send JSON websocket message to one or more users/rooms
 
     A message can be sent to all users by passing an empty string as session_id
+
+    The targets are looked up in the routing index of sockets, and the message
+    is sent to all of them concurrently, each send with a timeout (the connections
+    that time out are dropped from sockets). JSON messages
+    are encoded once for each encoding negotiated by the connections
     """
-    sent_to: set[tuple[str | None, str]] = set()
-    # for room, users in sockets.items():
-    for room in list(sockets):  # prevent size change during iteration
-        if room not in sockets:  # in case sockets changed during iteration
+    targets: list[tuple[str, str]]
+    if just:
+        room, user_id = just
+        if room is None or (session_id and room != session_id):
+            return
+        targets = [(room, user_id)]
+    else:
+        rooms = [session_id] if session_id else list(sockets.users)
+        targets = [
+            (room, user_id)
+            for room in rooms
+            for user_id in list(sockets.users.get(room, ()))
+        ]
+    encoded = None if isinstance(msg, bytes) else EncodedMessage(msg)
+    sends: list[Coroutine[Any, Any, None]] = []
+    for room, user_id in targets:
+        if skip and (room, user_id) == skip:
             continue
-        users = sockets[room]
-        if session_id and room != session_id:
+        conns = sockets.connections.get((room, user_id))
+        if not conns:
             continue
-        for conn, user_id in users:
-            if (room, user_id) in sent_to:
-                continue
-            if skip and (room, user_id) == skip:
-                continue
-            if just and (room, user_id) != just:
-                continue
-            try:
-                if isinstance(msg, bytes):
-                    await conn.send_bytes(msg)
-                else:
-                    await conn.send_json(msg)
-            except ConnectionResetError:
-                print(f"Connection reset: {room}/{user_id}")
-                pass
-            sent_to.add((room, user_id))
+        # one connection per user and room, preferably an open one
+        conn = min(conns, key=lambda c: c.closed)
+        data: str | bytes = cast(bytes, msg)
+        if encoded is not None:
+            data = encoded.get(sockets.encodings.get(conn, "json"))
+        sends.append(_send_ws(sockets, conn, data, room, user_id))
+    if sends:
+        await asyncio.gather(*sends)
 
 
 def _format_config_query(template: str) -> str:
@@ -707,6 +767,46 @@ def _get_all_jobs_from_hash(
     return (query_jobs_sorted, sent_jobs, meta_jobs)
 
 
+def _stop_job(connection: "RedisConnection[bytes]", job: Job) -> None:
+    """
+    Stop a running job: ask its worker to cancel the postgres backend running
+    its query (stopping the job alone leaves the query running on the server),
+    then stop the job itself. The key of the backend is deleted here, since a
+    job that gets killed never gets to delete it. The job is marked as stopped
+    first, so that the error raised by the cancelled query is not reported
+    """
+    _mark_stopped(connection, job.id)
+    key = PG_BACKEND_KEY % job.id
+    backend = connection.get(key)
+    if backend and job.worker_name:
+        engine, _, pid = backend.decode("utf-8").partition(":")
+        send_command(
+            connection,
+            job.worker_name,
+            CANCEL_BACKEND_COMMAND,
+            job_id=job.id,
+            engine=engine,
+            pid=int(pid),
+        )
+    if backend:
+        connection.delete(key)
+    send_stop_job_command(connection, job.id)
+
+
+def _mark_stopped(connection: "RedisConnection[bytes]", job_id: str) -> None:
+    """
+    Record that the job is being stopped on purpose
+    """
+    connection.set(JOB_STOPPED_KEY % job_id, 1, ex=MESSAGE_TTL)
+
+
+def _job_stopped(connection: "RedisConnection[bytes]", job: Job) -> bool:
+    """
+    Whether the job was stopped on purpose (see _stop_job)
+    """
+    return bool(connection.exists(JOB_STOPPED_KEY % job.id))
+
+
 def _get_prep_segment(
     segment_id: str, sentence_jobs: list[Job], first_job: Job
 ) -> tuple[str, int, list]:
@@ -967,9 +1067,27 @@ def _publish_msg(
     """
     if not isinstance(message, (str, bytes)):
         message = json.dumps(message, cls=CustomEncoder)
-    connection.set(msg_id, message)
-    connection.expire(msg_id, MESSAGE_TTL)
-    connection.publish(PUBSUB_CHANNEL, json.dumps({"msg_id": msg_id}))
+    connection.set(msg_id, message, ex=MESSAGE_TTL)
+    _notify(connection, json.dumps({"msg_id": msg_id}))
+    return None
+
+
+def _notify(connection: "RedisConnection[bytes]", data: str) -> None:
+    """
+    Send a notification to the app, through the configured MESSAGE_TRANSPORT
+
+    Stream entries stay available until the app acknowledges them, so they
+    are not lost while the app is disconnected
+    """
+    if MESSAGE_TRANSPORT == "streams":
+        connection.xadd(
+            MESSAGE_STREAM,
+            {"data": data},
+            maxlen=MESSAGE_STREAM_MAXLEN,
+            approximate=True,
+        )
+    else:
+        connection.publish(PUBSUB_CHANNEL, data)
     return None
 
 
@@ -1,6 +1,12 @@
+import asyncio
 import json
+import os
 import traceback
 
+from collections import OrderedDict
+from collections.abc import Awaitable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from lark.exceptions import UnexpectedToken
 from typing import cast, Any
 
@@ -8,7 +14,19 @@ from .cqp_to_json import full_cqp_to_json
 from .dqd_parser import convert
 from .textsearch_to_json import textsearch_to_json
 from .typed import JSONObject
-from .utils import _get_all_attributes, _get_all_labels
+from .utils import _get_all_attributes, _get_all_labels, hasher
+
+# Number of validation results kept, by corpus, corpus config and query
+VALIDATE_CACHE_SIZE = int(os.getenv("VALIDATE_CACHE_SIZE", 1024))
+# Seconds to wait for the next edit of a room's query before validating it
+VALIDATE_DEBOUNCE = float(os.getenv("VALIDATE_DEBOUNCE", 0.2))
+# Parsing runs in this many threads, or processes if VALIDATE_PROCESSES is true
+VALIDATE_WORKERS = int(os.getenv("VALIDATE_WORKERS", 2))
+VALIDATE_PROCESSES = os.getenv("VALIDATE_PROCESSES", "false").lower() in (
+    "true",
+    "1",
+    "yes",
+)
 
 
 def process_refs(
@@ -277,3 +295,106 @@ def validate(
             }
         result["kind"] = kind
     return result
+
+
+class QueryValidator:
+    """
+    Validate the queries edited over websockets away from the event loop:
+    the latest query of each user in a room is validated once its edits pause for
+    VALIDATE_DEBOUNCE seconds, and the results are cached by corpus,
+    version of the corpus config and query
+    """
+
+    def __init__(
+        self,
+        workers: int = VALIDATE_WORKERS,
+        processes: bool = VALIDATE_PROCESSES,
+        debounce: float = VALIDATE_DEBOUNCE,
+        cache_size: int = VALIDATE_CACHE_SIZE,
+    ):
+        self._executor: Executor = (
+            ProcessPoolExecutor(workers)
+            if processes
+            else ThreadPoolExecutor(workers, thread_name_prefix="validate")
+        )
+        self._debounce = debounce
+        self._cache_size = cache_size
+        self._cache: OrderedDict[tuple[str, str, str, str], JSONObject] = OrderedDict()
+        # validations running, so that identical queries share them
+        self._running: dict[tuple[str, str, str, str], asyncio.Future] = {}
+        # corpus id -> (config, version of the config)
+        self._versions: dict[str, tuple[dict, str]] = {}
+        # (room, user) -> validation waiting for the edits to pause or running
+        self._pending: dict[tuple[str, str], asyncio.Task] = {}
+
+    def config_version(self, corpus: str, conf: dict) -> str:
+        """
+        A hash of the config of the corpus, only computed again when it is replaced
+        """
+        known = self._versions.get(corpus)
+        if known and known[0] is conf:
+            return known[1]
+        version = hasher(json.dumps(conf, sort_keys=True, default=str))
+        self._versions[corpus] = (conf, version)
+        return version
+
+    async def validate(
+        self, config: dict, corpus: Any, query: str = "", kind: str = "json"
+    ) -> JSONObject:
+        """
+        Validate the query against the config of the corpus (not the whole config)
+        """
+        conf = config.get(corpus) or {}
+        key = (str(corpus), self.config_version(str(corpus), conf), kind, hasher(query))
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        running = self._running.get(key)
+        if running is None:
+            job = partial(validate, query, kind, config={corpus: conf}, corpus=corpus)
+            running = asyncio.get_running_loop().run_in_executor(self._executor, job)
+            self._running[key] = running
+            # cache the result even if the room moves on to another query
+            running.add_done_callback(partial(self._store, key))
+        return await asyncio.shield(running)
+
+    def _store(self, key: tuple[str, str, str, str], future: asyncio.Future) -> None:
+        self._running.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        self._cache[key] = future.result()
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def debounce(self, ident: tuple[str, str], respond: Awaitable[None]) -> None:
+        """
+        Replace the validation waiting or running for the user in the room with this
+        one: the queries edited by other users of the room are validated separately
+        """
+        if previous := self._pending.pop(ident, None):
+            previous.cancel()
+        task = asyncio.ensure_future(self._after_pause(ident, respond))
+        self._pending[ident] = task
+
+    async def _after_pause(
+        self, ident: tuple[str, str], respond: Awaitable[None]
+    ) -> None:
+        try:
+            await asyncio.sleep(self._debounce)
+            await respond
+        except asyncio.CancelledError:
+            # never awaited if cancelled during the pause
+            if asyncio.iscoroutine(respond):
+                respond.close()
+            raise
+        except Exception as err:
+            room, user = ident
+            print(f"Could not validate the query of {user} in room {room}:", err)
+        finally:
+            if self._pending.get(ident) is asyncio.current_task():
+                self._pending.pop(ident, None)
+
+    def shutdown(self) -> None:
+        for task in self._pending.values():
+            task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
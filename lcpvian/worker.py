@@ -5,7 +5,9 @@ custom rq worker for lcpvian: initialise db connection pools
 and store them on the custom job class.
 
 This allows us to submit queries to the db pool without
-restarting/recreating the pools each time.
+restarting/recreating the pools each time: the worker does not fork
+a work horse per job (it is an rq SimpleWorker), so the pools live as
+long as the worker process.
 
 This worker should be started with `python -m lcpvian worker`.
 
@@ -23,22 +25,36 @@ from __future__ import annotations
 import asyncio
 import logging
 import os
+import threading
+import time
 import urllib.parse
 
+from contextlib import asynccontextmanager
+from collections.abc import AsyncIterator, Awaitable
 from typing import Any
 
+import asyncpg
 import uvloop
 
 from redis import Redis
+from rq.command import parse_payload
 from rq.connections import Connection
-from rq.job import Job
-from rq.worker import Worker
-from sqlalchemy.ext.asyncio import create_async_engine
+from rq.job import Job, JobStatus
+from rq.queue import Queue
+from rq.worker import SimpleWorker
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
 from sqlalchemy.pool import NullPool
 
 from sshtunnel import SSHTunnelForwarder
 
-from .utils import load_env
+from .utils import (
+    CANCEL_BACKEND_COMMAND,
+    PG_APPLICATION_NAME,
+    PG_BACKEND_KEY,
+    _job_stopped,
+    _mark_stopped,
+    load_env,
+)
 
 load_env()
 
@@ -87,6 +103,9 @@ UPLOAD_TIMEOUT = int(os.getenv("UPLOAD_TIMEOUT", 43200))
 
 PORT = int(os.getenv("SQL_PORT", 25432))
 
+# Seconds between pg_cancel_backend and pg_terminate_backend when stopping a job
+QUERY_CANCEL_GRACE = float(os.getenv("QUERY_CANCEL_GRACE", 5))
+
 REDIS_DB_INDEX = int(os.getenv("REDIS_DB_INDEX", 0))
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 redis_url: str = f"{REDIS_URL}/{REDIS_DB_INDEX}" if REDIS_DB_INDEX > -1 else REDIS_URL
@@ -145,18 +164,230 @@ upload_kwargs = dict(
     isolation_level="READ COMMITTED",
 )
 if not UPLOAD_POOL:
-    upload_kwargs["pool_class"] = NullPool  # type: ignore
+    upload_kwargs["poolclass"] = NullPool  # type: ignore
+    # NullPool does not accept sizing arguments
+    upload_kwargs.pop("pool_size", None)
+    upload_kwargs.pop("pool_timeout", None)
+
+
+class EngineRegistry:
+    """
+    The SQLAlchemy engines (and their connection pools) of a worker process.
+
+    The registry is created once by MyWorker and handed to every job it performs,
+    so jobs no longer create three new engines each. MyWorker runs the jobs in its
+    own process, so the pools are reused from one job to the next; should the
+    registry be used in a forked process, the pools inherited from the parent are
+    detached (without closing the parent's connections) and repopulated.
+    Coroutine jobs run on a loop that lives as long as the process, so that pooled
+    asyncpg connections stay attached to the loop they were opened in.
+    """
+
+    def __init__(self) -> None:
+        self.engines: dict[str, AsyncEngine] = {
+            "query": create_async_engine(query_connstr, **query_kwargs),
+            "upload": create_async_engine(upload_connstr, **upload_kwargs),
+            "web": create_async_engine(web_connstr, **upload_kwargs),
+        }
+        self._pid: int = os.getpid()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # engine name -> [number of acquisitions, total wait, max wait]
+        self._waits: dict[str, list[float]] = {k: [0, 0.0, 0.0] for k in self.engines}
+
+    def _check_process(self) -> None:
+        """
+        Detach the pools inherited from the parent process after a fork
+        """
+        if self._pid == os.getpid():
+            return
+        for engine in self.engines.values():
+            engine.sync_engine.dispose(close=False)
+        self._pid = os.getpid()
+        self._loop = None
+        self._waits = {k: [0, 0.0, 0.0] for k in self.engines}
+
+    @property
+    def query(self) -> AsyncEngine:
+        self._check_process()
+        return self.engines["query"]
+
+    @property
+    def upload(self) -> AsyncEngine:
+        self._check_process()
+        return self.engines["upload"]
+
+    @property
+    def web(self) -> AsyncEngine:
+        self._check_process()
+        return self.engines["web"]
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        self._check_process()
+        if self._loop is None or self._loop.is_closed():
+            self._loop = uvloop.new_event_loop()
+        return self._loop
+
+    def run(self, coro: Awaitable[Any]) -> Any:
+        return self.loop.run_until_complete(coro)
+
+    @asynccontextmanager
+    async def connect(
+        self, name: str, begin: bool = False, job: Job | None = None
+    ) -> AsyncIterator[AsyncConnection]:
+        """
+        Acquire a connection from the named engine and record how long it took
+
+        If a job is passed, the PID of the postgres backend serving the connection
+        is stored in redis while the connection is in use, so that stopping the job
+        can cancel its query on the server (see MyWorker.cancel_backend). The backend
+        carries the application name of the job meanwhile, so that the worker does
+        not cancel the query of another job if the backend has moved on to it
+        """
+        engine: AsyncEngine = getattr(self, name)
+        start = time.perf_counter()
+        acquire: Any = engine.begin() if begin else engine.connect()
+        async with acquire as conn:
+            waited = time.perf_counter() - start
+            waits = self._waits[name]
+            waits[0] += 1
+            waits[1] += waited
+            waits[2] = max(waits[2], waited)
+            if job is None:
+                yield conn
+                return
+            raw = await conn.get_raw_connection()
+            driver: Any = raw.driver_connection
+            pid = driver.get_server_pid()
+            # no transaction is open yet: the setting outlives the job's transactions
+            await driver.execute(
+                "SELECT set_config('application_name', $1, false)",
+                PG_APPLICATION_NAME % job.id,
+            )
+            key = PG_BACKEND_KEY % job.id
+            ttl = job.timeout if job.timeout and job.timeout > 0 else UPLOAD_TIMEOUT
+            job.connection.set(key, f"{name}:{pid}", ex=int(ttl))
+            try:
+                yield conn
+            finally:
+                job.connection.delete(key)
+                try:
+                    await driver.execute("RESET application_name")
+                except Exception:
+                    # e.g. aborted transaction: the next job sets its own name
+                    pass
+
+    def stats(self) -> dict[str, dict[str, int | float]]:
+        """
+        Report the state of each pool: checked-out/idle connections, overflow
+        and the time spent waiting for a connection
+        """
+        ret: dict[str, dict[str, int | float]] = {}
+        for name, engine in self.engines.items():
+            pool: Any = engine.sync_engine.pool
+            count, total, longest = self._waits[name]
+            ret[name] = {
+                "size": pool.size() if hasattr(pool, "size") else 0,
+                "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else 0,
+                "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else 0,
+                "overflow": pool.overflow() if hasattr(pool, "overflow") else 0,
+                "acquisitions": int(count),
+                "avg_wait": round(total / count, 4) if count else 0.0,
+                "max_wait": round(longest, 4),
+            }
+        return ret
+
+
+_ENGINES: EngineRegistry | None = None
+
+
+def get_engines() -> EngineRegistry:
+    """
+    Return the engine registry of the current process, creating it if needed
+    """
+    global _ENGINES
+    if _ENGINES is None:
+        _ENGINES = EngineRegistry()
+    return _ENGINES
 
 
 class SQLJob(Job):
-    def __init__(self, *args: Any, **kwargs: Any) -> None:
-        super().__init__(*args)
-        self._pool = create_async_engine(query_connstr, **query_kwargs)
-        self._upool = create_async_engine(upload_connstr, **upload_kwargs)
-        self._wpool = create_async_engine(web_connstr, **upload_kwargs)
+    """
+    Jobs get their engines from the worker's registry instead of creating their own
+    """
 
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._engines: EngineRegistry | None = None
+        # Whether the job runs and the task of a coroutine job, so that it can be
+        # stopped from another thread
+        self._interrupt_lock = threading.Lock()
+        self._running = False
+        self._task: asyncio.Task | None = None
+        self._stop = threading.Event()
+
+    @property
+    def engines(self) -> EngineRegistry:
+        if self._engines is None:
+            self._engines = get_engines()
+        return self._engines
+
+    @engines.setter
+    def engines(self, value: EngineRegistry) -> None:
+        self._engines = value
+
+    @property
+    def _pool(self) -> AsyncEngine:
+        return self.engines.query
+
+    @property
+    def _upool(self) -> AsyncEngine:
+        return self.engines.upload
+
+    @property
+    def _wpool(self) -> AsyncEngine:
+        return self.engines.web
+
+    def _execute(self) -> Any:
+        with self._interrupt_lock:
+            self._running = True
+        try:
+            result = self.func(*self.args, **self.kwargs)
+            if not asyncio.iscoroutine(result):
+                return result
+            task = self.engines.loop.create_task(result)
+            with self._interrupt_lock:
+                self._task = task
+                if self._stop.is_set():
+                    task.cancel()
+            return self.engines.run(task)
+        finally:
+            with self._interrupt_lock:
+                self._running = False
+                self._task = None
+
+    def interrupt(self) -> bool:
+        """
+        Stop the job from another thread: the task of a coroutine job (all the
+        jobs of the app are) is cancelled, or cancelled as soon as it is created
+        if the job did not get there yet. Nothing is raised asynchronously in the
+        thread of the job, which could leave redis pipelines or connection pools
+        in a broken state; a query running for the job is cancelled on the server
+        (see MyWorker.cancel_backend). Return whether the job was still running
+        """
+        with self._interrupt_lock:
+            self._stop.set()
+            if self._task is not None:
+                self._task.get_loop().call_soon_threadsafe(self._task.cancel)
+            return self._running
+
+
+class MyWorker(SimpleWorker):
+    """
+    Run the jobs in the worker process instead of a forked work horse, so that
+    they share the worker's engines (and connection pools) for its whole lifetime
+    """
 
-class MyWorker(Worker):
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         kwargs["job_class"] = SQLJob
         print("starting a worker", args, kwargs)
@@ -165,9 +396,113 @@ class MyWorker(Worker):
                 4  # full queries need to be able to run batches in parallel
             )
         super().__init__(*args, **kwargs)
-
-
-async def work(queue: str = "internal", all_in_one: bool = False) -> None:
+        self.engines: EngineRegistry = get_engines()
+        self._current_job: Job | None = None
+
+    def perform_job(self, job: Job, queue: Queue) -> bool:
+        if isinstance(job, SQLJob):
+            job.engines = self.engines
+        self._current_job = job
+        try:
+            return super().perform_job(job, queue)
+        finally:
+            self._current_job = None
+            self.log.debug("Pool stats after job %s: %s", job.id, self.engines.stats())
+
+    def kill_horse(self, sig: Any = None) -> None:
+        """
+        There is no work horse to kill: rq's stop-job command would otherwise kill
+        the process group of the worker itself. The running job is asked to stop
+        instead (see SQLJob.interrupt), and its query cancelled on the server
+        (see cancel_backend)
+        """
+        job = self._current_job
+        if not isinstance(job, SQLJob):
+            self.log.info("No running job to stop")
+            return
+        # before the job fails, so that its failure is not reported
+        _mark_stopped(self.connection, job.id)
+        if job.interrupt():
+            self.log.info("Interrupted job %s", job.id)
+
+    def handle_job_failure(
+        self,
+        job: Job,
+        queue: Queue,
+        started_job_registry: Any = None,
+        exc_string: str = "",
+    ) -> None:
+        """
+        The query of a job may be cancelled (see _stop_job) before the stop-job
+        command reaches the worker: the job still ends as stopped, not failed
+        """
+        if _job_stopped(self.connection, job):
+            self._stopped_job_id = job.id
+        super().handle_job_failure(job, queue, started_job_registry, exc_string)
+
+    def handle_exception(self, job: Job, *exc_info: Any) -> None:
+        """
+        The error raised in a stopped job (e.g. QueryCanceledError) is expected
+        """
+        if job.get_status(refresh=False) == JobStatus.STOPPED:
+            self.log.info("Job %s was stopped", job.id)
+            return
+        super().handle_exception(job, *exc_info)
+
+    def handle_payload(self, message: dict[str, Any]) -> None:
+        """
+        Handle our own commands on top of rq's (shutdown, kill-horse, stop-job)
+        """
+        payload = parse_payload(message)
+        if payload.get("command") != CANCEL_BACKEND_COMMAND:
+            return super().handle_payload(message)
+        # The pubsub thread must not wait for the grace period
+        threading.Thread(
+            target=self.cancel_backend,
+            args=(payload["job_id"], payload["engine"], int(payload["pid"])),
+            daemon=True,
+        ).start()
+
+    def cancel_backend(self, job_id: str, engine: str, pid: int) -> None:
+        """
+        Cancel the query that the backend with this PID is running for the job,
+        and terminate the backend if it is still busy with it after the grace period
+        """
+        try:
+            asyncio.run(self._signal_backend(job_id, engine, pid))
+        except Exception as err:
+            print(f"Could not cancel backend {pid} of job {job_id}: {err}")
+
+    async def _signal_backend(self, job_id: str, engine: str, pid: int) -> None:
+        # Signal as the role that opened the backend, through a connection
+        # of our own (the pools are attached to the loop of the running job)
+        url = self.engines.engines[engine].url.set(drivername="postgresql")
+        conn = await asyncpg.connect(url.render_as_string(hide_password=False))
+        # The backend may have moved on to another job: only signal it while
+        # it carries the application name of this job
+        signal = (
+            "SELECT {}(pid) FROM pg_stat_activity"
+            " WHERE pid = $1 AND application_name = $2 AND state <> 'idle'"
+        )
+        app_name = PG_APPLICATION_NAME % job_id
+        try:
+            print(f"Cancelling backend {pid} of job {job_id}")
+            cancelled = await conn.fetchval(
+                signal.format("pg_cancel_backend"), pid, app_name
+            )
+            if cancelled is None:
+                print(f"Backend {pid} no longer runs a query of job {job_id}")
+                return
+            await asyncio.sleep(QUERY_CANCEL_GRACE)
+            if await conn.fetchval(
+                signal.format("pg_terminate_backend"), pid, app_name
+            ):
+                print(f"Terminated backend {pid} of job {job_id}")
+        finally:
+            await conn.close()
+
+
+def work(queue: str = "internal", all_in_one: bool = False) -> None:
     valid_queues = ("internal", "query", "background")
     assert queue in valid_queues, TypeError(
         f"Tried to run a worker with an invalid queue name ({queue}). The queue should be one of: {', '.join(q for q in valid_queues)}"
@@ -182,8 +517,9 @@ def start_worker(queue: str = "internal") -> None:
     if all_in_one in ("0", "false", "FALSE", "False"):
         all_in_one = False
     try:
-        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
-            runner.run(work(queue, all_in_one=all_in_one))
+        # no event loop may be running here: the jobs run their coroutines
+        # on the loop of the engine registry, in this process
+        work(queue, all_in_one=all_in_one)
     except KeyboardInterrupt:
         print("Worker stopped.")
 
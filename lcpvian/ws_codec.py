@@ -0,0 +1,132 @@
+"""
+ws_codec.py: compact encodings for the large messages sent over /ws
+
+Every client gets JSON text frames, compressed with permessage-deflate when the
+browser negotiates it (WS_COMPRESS). A client can also ask for binary frames
+by listing the encodings it understands in its "joined" message, e.g.
+{"action": "joined", ..., "encodings": ["msgpack+zstd", "zstd"]}: the first one
+available on the server is used for that connection, and the client is told
+which one with an "encoding" message. Messages smaller than WS_BINARY_MIN_BYTES
+are still sent as JSON text.
+
+A binary frame starts with a 4 byte header: b"LC", the version of the format
+and the id of the encoding (see ENCODINGS), followed by the encoded message.
+
+msgpack and zstd are optional (pip install lcpvian[ws]): the encodings needing
+a missing library are not offered.
+"""
+
+import json
+import os
+import time
+
+from collections.abc import Callable
+from typing import Any
+
+try:
+    import msgpack  # type: ignore
+except ImportError:
+    msgpack = None
+
+try:
+    import pyzstd  # type: ignore
+except ImportError:
+    pyzstd = None  # type: ignore
+
+WS_COMPRESS = os.getenv("WS_COMPRESS", "true").lower() not in ("", "0", "false")
+WS_BINARY_MIN_BYTES = int(os.getenv("WS_BINARY_MIN_BYTES", 16384))
+WS_ZSTD_LEVEL = int(os.getenv("WS_ZSTD_LEVEL", 3))
+
+MAGIC = b"LC"
+VERSION = 1
+
+
+def _zstd(raw: bytes) -> bytes:
+    return pyzstd.compress(raw, WS_ZSTD_LEVEL)
+
+
+# name -> (id in the header, encoder of (JSON text, message), available)
+ENCODINGS: dict[str, tuple[int, Callable[[bytes, Any], bytes], bool]] = {
+    "zstd": (1, lambda raw, msg: _zstd(raw), pyzstd is not None),
+    "msgpack": (2, lambda raw, msg: msgpack.packb(msg), msgpack is not None),
+    "msgpack+zstd": (
+        3,
+        lambda raw, msg: _zstd(msgpack.packb(msg)),
+        msgpack is not None and pyzstd is not None,
+    ),
+}
+
+
+class EncodingStats:
+    """
+    Bytes and CPU time spent per encoding, to compare them with plain JSON
+    """
+
+    def __init__(self) -> None:
+        # encoding -> [messages, JSON bytes, encoded bytes, seconds]
+        self.totals: dict[str, list[float]] = {}
+
+    def add(self, encoding: str, json_size: int, size: int, seconds: float) -> None:
+        totals = self.totals.setdefault(encoding, [0, 0, 0, 0.0])
+        totals[0] += 1
+        totals[1] += json_size
+        totals[2] += size
+        totals[3] += seconds
+
+    def report(self) -> dict[str, dict[str, float]]:
+        return {
+            encoding: {
+                "messages": int(n),
+                "json_bytes": int(json_size),
+                "bytes": int(size),
+                "ratio": round(size / json_size, 4) if json_size else 1.0,
+                "ms_per_message": round(seconds * 1000 / n, 3) if n else 0.0,
+            }
+            for encoding, (n, json_size, size, seconds) in self.totals.items()
+        }
+
+
+stats = EncodingStats()
+
+
+def negotiate(requested: Any) -> str:
+    """
+    The first encoding requested by a client that is available, or "json"
+    """
+    if not isinstance(requested, list):
+        return "json"
+    for name in requested:
+        if name in ENCODINGS and ENCODINGS[name][2]:
+            return str(name)
+    return "json"
+
+
+class EncodedMessage:
+    """
+    A message to send to several connections, encoded once per encoding
+    """
+
+    def __init__(self, msg: Any):
+        self.msg = msg
+        start = time.perf_counter()
+        self.text = json.dumps(msg)
+        self._raw = self.text.encode("utf-8")
+        self._json_seconds = time.perf_counter() - start
+        self._encoded: dict[str, str | bytes] = {}
+
+    def get(self, encoding: str = "json") -> str | bytes:
+        if encoding == "json" or len(self._raw) < WS_BINARY_MIN_BYTES:
+            encoding = "json"
+        if encoding in self._encoded:
+            return self._encoded[encoding]
+        start = time.perf_counter()
+        encoded: str | bytes = self.text
+        size = len(self._raw)
+        if encoding != "json":
+            code, encode, _ = ENCODINGS[encoding]
+            encoded = MAGIC + bytes((VERSION, code)) + encode(self._raw, self.msg)
+            size = len(encoded)
+        seconds = self._json_seconds + time.perf_counter() - start
+        stats.add(encoding, len(self._raw), size, seconds)
+        self._encoded[encoding] = encoded
+        return encoded
@@ -1,3 +1,5 @@
 #!/bin/bash
 
 python lark_to_cobquec.py dqd_grammar.lark cobquec.auto.json
+# cache the tables of the LALR parsers (e.g. cqp_lalr.lark.cache)
+(cd .. && python -c "import lcpvian.cqp_to_json")
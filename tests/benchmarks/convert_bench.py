@@ -0,0 +1,74 @@
+"""
+Compare the row by row and the vectorised frequency table paths of convert.py
+
+    python tests/benchmarks/convert_bench.py [number of rows] [number of distinct bodies]
+
+Both paths sum the same synthetic frequency output (two batches) and filter it;
+the script checks that they give identical results and prints their timings.
+"""
+
+import random
+import sys
+import time
+
+from lcpvian import convert
+
+RESULT_SETS = [
+    {"type": "plain", "name": "kwic", "attributes": []},
+    {
+        "type": "analysis",
+        "name": "freq",
+        "attributes": [
+            {"name": "lemma", "type": "string"},
+            {"name": "upos", "type": "string"},
+            {"name": "frequency", "type": "aggregate"},
+        ],
+        "total": [{"name": "frequency", "type": "aggregate"}],
+    },
+]
+POST_PROCESSES = {
+    2: [{"comparison": {"left": "frequency", "comparator": ">", "right": 3}}]
+}
+UPOS = ["NOUN", "VERB", "ADJ", "ADV", "PRON", "DET", "ADP"]
+
+
+def make_batch(n_rows: int, n_bodies: int, seed: int) -> list:
+    rng = random.Random(seed)
+    rows: list = [[0, [n_rows]]]
+    for _ in range(n_rows):
+        rows.append(
+            [2, [False, f"lemma{rng.randrange(n_bodies)}", rng.choice(UPOS), 1]]
+        )
+    rows.append([2, [True, n_rows]])
+    return rows
+
+
+def run(batches: list[list], vectorised: bool) -> tuple[float, list]:
+    convert.VECTORISED_STATS = vectorised
+    result_set = RESULT_SETS[1]
+    totals: dict = {}
+    start = time.perf_counter()
+    existing: dict = {}
+    to_send: dict = {}
+    for batch in batches:
+        rows = [rest for key, rest in batch if key == 2]
+        totals = convert._frequency_totals(rows, result_set, totals)
+        existing = {2: [list(body) + values for body, values in totals.items()]}
+        to_send = convert._apply_filters(existing, POST_PROCESSES)
+    return time.perf_counter() - start, [existing[2], to_send[2]]
+
+
+def main() -> None:
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    n_bodies = int(sys.argv[2]) if len(sys.argv) > 2 else 2_000
+    batches = [make_batch(n_rows // 2, n_bodies, seed) for seed in (1, 2)]
+    python_time, python_res = run(batches, vectorised=False)
+    numpy_time, numpy_res = run(batches, vectorised=True)
+    assert python_res == numpy_res, "The vectorised results differ"
+    print(f"{n_rows} rows, {len(python_res[0])} distinct bodies")
+    print(f"row by row: {python_time:.2f}s")
+    print(f"vectorised: {numpy_time:.2f}s ({python_time / numpy_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
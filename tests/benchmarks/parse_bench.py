@@ -0,0 +1,78 @@
+"""
+Time the construction of the query parsers and the parsing of queries
+
+    python tests/benchmarks/parse_bench.py [number of repetitions]
+
+Builds each Lark parser from its grammar (the LALR one with and without its cached
+tables), then parses the DQD queries of tests/test_data/*.dqd and the CQP queries
+of tests/test_cqp_to_json.py (which checks that both CQP parsers agree).
+"""
+
+import glob
+import os
+import sys
+import tempfile
+import time
+
+from lark import Lark
+
+from lcpvian import cqp_to_json, cql_to_json, dqd_parser
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), "..", "test_data")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+from tests.test_cqp_to_json import CQP_QUERIES, EARLEY_QUERIES
+
+
+def timed(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main() -> None:
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    lalr_grammar = open(cqp_to_json.cqp_lalr_fn).read()
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = os.path.join(tmp, "cqp_lalr.lark.cache")
+        Lark(lalr_grammar, parser="lalr", start="top", cache=cache)
+        builds = {
+            "DQD earley": lambda: Lark(
+                dqd_parser.dqd_grammar,
+                parser="earley",
+                start="top",
+                postlex=dqd_parser.TreeIndenter(),
+            ),
+            "CQL earley": lambda: Lark(
+                cql_to_json.test_grammar, parser="earley", start="cql_query"
+            ),
+            "CQP earley": lambda: Lark(
+                cqp_to_json.cqp_grammar, parser="earley", start="top"
+            ),
+            "CQP lalr": lambda: Lark(lalr_grammar, parser="lalr", start="top"),
+            "CQP lalr (cached)": lambda: Lark(
+                lalr_grammar, parser="lalr", start="top", cache=cache
+            ),
+        }
+        print("Parser construction")
+        for name, build in builds.items():
+            print(f"  {name:<20} {timed(build, repeat) * 1000:8.2f}ms")
+
+    dqds = [open(f).read() for f in sorted(glob.glob(f"{TEST_DATA}/*.dqd"))]
+    dqd_time = timed(lambda: [dqd_parser.parser.parse(q) for q in dqds], repeat)
+    print(f"Parsing {len(dqds)} DQD queries")
+    print(f"  {'DQD earley':<20} {dqd_time * 1000 / len(dqds):8.2f}ms per query")
+
+    queries = CQP_QUERIES + EARLEY_QUERIES
+    n = len(queries)
+    earley = timed(lambda: [cqp_to_json.cqp_parser.parse(q) for q in queries], repeat)
+    lalr = timed(lambda: [cqp_to_json.parse_cqp(q) for q in queries], repeat)
+    print(f"Parsing {n} CQP queries ({len(CQP_QUERIES)} covered by the LALR grammar)")
+    print(f"  {'CQP earley':<20} {earley * 1000 / n:8.2f}ms per query")
+    print(f"  {'CQP lalr+fallback':<20} {lalr * 1000 / n:8.2f}ms per query")
+    print(f"  {earley / lalr:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
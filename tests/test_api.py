@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+from contextlib import aclosing
+from unittest.mock import patch
+
+from aiohttp import web
+from aiohttp.test_utils import AioHTTPTestCase
+from fakeredis import FakeStrictRedis
+
+from lcpvian.api import search_stream
+from lcpvian.query_classes import (
+    QueryInfo,
+    Request,
+    _request_streams,
+    stream_request,
+)
+
+
+class Authenticator:
+    def __init__(self, app):
+        pass
+
+    async def user_details(self, request):
+        return {}
+
+    def check_corpus_searchable(self, *args, **kwargs):
+        return True
+
+
+class SearchStreamTestCase(AioHTTPTestCase):
+    async def get_application(self):
+        app = web.Application()
+        app["auth_class"] = Authenticator
+        app["config"] = {"1": {"enabled": True}}
+        app["query_buffers"] = {}
+        app["redis"] = FakeStrictRedis()
+        app.router.add_post("/api/corpora/{corpus_id}/search/stream", search_stream)
+        return app
+
+    def cached_query(self, app, request_data):
+        """
+        Stand-in for process_query when the results are cached: they are sent
+        right away, and the request completes before the response is prepared
+        """
+        req = Request(app["redis"], request_data)
+        app["query_buffers"][req.id] = {}
+        qi = QueryInfo("abc", app["redis"], config={})
+        qi.add_request(req)
+
+        async def respond():
+            for n in range(3):
+                await req.send_sync(app, {"0": [n]}, {"action": "query_result", "n": n})
+            qi.delete_request(req)
+
+        self.responding = asyncio.ensure_future(respond())
+        return req, qi, object()
+
+    async def late_stream(self, qi, req):
+        """
+        Read the stream only once the cached query has sent all its payloads
+        """
+        await self.responding
+        async with aclosing(stream_request(qi, req)) as payloads:
+            async for payload in payloads:
+                yield payload
+
+    async def test_cached_query(self):
+        """
+        The payloads of a query served from the cache are all streamed
+        """
+        with (
+            patch("lcpvian.api.process_query", self.cached_query),
+            patch("lcpvian.api.stream_request", self.late_stream),
+            patch("lcpvian.api.validate", return_value={"status": 200, "json": {}}),
+        ):
+            resp = await self.client.post(
+                "/api/corpora/1/search/stream", json={"query": "x"}
+            )
+            body = await resp.text()
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp.headers["Content-Type"], "application/x-ndjson")
+        lines = [json.loads(line) for line in body.splitlines() if line]
+        self.assertEqual([line["n"] for line in lines], [0, 1, 2])
+        self.assertEqual(self.app["query_buffers"], {})
+        self.assertEqual(_request_streams, {})
+
+    async def test_rejected_query(self):
+        """
+        The stream registered for a query that does not start is unregistered
+        """
+        error = {"status": 400, "error": "bad query"}
+        with patch("lcpvian.api.validate", return_value=error):
+            resp = await self.client.post(
+                "/api/corpora/1/search/stream", json={"query": "x"}
+            )
+        self.assertEqual(resp.status, 400)
+        self.assertEqual(_request_streams, {})
@@ -0,0 +1,78 @@
+import unittest
+
+import numpy as np
+
+from lcpvian.char_ranges import (
+    RangeMatcher,
+    line_ranges,
+    parse_char_range,
+    ranges_from_bytes,
+    ranges_to_bytes,
+)
+
+
+class CharRangesTestCase(unittest.TestCase):
+    def test_parse_char_range(self):
+        """
+        The char range is read from the last item of a line, as a string or in a dict
+        """
+        self.assertEqual(parse_char_range([1, 0, "[3,12)"]), (3, 12))
+        self.assertEqual(parse_char_range([1, {"char_range": "[0,4)"}]), (0, 4))
+        self.assertIsNone(parse_char_range([1, 0, "no range"]))
+        self.assertIsNone(parse_char_range([1, 0, 7]))
+        self.assertIsNone(parse_char_range([]))
+
+    def test_line_ranges_round_trip(self):
+        """
+        Lines without a char range get the empty range [0, 0)
+        """
+        lines = [[-1, [1, "[0,10)"]], [-2, ["meta"]], [-1, [2, "[10,20)"]]]
+        ranges = line_ranges(lines)
+        self.assertEqual(ranges.tolist(), [[0, 10], [0, 0], [10, 20]])
+        self.assertEqual(
+            ranges_from_bytes(ranges_to_bytes(ranges)).tolist(), ranges.tolist()
+        )
+
+    def test_merged_intervals(self):
+        """
+        Overlapping and touching ranges merge, empty ones are dropped
+        """
+        matcher = RangeMatcher([[10, 20], (0, 5), [5, 8], [15, 30], [40, 40], [50, 60]])
+        self.assertEqual(matcher.starts.tolist(), [0, 10, 50])
+        self.assertEqual(matcher.ends.tolist(), [8, 30, 60])
+
+    def test_overlaps(self):
+        """
+        A range overlaps the union if it shares at least one char with it
+        """
+        matcher = RangeMatcher([[0, 5], [10, 20]])
+        ranges = np.array(
+            [[4, 6], [5, 10], [19, 25], [20, 30], [0, 0], [12, 13], [-5, 0]],
+            dtype=np.int64,
+        )
+        self.assertEqual(
+            matcher.overlaps(ranges).tolist(),
+            [True, False, True, False, False, True, False],
+        )
+        self.assertFalse(RangeMatcher([]).overlaps(ranges).any())
+
+    def test_matches_brute_force(self):
+        """
+        The vectorised test agrees with checking each range against each interval
+        """
+        rng = np.random.default_rng(0)
+        starts = rng.integers(0, 200, size=(40, 1))
+        union = np.hstack([starts, starts + rng.integers(0, 15, size=(40, 1))])
+        starts = rng.integers(0, 200, size=(200, 1))
+        ranges = np.hstack([starts, starts + rng.integers(0, 15, size=(200, 1))])
+        expected = [
+            lo < up and any(lo < u and l < up for l, u in union.tolist() if l < u)
+            for lo, up in ranges.tolist()
+        ]
+        self.assertEqual(
+            RangeMatcher(union.tolist()).overlaps(ranges).tolist(), expected
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
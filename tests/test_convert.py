@@ -0,0 +1,128 @@
+import random
+import unittest
+
+from unittest.mock import patch
+
+from lcpvian.convert import _apply_filters, _frequency_totals, _group_frequencies
+
+FREQUENCY = {
+    "type": "analysis",
+    "attributes": [
+        {"name": "lemma", "type": "attribute"},
+        {"name": "upos", "type": "attribute"},
+        {"name": "frequency", "type": "aggregate"},
+    ],
+    "total": [{"name": "frequency", "type": "aggregate"}],
+}
+UPOS = ["NOUN", "VERB", "ADJ"]
+
+
+def frequency_rows(n_rows: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    rows: list = []
+    for n in range(n_rows):
+        rows.append([False, f"lemma{rng.randrange(20)}", rng.choice(UPOS), n % 4])
+        if n % 50 == 0:
+            rows.append([True, n])
+    return rows
+
+
+class VectorisedTestCase(unittest.TestCase):
+    """
+    The vectorised paths of convert.py give the same output as the row by row ones
+    """
+
+    def both(self, func, *args):
+        """
+        The output of func on both paths, vectorised from the first row on
+        """
+        with patch("lcpvian.convert.VECTORISED_MIN_ROWS", 1):
+            vectorised = func(*args)
+        with patch("lcpvian.convert.VECTORISED_STATS", False):
+            row_by_row = func(*args)
+        return vectorised, row_by_row
+
+    def test_frequency_totals(self):
+        """
+        The totals are summed by body, in order of first appearance
+        """
+        rows = frequency_rows(500)
+        self.assertIsNotNone(_group_frequencies(rows, FREQUENCY))
+        vectorised, row_by_row = self.both(_frequency_totals, rows, FREQUENCY)
+        self.assertEqual(list(vectorised.items()), list(row_by_row.items()))
+        self.assertEqual(row_by_row[("True",)], [sum(range(0, 500, 50))])
+
+    def test_frequency_totals_so_far(self):
+        """
+        The totals of a batch are added to those of the previous batches
+        """
+        previous = _frequency_totals(frequency_rows(100, seed=2), FREQUENCY)
+        vectorised, row_by_row = self.both(
+            lambda: _frequency_totals(frequency_rows(200), FREQUENCY, dict(previous))
+        )
+        self.assertEqual(list(vectorised.items()), list(row_by_row.items()))
+
+    def test_empty_groups(self):
+        """
+        Rows without attributes, without totals, or no rows at all
+        """
+        only_totals = [[True, 3], [True, 4]]
+        only_attributes = [r for r in frequency_rows(100) if r[0] is False]
+        no_aggregate = {"attributes": [{"name": "lemma", "type": "attribute"}]}
+        for rows, result_set in [
+            (only_totals, FREQUENCY),
+            (only_attributes, FREQUENCY),
+            ([], FREQUENCY),
+            ([[False, "a"], [False, "b"], [False, "a"]], no_aggregate),
+        ]:
+            with self.subTest(rows=rows[:3]):
+                vectorised, row_by_row = self.both(_frequency_totals, rows, result_set)
+                self.assertEqual(list(vectorised.items()), list(row_by_row.items()))
+        self.assertEqual(_frequency_totals(only_totals, FREQUENCY), {("True",): [7]})
+        self.assertEqual(_frequency_totals([], FREQUENCY), {})
+
+    def test_fallback(self):
+        """
+        Rows that pandas cannot sum exactly are summed row by row
+        """
+        floats = [[False, "a", "X", 0.1], [False, "a", "X", 0.2], [True, 0.3]]
+        ragged = [[False, "a", "X", 1], [False, "a", 1]]
+        short = {**FREQUENCY, "attributes": FREQUENCY["attributes"][1:]}
+        self.assertIsNone(_group_frequencies(floats, FREQUENCY))
+        self.assertIsNone(_group_frequencies(ragged, short))
+        vectorised, row_by_row = self.both(_frequency_totals, floats, FREQUENCY)
+        self.assertEqual(vectorised, row_by_row)
+        self.assertEqual(vectorised[("False", "a", "X")], [0.1 + 0.2])
+
+    def test_filters(self):
+        """
+        The filters keep the same rows in the same order, without duplicates
+        """
+        totals = _frequency_totals(frequency_rows(300), FREQUENCY)
+        rows = [list(body) + values for body, values in totals.items()]
+        rows += rows[:5]
+        for comparator, value in [(">", 20), ("<=", "20"), ("=", 0), ("!=", 1.5)]:
+            comparison = {"left": "f", "comparator": comparator, "right": value}
+            post = {2: [{"comparison": comparison}]}
+            with self.subTest(comparator=comparator):
+                vectorised, row_by_row = self.both(_apply_filters, {2: rows}, post)
+                self.assertEqual(vectorised, row_by_row)
+                self.assertEqual(
+                    len(vectorised[2]), len(set(map(tuple, vectorised[2])))
+                )
+
+    def test_filters_on_empty_or_text(self):
+        """
+        Empty result sets and non-numeric totals are filtered row by row
+        """
+        post = {2: [{"comparison": {"left": "f", "comparator": "!=", "right": 1}}]}
+        texts = [["a", "b"], ["c", "d"], ["a", "b"]]
+        for rows in ([], texts):
+            with self.subTest(rows=rows):
+                vectorised, row_by_row = self.both(_apply_filters, {2: rows}, post)
+                self.assertEqual(vectorised, row_by_row)
+                self.assertEqual(vectorised[2], rows[:2])
+
+
+if __name__ == "__main__":
+    unittest.main()
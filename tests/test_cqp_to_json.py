@@ -0,0 +1,72 @@
+import unittest
+
+from unittest.mock import patch
+
+from lark.exceptions import LarkError, UnexpectedInput
+
+from lcpvian import cqp_to_json
+from lcpvian.cqp_to_json import cqp_lalr_parser, cqp_parser, parse_cqp
+
+# Queries covered by the LALR grammar (also timed by tests/benchmarks/parse_bench.py)
+CQP_QUERIES = [
+    '"elephant"',
+    '[lemma="be"] [pos="DET"]? [pos="ADJ"]* [lemma="elephant"]',
+    'a:[word="the" & pos="DET"] []{0,3} b:[lemma="dog"%c]',
+    '"the" ("big" | "small") "elephant"',
+    '[lemma!="be"] "a" | "an" [pos="NOUN"]+',
+    '<s> [word="Elephants"%c] [] </s>',
+    '<np type="indef"> "an" [pos="ADJ"]{1,2} "elephant" </np> [lemma="run"]',
+    '[pos="NOUN" | pos="PROPN"]',
+    '[lemma="go"]{2}',
+    '[]* "end"',
+    '"a" []? "b"',
+    '("a" "b")+',
+]
+# Queries that only the Earley grammar covers
+EARLEY_QUERIES = [
+    '[(lemma="a" | lemma="b") & pos="DET"] [pos!="PUNCT"]',
+    '[!(pos="NOUN")]',
+    '[word="x" & !(lemma="y")]',
+]
+
+
+class ParseCQPTestCase(unittest.TestCase):
+    def test_lalr_trees(self):
+        """
+        The LALR parser gives the same trees as the Earley parser
+        """
+        for query in CQP_QUERIES:
+            with self.subTest(query=query):
+                self.assertEqual(cqp_lalr_parser.parse(query), cqp_parser.parse(query))
+
+    def test_lalr_first(self):
+        """
+        The queries covered by the LALR grammar are not parsed with Earley
+        """
+        with patch.object(cqp_to_json, "cqp_parser") as earley:
+            for query in CQP_QUERIES:
+                self.assertEqual(parse_cqp(query), cqp_lalr_parser.parse(query))
+        earley.parse.assert_not_called()
+
+    def test_earley_fallback(self):
+        """
+        The queries that the LALR grammar does not cover are parsed with Earley
+        """
+        for query in EARLEY_QUERIES:
+            with self.subTest(query=query):
+                with self.assertRaises(LarkError):
+                    cqp_lalr_parser.parse(query)
+                self.assertEqual(parse_cqp(query), cqp_parser.parse(query))
+
+    def test_errors(self):
+        """
+        Invalid queries raise the error of the Earley parser
+        """
+        with patch.object(cqp_to_json, "cqp_parser", wraps=cqp_parser) as earley:
+            with self.assertRaises(UnexpectedInput):
+                parse_cqp('[lemma="dog"] within 3')
+        earley.parse.assert_called_once_with('[lemma="dog"] within 3')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import base64
+import json
+import unittest
+import zlib
+
+from unittest.mock import patch
+
+from fakeredis import FakeStrictRedis
+
+from lcpvian import cursor
+from lcpvian.cursor import Cursor
+from lcpvian.query_classes import QueryInfo
+
+
+def query_info(connection, qhash: str = "abc") -> QueryInfo:
+    # QueryInfo moves _batches to batches in the config it is given
+    config = {"_batches": {"b1": 100, "b2": 200, "b3": 300}}
+    return QueryInfo(qhash, connection, config=config)
+
+
+class CursorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeStrictRedis()
+        self.qi = query_info(self.redis)
+        self.qi.query_batches["b1"] = ("h1", 5)
+        self.qi.query_batches["b2"] = ("h2", 10)
+        self.qi.done_batches["b1"] = 100
+        self.qi.done_batches["b2"] = 200
+
+    def test_round_trip(self):
+        """
+        A cursor decodes to the batch and position of its line
+        """
+        token = Cursor.at(self.qi, 8).encode()
+        decoded = Cursor.decode(token)
+        self.assertEqual(
+            (decoded.qhash, decoded.batch, decoded.position), ("abc", "b2", 3)
+        )
+        self.assertEqual(decoded.batches, [["b1", "h1", 5], ["b2", "h2", 10]])
+        self.assertEqual(decoded.resume(self.qi), 8)
+
+    def test_tampered(self):
+        """
+        A cursor whose content was changed by the client is rejected
+        """
+        token = Cursor.at(self.qi, 8).encode()
+        packed, signature = token.split(".")
+        raw = json.loads(zlib.decompress(base64.urlsafe_b64decode(packed + "==")))
+        raw[4][0][2] = 1000
+        forged = base64.urlsafe_b64encode(zlib.compress(json.dumps(raw).encode()))
+        for bad in (
+            f"{forged.decode().rstrip('=')}.{signature}",
+            packed,
+            f"{packed}.",
+            f"{packed}.{signature[:-1]}é",
+        ):
+            with self.subTest(token=bad), self.assertRaises(ValueError):
+                Cursor.decode(bad)
+
+    def test_other_secret(self):
+        """
+        A cursor signed with another secret is rejected
+        """
+        token = Cursor.at(self.qi, 8).encode()
+        with patch.object(cursor, "CURSOR_SECRET", b"another secret"):
+            with self.assertRaises(ValueError):
+                Cursor.decode(token)
+
+    def test_secret(self):
+        """
+        The secret is CURSOR_SECRET, else derived from the JWT key, never the key
+        itself, else random for each process with a warning
+        """
+        env = {"CURSOR_SECRET": "", "JWT_SECRET_KEY": "jwt key"}
+        with patch.dict("os.environ", env):
+            derived = cursor._cursor_secret()
+            self.assertNotIn(b"jwt key", derived)
+            self.assertEqual(derived, cursor._cursor_secret())
+            with patch.dict("os.environ", {"CURSOR_SECRET": "cursor key"}):
+                self.assertEqual(cursor._cursor_secret(), b"cursor key")
+            with patch.dict("os.environ", {"JWT_SECRET_KEY": ""}):
+                with self.assertLogs(level="WARNING"):
+                    random = cursor._cursor_secret()
+                self.assertNotEqual(random, cursor._cursor_secret())
+
+    def test_resume_expired_query(self):
+        """
+        Resuming on an expired query records the batches of the cursor again
+        """
+        token = Cursor.at(self.qi, 8).encode()
+        self.redis.flushall()
+        qi = query_info(self.redis)
+        self.assertEqual(Cursor.decode(token).resume(qi), 8)
+        self.assertEqual(qi.query_batches["b1"].to_list(), ["h1", 5])
+        self.assertEqual(qi.done_batches.to_dict(), {"b1": 100, "b2": 200})
+        with self.assertRaises(ValueError):
+            Cursor.decode(token).resume(query_info(self.redis, "def"))
+
+
+if __name__ == "__main__":
+    unittest.main()
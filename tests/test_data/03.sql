@@ -130,9 +130,17 @@ SET ordercol ,
         AND "t"."token_id" BETWEEN gather."min_seq"::bigint AND gather."max_seq"::bigint) AS "seq"
    FROM gather),
     res1 AS
-  (SELECT DISTINCT 1::int2 AS rstype,
-                   jsonb_build_array("s", jsonb_build_array("seq") , array[lower(match_list."s_char_range"), upper(match_list."s_char_range")])
-   FROM match_list) ,
+  (SELECT 1::int2 AS rstype,
+          jsonb_build_array("s", jsonb_build_array("seq") , array[lower(match_list."s_char_range"), upper(match_list."s_char_range")])
+   FROM
+     (SELECT DISTINCT "s",
+                      "seq",
+                      "s_char_range"
+      FROM match_list
+      ORDER BY "s",
+               "seq") match_list
+   ORDER BY "s",
+            "seq") ,
     res0 AS
   (SELECT 0::int2 AS rstype,
           jsonb_build_array(count(match_list.*))
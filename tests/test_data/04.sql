@@ -54,9 +54,20 @@ WITH RECURSIVE fixed_parts AS
           "tv"
    FROM disjunction0),
                res1 AS
-  (SELECT DISTINCT 1::int2 AS rstype,
-                   jsonb_build_array("s", jsonb_build_array("tv", disjunction_matches) , array[lower(match_list."s_char_range"), upper(match_list."s_char_range")])
-   FROM match_list) ,
+  (SELECT 1::int2 AS rstype,
+          jsonb_build_array("s", jsonb_build_array("tv", disjunction_matches) , array[lower(match_list."s_char_range"), upper(match_list."s_char_range")])
+   FROM
+     (SELECT DISTINCT "s",
+                      "tv",
+                      "disjunction_matches",
+                      "s_char_range"
+      FROM match_list
+      ORDER BY "s",
+               "tv",
+               "disjunction_matches") match_list
+   ORDER BY "s",
+            "tv",
+            "disjunction_matches") ,
                res0 AS
   (SELECT 0::int2 AS rstype,
           jsonb_build_array(count(match_list.*))
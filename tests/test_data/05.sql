@@ -32,9 +32,18 @@ WITH RECURSIVE fixed_parts AS
           "t"
    FROM fixed_parts),
                res1 AS
-  (SELECT DISTINCT 1::int2 AS rstype,
-                   jsonb_build_array("interruptor", jsonb_build_array("t") , array[lower(match_list."interruptor_frame_range"), upper(match_list."interruptor_frame_range")], array[lower(match_list."interruptor_char_range"), upper(match_list."interruptor_char_range")])
-   FROM match_list) ,
+  (SELECT 1::int2 AS rstype,
+          jsonb_build_array("interruptor", jsonb_build_array("t") , array[lower(match_list."interruptor_frame_range"), upper(match_list."interruptor_frame_range")], array[lower(match_list."interruptor_char_range"), upper(match_list."interruptor_char_range")])
+   FROM
+     (SELECT DISTINCT "interruptor",
+                      "t",
+                      "interruptor_frame_range",
+                      "interruptor_char_range"
+      FROM match_list
+      ORDER BY "interruptor",
+               "t") match_list
+   ORDER BY "interruptor",
+            "t") ,
                res2 AS
   (SELECT 2::int2 AS rstype,
           jsonb_build_array(FALSE, "interruptee_agent_region", "interruptor_agent_region", frequency)
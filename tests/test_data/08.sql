@@ -18,9 +18,17 @@ WITH RECURSIVE fixed_parts AS
           "t"
    FROM fixed_parts),
                res1 AS
-  (SELECT DISTINCT 1::int2 AS rstype,
-                   jsonb_build_array("s", jsonb_build_array("t") , array[lower(match_list."s_char_range"), upper(match_list."s_char_range")])
-   FROM match_list) ,
+  (SELECT 1::int2 AS rstype,
+          jsonb_build_array("s", jsonb_build_array("t") , array[lower(match_list."s_char_range"), upper(match_list."s_char_range")])
+   FROM
+     (SELECT DISTINCT "s",
+                      "t",
+                      "s_char_range"
+      FROM match_list
+      ORDER BY "s",
+               "t") match_list
+   ORDER BY "s",
+            "t") ,
                res0 AS
   (SELECT 0::int2 AS rstype,
           jsonb_build_array(count(match_list.*))
@@ -38,9 +38,18 @@ WITH RECURSIVE fixed_parts AS
           "s_frame_range"
    FROM fixed_parts),
                res1 AS
-  (SELECT DISTINCT 1::int2 AS rstype,
-                   jsonb_build_array("s", jsonb_build_array("s_container") , array[lower(match_list."s_frame_range"), upper(match_list."s_frame_range")], array[lower(match_list."s_char_range"), upper(match_list."s_char_range")])
-   FROM match_list) ,
+  (SELECT 1::int2 AS rstype,
+          jsonb_build_array("s", jsonb_build_array("s_container") , array[lower(match_list."s_frame_range"), upper(match_list."s_frame_range")], array[lower(match_list."s_char_range"), upper(match_list."s_char_range")])
+   FROM
+     (SELECT DISTINCT "s",
+                      "s_container",
+                      "s_frame_range",
+                      "s_char_range"
+      FROM match_list
+      ORDER BY "s",
+               "s_container") match_list
+   ORDER BY "s",
+            "s_container") ,
                res0 AS
   (SELECT 0::int2 AS rstype,
           jsonb_build_array(count(match_list.*))
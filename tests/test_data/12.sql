@@ -30,9 +30,17 @@ WITH RECURSIVE fixed_parts AS
           "t3_segment_id"
    FROM fixed_parts),
                res1 AS
-  (SELECT DISTINCT 1::int2 AS rstype,
-                   jsonb_build_array("s", jsonb_build_array("t3") , array[lower(match_list."s_char_range"), upper(match_list."s_char_range")])
-   FROM match_list) ,
+  (SELECT 1::int2 AS rstype,
+          jsonb_build_array("s", jsonb_build_array("t3") , array[lower(match_list."s_char_range"), upper(match_list."s_char_range")])
+   FROM
+     (SELECT DISTINCT "s",
+                      "t3",
+                      "s_char_range"
+      FROM match_list
+      ORDER BY "s",
+               "t3") match_list
+   ORDER BY "s",
+            "t3") ,
                collocates2 AS
   (SELECT "_token_collocate2"."form_id"
    FROM match_list
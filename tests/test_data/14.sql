@@ -54,9 +54,20 @@ WITH RECURSIVE fixed_parts AS
           "t2"
    FROM gather),
                res1 AS
-  (SELECT DISTINCT 1::int2 AS rstype,
-                   jsonb_build_array("s", jsonb_build_array("t1", "t2") , array[lower(match_list."s_char_range"), upper(match_list."s_char_range")])
-   FROM match_list) ,
+  (SELECT 1::int2 AS rstype,
+          jsonb_build_array("s", jsonb_build_array("t1", "t2") , array[lower(match_list."s_char_range"), upper(match_list."s_char_range")])
+   FROM
+     (SELECT DISTINCT "s",
+                      "t1",
+                      "t2",
+                      "s_char_range"
+      FROM match_list
+      ORDER BY "s",
+               "t1",
+               "t2") match_list
+   ORDER BY "s",
+            "t1",
+            "t2") ,
                res2 AS
   (SELECT 2::int2 AS rstype,
           jsonb_build_array(FALSE, "t1_lemma", frequency)
@@ -27,9 +27,18 @@ WITH RECURSIVE fixed_parts AS
           "u_frame_range"
    FROM fixed_parts),
                res1 AS
-  (SELECT DISTINCT 1::int2 AS rstype,
-                   jsonb_build_array("u", jsonb_build_array("t") , array[lower(match_list."u_frame_range"), upper(match_list."u_frame_range")], array[lower(match_list."u_char_range"), upper(match_list."u_char_range")])
-   FROM match_list) ,
+  (SELECT 1::int2 AS rstype,
+          jsonb_build_array("u", jsonb_build_array("t") , array[lower(match_list."u_frame_range"), upper(match_list."u_frame_range")], array[lower(match_list."u_char_range"), upper(match_list."u_char_range")])
+   FROM
+     (SELECT DISTINCT "u",
+                      "t",
+                      "u_frame_range",
+                      "u_char_range"
+      FROM match_list
+      ORDER BY "u",
+               "t") match_list
+   ORDER BY "u",
+            "t") ,
                res2 AS
   (SELECT 2::int2 AS rstype,
           jsonb_build_array(FALSE, "u_agent_annee_naissance", "u_agent_region", frequency)
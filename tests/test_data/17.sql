@@ -56,9 +56,17 @@ WITH RECURSIVE fixed_parts AS
         AND "t"."token_id" BETWEEN gather."min_seq"::bigint AND gather."max_seq"::bigint) AS "seq"
    FROM gather),
                res1 AS
-  (SELECT DISTINCT 1::int2 AS rstype,
-                   jsonb_build_array("s", jsonb_build_array("t3") , array[lower(match_list."s_char_range"), upper(match_list."s_char_range")])
-   FROM match_list) ,
+  (SELECT 1::int2 AS rstype,
+          jsonb_build_array("s", jsonb_build_array("t3") , array[lower(match_list."s_char_range"), upper(match_list."s_char_range")])
+   FROM
+     (SELECT DISTINCT "s",
+                      "t3",
+                      "s_char_range"
+      FROM match_list
+      ORDER BY "s",
+               "t3") match_list
+   ORDER BY "s",
+            "t3") ,
                collocates2 AS
   (SELECT "_token_collocate2"."lemma_id"
    FROM match_list
@@ -0,0 +1,87 @@
+import asyncio
+import time
+import unittest
+
+from unittest.mock import patch
+
+from lcpvian.fcs import _federated_search
+
+
+class FederatedSearchTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.app = {"query_buffers": {}}
+        self.running = 0
+        self.max_running = 0
+        self.started: list[str] = []
+        self.cancelled: list[str] = []
+
+    async def search_corpus(self, app, corpus, data, budget):
+        """
+        Stand-in for _search_corpus: the results of a corpus, after its delay
+        """
+        async with budget:
+            self.started.append(corpus["cid"])
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            try:
+                await asyncio.sleep(data["delay"])
+            except asyncio.CancelledError:
+                self.cancelled.append(corpus["cid"])
+                raise
+            finally:
+                self.running -= 1
+            corpus["rid"] = f"request::{corpus['cid']}"
+            app["query_buffers"][corpus["rid"]] = {"hits": data["hits"]}
+
+    @staticmethod
+    def make_records(payload, corpus, first_position=1, version="2.0"):
+        for n, hit in enumerate(payload.get("hits", []), start=first_position):
+            yield f"{corpus['cid']}:{hit}@{n}"
+
+    async def search(self, delays: list[float], hits: int = 2, **kwargs) -> list:
+        corpora = [
+            ({"cid": f"c{n}"}, {"delay": d, "hits": list(range(hits))})
+            for n, d in enumerate(delays)
+        ]
+        with (
+            patch("lcpvian.fcs._search_corpus", self.search_corpus),
+            patch("lcpvian.fcs._make_records", self.make_records),
+            patch("lcpvian.fcs.FCS_MAX_CONCURRENT", 2),
+        ):
+            return [r async for r in _federated_search(self.app, corpora, **kwargs)]
+
+    async def test_corpus_order(self):
+        """
+        The records follow the order of the corpora, not the order they complete in
+        """
+        records = await self.search([0.06, 0.04, 0.02, 0.0], startRecord=10)
+        self.assertEqual(
+            records,
+            [f"c{c}:{h}@{11 + 2 * c + h}" for c in range(4) for h in range(2)],
+        )
+        self.assertEqual(self.app["query_buffers"], {})
+
+    async def test_concurrency_bound(self):
+        """
+        At most FCS_MAX_CONCURRENT corpora are queried at once
+        """
+        await self.search([0.02] * 5)
+        self.assertEqual(self.max_running, 2)
+        self.assertEqual(self.started, [f"c{n}" for n in range(5)])
+
+    async def test_pending_corpora_cancelled(self):
+        """
+        Once enough records were yielded, the remaining corpora are stopped
+        """
+        start = time.monotonic()
+        records = await self.search([0.0, 0.01, 5.0, 5.0, 5.0], requested=3)
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(records, ["c0:0@1", "c0:1@2", "c1:0@3"])
+        self.assertEqual(self.cancelled, ["c2", "c3"])
+        self.assertNotIn("c4", self.started)
+        self.assertEqual(self.running, 0)
+        self.assertEqual(self.app["query_buffers"], {})
+
+
+if __name__ == "__main__":
+    unittest.main()
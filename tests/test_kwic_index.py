@@ -0,0 +1,75 @@
+import unittest
+
+from lcpvian.kwic_index import KwicIndex, KwicIndexBuilder
+
+# Result set 1 has char ranges at index 2 of its hits, result set 2 has them at
+# index 1 but its context is the segment (widened by 2), result set 3 has none
+LOOKUPS: dict[str, tuple[int | None, bool]] = {
+    "1": (2, False),
+    "2": (1, True),
+    "3": (None, False),
+}
+
+ROWS = [
+    (0, {"result_sets": []}),
+    (1, [10, "x", [0, 5]]),
+    (-1, [10, 0, [["word"]]]),
+    (2, [11, [5, 9]]),
+    (3, [12, "y"]),
+    (1, [10, "z", [6, 8]]),
+    (-2, ["meta"]),
+    (1, [13, "w", None]),
+]
+
+
+class KwicIndexTestCase(unittest.TestCase):
+    def build(self, *chunks) -> KwicIndex:
+        builder = KwicIndexBuilder(LOOKUPS)
+        for chunk in chunks:
+            builder.add(chunk)
+        return builder.finish()
+
+    def test_positions(self):
+        """
+        Only kwic lines are indexed, at their position among all the rows
+        """
+        index = self.build(ROWS)
+        self.assertEqual(len(index), 5)
+        self.assertEqual(index.rows(), [1, 3, 4, 5, 7])
+        self.assertEqual(index.rows(1, 3), [3, 4])
+        self.assertEqual(index.count_segments(), 4)
+        self.assertEqual(index.count_segments(0, 4), 3)
+
+    def test_chunks(self):
+        """
+        Positions continue across the chunks given to the builder
+        """
+        chunked = self.build(ROWS[:3], ROWS[3:6], ROWS[6:])
+        self.assertEqual(chunked.rows(), self.build(ROWS).rows())
+        self.assertEqual(chunked.segment_ids(), self.build(ROWS).segment_ids())
+
+    def test_segment_ids(self):
+        """
+        Segment ids map to the (widened) char range of their line, or 1 without one
+        """
+        index = self.build(ROWS)
+        self.assertEqual(
+            index.segment_ids(),
+            {"10": [6, 8], "11": [3, 11], "12": 1, "13": 1},
+        )
+        self.assertEqual(index.segment_ids(1, 3), {"11": [3, 11], "12": 1})
+
+    def test_bytes_round_trip(self):
+        """
+        An index is stored as bytes and loaded back unchanged
+        """
+        index = self.build(ROWS)
+        loaded = KwicIndex.from_bytes(index.to_bytes())
+        self.assertEqual(loaded.rows(), index.rows())
+        self.assertEqual(loaded.segment_ids(), index.segment_ids())
+        empty = KwicIndex.from_bytes(self.build().to_bytes())
+        self.assertEqual((len(empty), empty.segment_ids()), (0, {}))
+
+
+if __name__ == "__main__":
+    unittest.main()
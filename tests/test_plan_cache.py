@@ -0,0 +1,123 @@
+import glob
+import json
+import os
+import unittest
+
+from unittest.mock import patch
+
+from lcpvian.abstract_query.create import _compile, json_to_sql
+from lcpvian.abstract_query.plan_cache import (
+    PLAN_CACHE,
+    dump_plan,
+    load_plan,
+    plan_key,
+    split_batch,
+)
+from lcpvian.dqd_parser import convert as dqd_to_json
+from lcpvian.utils import _determine_language
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), "test_data")
+
+
+def typed(value):
+    """
+    Comparable form of value that tells tuples from lists and 1 from "1"
+    """
+    if isinstance(value, dict):
+        return {repr(k): typed(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, [typed(v) for v in value])
+    return repr(value)
+
+
+def reverse_keys(value):
+    """
+    Copy of value with the keys of all its dicts in reverse order
+    """
+    if isinstance(value, dict):
+        return {k: reverse_keys(value[k]) for k in reversed(value)}
+    if isinstance(value, list):
+        return [reverse_keys(v) for v in value]
+    return value
+
+
+def data_queries():
+    for dqd_file in sorted(glob.glob(os.path.join(TEST_DATA, "*.dqd"))):
+        base = dqd_file[:-4]
+        if not os.path.exists(base + ".meta"):
+            continue
+        with open(base + ".meta") as mfile:
+            meta = json.load(mfile)
+        with open(dqd_file) as dfile:
+            dqd = dfile.read().strip() + "\n"
+        yield base, dqd_to_json(dqd, meta), meta
+
+
+class PlanCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        PLAN_CACHE.clear()
+
+    def test_plan_key_ignores_key_order(self):
+        """
+        Dicts with the same items give the same key
+        """
+        self.assertEqual(
+            plan_key({"a": 1, "b": [1, 2]}, "token"),
+            plan_key({"b": [1, 2], "a": 1}, "token"),
+        )
+        self.assertNotEqual(plan_key({"a": 1}, "token1"), plan_key({"a": 1}, "token2"))
+
+    def test_query_key_order(self):
+        """
+        The same query with its keys in another order gets the cached plan
+        """
+        base, json_query, meta = next(data_queries())
+        lang = _determine_language(meta["batch"]) or ""
+        args = (meta["schema"], meta["batch"], meta, lang)
+        first = json_to_sql(json.loads(json.dumps(json_query)), *args)
+        reordered = reverse_keys(json.loads(json.dumps(json_query)))
+        self.assertNotEqual(json.dumps(reordered), json.dumps(json_query))
+        with patch("lcpvian.abstract_query.create._compile") as compile:
+            cached = json_to_sql(reordered, *args)
+        compile.assert_not_called()
+        self.assertEqual(typed(cached), typed(first))
+
+    def test_round_trip_types(self):
+        """
+        Loading a dumped plan gives back tuples, non-string keys and tag-like keys
+        """
+        meta_json = {
+            "result_sets": [{"attributes": ("form", "lemma"), "type": "plain"}],
+            "positions": {1: (0, 2), "1": [0, 2]},
+            "__tuple__": [1],
+        }
+        post_processes = {2: [{"comparison": ("frequency", ">", 3)}]}
+        script, meta, post = load_plan(dump_plan("SELECT 1", meta_json, post_processes))
+        self.assertEqual(script, "SELECT 1")
+        self.assertEqual(typed(meta), typed(meta_json))
+        self.assertEqual(typed(post), typed(post_processes))
+
+    def test_cached_plans_match_fresh_ones(self):
+        """
+        Cached plans (and plans filled from a template) are the same as compiled ones
+        """
+        for base, json_query, meta in data_queries():
+            lang = _determine_language(meta["batch"]) or ""
+            split = split_batch(meta["batch"])
+            batches = [meta["batch"]]
+            if split:
+                batches += [f"{split[0]}1", f"{split[0]}2", f"{split[0]}3"]
+            for batch in batches:
+                # json_to_sql may modify the query: each call gets a copy
+                query = json.dumps(json_query)
+                schema = meta["schema"]
+                fresh = _compile(json.loads(query), schema, batch, meta, lang, None)
+                first = json_to_sql(json.loads(query), schema, batch, meta, lang)
+                cached = json_to_sql(json.loads(query), schema, batch, meta, lang)
+                with self.subTest(query=base, batch=batch):
+                    self.assertEqual(typed(first), typed(fresh))
+                    self.assertEqual(typed(cached), typed(fresh))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,497 @@
+import asyncio
+import json
+import random
+import re
+import unittest
+
+from contextlib import aclosing
+from unittest.mock import patch
+
+from asyncpg.exceptions import QueryCanceledError
+from fakeredis import FakeStrictRedis
+from rq.job import JobStatus
+
+from lcpvian.abstract_query.create import json_to_sql
+from lcpvian.cursor import Cursor
+from lcpvian.query import do_batch
+from lcpvian.query_classes import (
+    SYNC_STREAM_BUFFER,
+    QueryInfo,
+    Request,
+    _qi_job_failure,
+    _request_waiters,
+    stream_request,
+    wait_for_request,
+)
+from lcpvian.redis_proxies import SnapshotConflict
+from lcpvian.utils import _determine_language
+
+from .test_plan_cache import data_queries
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeStrictRedis()
+        self.qi = QueryInfo("abc", self.redis, config={"batches": {}})
+        self.request = Request(
+            self.redis, {"synchronous": True, "offset": 0, "requested": 10}
+        )
+        self.qi.add_request(self.request)
+
+    def test_writes_are_flushed(self):
+        """
+        Writes made within a snapshot reach redis when it is closed, or before a
+        job is enqueued
+        """
+        with self.qi.snapshot():
+            self.qi.running_batch = "b1"
+            self.assertEqual(QueryInfo("abc", self.redis).running_batch, "")
+            self.qi.enqueue(do_batch, self.qi.hash, ["b1", 100])
+            self.assertEqual(QueryInfo("abc", self.redis).running_batch, "b1")
+            self.qi.running_batch = "b2"
+        self.assertEqual(QueryInfo("abc", self.redis).running_batch, "b2")
+
+    def test_snapshot_keeps_worker_updates(self):
+        """
+        Closing a snapshot does not overwrite what a worker wrote in the meantime
+        """
+        with self.assertRaises(SnapshotConflict):
+            with self.qi.snapshot():
+                self.assertEqual(self.qi.running_batch, "")
+                worker_qi = QueryInfo("abc", self.redis)
+                worker_qi.done_batches["b1"] = 100
+                worker_qi.running_batch = "b2"
+                self.qi.running_batch = "b1"
+                self.qi.done_batches["b0"] = 50
+        self.assertEqual(self.qi.running_batch, "b2")
+        self.assertEqual(self.qi.done_batches.to_dict(), {"b1": 100})
+
+    def test_other_fields_written_meanwhile(self):
+        """
+        A worker writing other fields of the QueryInfo is no conflict
+        """
+        with self.qi.snapshot():
+            QueryInfo("abc", self.redis).running_batch = "b2"
+            self.qi.done_batches["b1"] = 100
+        self.assertEqual(self.qi.running_batch, "b2")
+        self.assertEqual(self.qi.done_batches.to_dict(), {"b1": 100})
+
+    def test_snapshot_discarded_on_error(self):
+        """
+        The changes of a snapshot whose body raised are not written
+        """
+        with self.assertRaises(ValueError):
+            with self.qi.snapshot():
+                self.qi.running_batch = "b1"
+                QueryInfo("abc", self.redis).running_batch = "b2"
+                raise ValueError("Could not schedule")
+        self.assertEqual(self.qi.running_batch, "b2")
+
+    def test_request_through_snapshot(self):
+        """
+        A request created outside the snapshot agrees with the requests of the QueryInfo
+        """
+        with self.qi.snapshot(), self.request.through(self.qi):
+            self.request.lines_batch["b1"] = [0, 10, 3]
+            (snapshot_request,) = self.qi.requests
+            self.assertEqual(snapshot_request.lines_sent_so_far, 10)
+        self.assertEqual(
+            Request(self.redis, {"id": self.request.id}).lines_sent_so_far, 10
+        )
+
+
+class StreamingTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.redis = FakeStrictRedis()
+        meta_json = {"result_sets": [{"type": "plain"}, {"type": "analysis"}]}
+        config = {"firstClass": {"segment": "Segment"}}
+        self.qi = QueryInfo("abc", self.redis, meta_json=meta_json, config=config)
+        request = Request(self.redis, {"offset": 0, "requested": 3})
+        self.qi.add_request(request)
+
+    async def test_stream_into_cache(self):
+        """
+        Chunks go to <hash>::streaming, the batch is published once it has the
+        required lines and the entry is renamed to the hash when the query completes
+        """
+        chunks = [
+            [(1, ["a"]), (2, ["x"]), (1, ["b"])],
+            [(1, ["c"]), (1, ["d"])],
+            [(2, ["y"]), (1, ["e"])],
+        ]
+        seen: list[tuple[list, list]] = []
+
+        async def db_query(script, params={}, on_chunk=None, chunk_size=0):
+            for chunk in chunks:
+                await on_chunk(chunk)
+                seen.append(
+                    (
+                        self.qi.get_from_cache("batch_hash"),
+                        [str(b) for b in self.qi.query_batches],
+                    )
+                )
+
+        with (
+            patch("lcpvian.query_classes._db_query", db_query),
+            patch.object(QueryInfo, "publish") as publish,
+        ):
+            counts = await self.qi.query_stream("batch_hash", "SELECT", "b1")
+
+        self.assertEqual(counts, {"1": 5})
+        # readers get the chunks received so far while the query runs
+        self.assertEqual(len(seen[0][0]), 3)
+        self.assertEqual(len(seen[1][0]), 5)
+        # published after the second chunk, which reached the 3 required lines
+        self.assertEqual([b for _, b in seen], [[], ["b1"], ["b1"]])
+        publish.assert_called_once_with("b1", "main")
+        self.assertFalse(self.redis.exists("batch_hash::streaming"))
+        self.assertEqual(
+            self.qi.get_from_cache("batch_hash"), [list(r) for c in chunks for r in c]
+        )
+
+    async def test_empty_stream(self):
+        """
+        A query without results still leaves a complete (empty) entry
+        """
+
+        async def db_query(script, params={}, on_chunk=None, chunk_size=0):
+            return None
+
+        with patch("lcpvian.query_classes._db_query", db_query):
+            counts = await self.qi.query_stream("batch_hash", "SELECT", "b1")
+        self.assertEqual(counts, {"1": 0})
+        self.assertEqual(self.qi.get_from_cache("batch_hash"), [])
+
+
+class RowBudgetTestCase(unittest.IsolatedAsyncioTestCase):
+    # kwic lines [segment id, [token ids]] of one batch, in segment/token order
+    HITS = [[1, [seg, [seg * 10 + tok]]] for seg in range(1, 7) for tok in (1, 2)]
+
+    def setUp(self):
+        self.redis = FakeStrictRedis()
+        self.qi = self.query_info()
+        self.runs = 0
+
+    def query_info(self) -> QueryInfo:
+        meta_json = {"result_sets": [{"type": "plain", "attributes": []}]}
+        config = {"firstClass": {"segment": "Segment"}, "_batches": {"b1": 1000}}
+        return QueryInfo(
+            "abc", self.redis, json_query={}, meta_json=meta_json, config=config
+        )
+
+    async def query(self, qi, qhash, script, params={}):
+        """
+        The lines in any order unless the SQL orders them, limited as it says
+        """
+        self.runs += 1
+        script = " ".join(script.split())
+        rows = [list(h) for h in self.HITS]
+        if not re.search(r"\) match_list ORDER BY", script):
+            random.Random(self.runs).shuffle(rows)
+        if limit := re.search(r"ORDER BY [^()]* LIMIT (\d+)", script):
+            rows = rows[: int(limit.group(1))]
+        qi.set_cache(qhash, rows)
+        return rows
+
+    def patched(self):
+        """
+        Compile the SQL of a test query with the budget of the run
+        """
+        base, json_query, meta = next(data_queries())
+        lang = _determine_language(meta["batch"]) or ""
+
+        def compile(query_json, batch="", row_budget=None, **kwargs):
+            return json_to_sql(
+                json.loads(json.dumps(json_query)),
+                meta["schema"],
+                meta["batch"],
+                meta,
+                lang,
+                row_budget=row_budget,
+            )
+
+        async def query(qi, qhash, script, params={}):
+            return await self.query(qi, qhash, script, params)
+
+        return (
+            patch("lcpvian.query_classes.json_to_sql", compile),
+            patch.object(QueryInfo, "query", query),
+        )
+
+    def page(self, offset: int, requested: int, qi: QueryInfo | None = None) -> list:
+        qi = qi or self.qi
+        batch_hash, _ = qi.query_batches["b1"]
+        return qi.rows_from_cache(batch_hash, ["1"], offset, offset + requested)
+
+    async def test_pages_over_rerun_batch(self):
+        """
+        Pages over a truncated batch, then over its re-run, have no duplicates or gaps
+        """
+        patch_sql, patch_query = self.patched()
+        with patch_sql, patch_query:
+            self.qi.add_request(Request(self.redis, {"offset": 0, "requested": 4}))
+            await self.qi.run_query_on_batch(["b1", 1000])
+            self.assertIn("b1", self.qi.truncated_batches)
+            self.assertEqual(self.qi.query_batches["b1"][1], 4)
+            first_page = self.page(0, 4)
+
+            self.qi.add_request(Request(self.redis, {"offset": 4, "requested": 4}))
+            self.assertTrue(self.qi.needs_rerun("b1"))
+            await self.qi.run_query_on_batch(["b1", 1000], budgeted=False)
+            self.assertNotIn("b1", self.qi.truncated_batches)
+            self.assertEqual(self.qi.query_batches["b1"][1], len(self.HITS))
+            second_page = self.page(4, 4)
+
+        self.assertEqual(first_page + second_page, self.HITS[:8])
+
+    async def test_resume_cursor_over_rerun_batch(self):
+        """
+        A cursor resumed once its batch left the cache continues where it stopped,
+        even if the batch runs again without a budget
+        """
+        patch_sql, patch_query = self.patched()
+        with patch_sql, patch_query:
+            self.qi.add_request(Request(self.redis, {"offset": 0, "requested": 4}))
+            await self.qi.run_query_on_batch(["b1", 1000])
+            first_page = self.page(0, 4)
+            token = Cursor.at(self.qi, 4).encode()
+
+            self.redis.flushall()
+            qi = self.query_info()
+            offset = Cursor.decode(token).resume(qi)
+            self.assertEqual(offset, 4)
+            qi.add_request(Request(self.redis, {"offset": offset, "requested": 4}))
+            with patch("lcpvian.query_classes.KWIC_ROW_BUDGET", False):
+                await qi.run_query_on_batch(["b1", 1000])
+            second_page = self.page(offset, 4, qi)
+
+        self.assertEqual(first_page + second_page, self.HITS[:8])
+
+    async def test_truncated_batches_out_of_hit_rate(self):
+        """
+        The hit rate (and so the projections) leave out the truncated batches
+        """
+        patch_sql, patch_query = self.patched()
+        with patch_sql, patch_query:
+            self.qi.add_request(Request(self.redis, {"offset": 0, "requested": 4}))
+            await self.qi.run_query_on_batch(["b1", 1000])
+            # only truncated batches: their lines are a lower bound
+            self.assertEqual(self.qi.hit_rate(), 4 / 1000)
+            self.qi.add_request(Request(self.redis, {"offset": 0, "requested": 100}))
+            await self.qi.run_query_on_batch(["b2", 4000])
+        self.assertNotIn("b2", self.qi.truncated_batches)
+        self.assertEqual(self.qi.hit_rate(), len(self.HITS) / 4000)
+
+
+class SpeculativeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeStrictRedis()
+        self.qi = QueryInfo("abc", self.redis, config={})
+        self.qi.add_request(Request(self.redis, {"offset": 0, "requested": 10}))
+        for name in ("b1", "b2", "b3"):
+            self.qi.speculative_batches[name] = 1
+
+    def test_commit_in_scheduling_order(self):
+        """
+        Completed batches are committed only once the batches scheduled before them are
+        """
+        self.qi.pending_batches["b2"] = ["h2", 5, 200]
+        self.assertEqual(self.qi.commit_speculative(), [])
+        self.assertNotIn("b2", self.qi.query_batches)
+
+        self.qi.pending_batches["b1"] = ["h1", 3, 100]
+        self.assertEqual(self.qi.commit_speculative(), ["b1", "b2"])
+        self.assertEqual(list(self.qi.query_batches), ["b1", "b2"])
+        self.assertEqual(self.qi.get_lines_batch("b2"), (3, 5))
+        self.assertEqual(self.qi.done_batches.to_dict(), {"b1": 100, "b2": 200})
+        self.assertEqual(list(self.qi.speculative_batches), ["b3"])
+        self.assertEqual(list(self.qi.pending_batches), [])
+
+    def test_cancel(self):
+        """
+        Cancelling stops the jobs of the speculative batches and forgets them
+        """
+        jobs = {
+            name: self.qi.enqueue(do_batch, self.qi.hash, [name, 100])
+            for name in ("b0", "b2", "b3")
+        }
+        self.qi.speculative_batches.pop("b1")
+        self.qi.pending_batches["b3"] = ["h3", 5, 100]
+        self.qi.cancel_speculative()
+        self.assertEqual(jobs["b0"].get_status(), JobStatus.QUEUED)
+        self.assertEqual(jobs["b2"].get_status(), JobStatus.CANCELED)
+        self.assertEqual(jobs["b3"].get_status(), JobStatus.CANCELED)
+        self.assertEqual(list(self.qi.enqueued_jobs), [jobs["b0"].id])
+        self.assertEqual(list(self.qi.speculative_batches), [])
+        self.assertEqual(list(self.qi.pending_batches), [])
+
+    def test_cancelled_batch_failure(self):
+        """
+        The failure of a cancelled speculative batch is not reported to the requests
+        """
+        jobs = {
+            name: self.qi.enqueue(do_batch, self.qi.hash, [name, 100])
+            for name in ("b0", "b2")
+        }
+        self.qi.speculative_batches.pop("b1")
+        self.qi.speculative_batches.pop("b3")
+        self.qi.cancel_speculative()
+        error = QueryCanceledError("canceling statement due to user request")
+        with (
+            patch("lcpvian.query_classes._publish_msg") as publish,
+            patch("lcpvian.callbacks._publish_msg") as publish_failed,
+        ):
+            _qi_job_failure(jobs["b2"], self.redis, QueryCanceledError, error, None)
+            self.assertFalse(publish.called or publish_failed.called)
+            _qi_job_failure(jobs["b0"], self.redis, QueryCanceledError, error, None)
+            self.assertEqual(publish.call_args[0][1]["callback_query"], "failure")
+            self.assertTrue(publish_failed.called)
+
+
+class StreamDisconnectTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.redis = FakeStrictRedis()
+        self.qi = QueryInfo("abc", self.redis, config={})
+        self.request = Request(
+            self.redis, {"synchronous": True, "offset": 0, "requested": 10}
+        )
+        self.qi.add_request(self.request)
+        self.app = {"query_buffers": {}}
+
+    async def produce(self, n: int):
+        await self.request.send_sync(self.app, {}, {"n": n})
+
+    async def test_disconnect_mid_stream(self):
+        """
+        When the client goes away, the request is stopped and the payloads
+        produced for it are dropped
+        """
+        received: list[dict] = []
+
+        async def client():
+            async with aclosing(stream_request(self.qi, self.request)) as payloads:
+                async for payload in payloads:
+                    received.append(payload)
+                    # let the producers add to the stream before writing fails
+                    await asyncio.sleep(0.1)
+                    raise ConnectionResetError("client went away")
+
+        reader = asyncio.ensure_future(client())
+        await asyncio.sleep(0)
+        producers = [asyncio.ensure_future(self.produce(n)) for n in range(3)]
+        with self.assertRaises(ConnectionResetError):
+            await reader
+        await asyncio.wait_for(asyncio.gather(*producers), timeout=1)
+        self.assertEqual(received, [{"n": 0}])
+        self.assertFalse(self.qi.has_request(self.request))
+        # later payloads are not buffered for a request nobody reads
+        await asyncio.wait_for(self.produce(99), timeout=1)
+        self.assertEqual(self.app["query_buffers"], {})
+
+    async def test_slow_client(self):
+        """
+        Producing for a client that does not keep up never waits: its stream
+        ends with a failure and the request is stopped
+        """
+        received: list[dict] = []
+
+        async def client():
+            async with aclosing(stream_request(self.qi, self.request)) as payloads:
+                async for payload in payloads:
+                    received.append(payload)
+                    await asyncio.sleep(0.05)
+
+        reader = asyncio.ensure_future(client())
+        await asyncio.sleep(0)
+        for n in range(SYNC_STREAM_BUFFER + 3):
+            await asyncio.wait_for(self.produce(n), timeout=0.1)
+        await asyncio.wait_for(reader, timeout=1)
+        self.assertLess(len(received), SYNC_STREAM_BUFFER)
+        self.assertEqual(received[-1]["status"], "failed")
+        self.assertFalse(self.qi.has_request(self.request))
+        await asyncio.wait_for(self.produce(99), timeout=1)
+        self.assertEqual(self.app["query_buffers"], {})
+
+
+class ApproximateBoundsTestCase(unittest.IsolatedAsyncioTestCase):
+    BOUNDS = {"2": {"top": 2, "max_error": 5}}
+
+    def setUp(self):
+        self.redis = FakeStrictRedis()
+        config = {"firstClass": {"segment": "Segment"}, "_batches": {"b1": 1000}}
+        self.qi = QueryInfo("abc", self.redis, config=config)
+        self.qi.query_batches["b1"] = ["h1", 10]
+        self.request = Request(
+            self.redis, {"synchronous": True, "offset": 0, "requested": 10}
+        )
+        self.qi.add_request(self.request)
+        self.app = {"query_buffers": {self.request.id: {}}}
+
+    async def test_batch_update(self):
+        """
+        The bounds of a streamed batch go with the metadata in result "0", like
+        those of any other batch
+        """
+        with (
+            patch.object(self.qi.stats, "bounds", return_value=self.BOUNDS),
+            patch.object(self.qi, "stats_results", return_value={"2": [["a", 3]]}),
+        ):
+            await self.request.send_batch_update(self.app, self.qi, "b1")
+        buffer = self.app["query_buffers"][self.request.id]
+        self.assertEqual(buffer["0"], {"approximate": self.BOUNDS})
+        self.assertEqual(buffer["2"], [["a", 3]])
+
+
+class WaitForRequestTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.redis = FakeStrictRedis()
+        self.qi = QueryInfo("abc", self.redis, config={})
+        self.request = Request(
+            self.redis, {"synchronous": True, "offset": 0, "requested": 10}
+        )
+        self.qi.add_request(self.request)
+
+    async def test_completed(self):
+        """
+        The wait ends as soon as the request is deleted, without polling redis
+        """
+        with patch("lcpvian.query_classes.SYNC_REQUEST_RECHECK", 60.0):
+            waiter = asyncio.ensure_future(wait_for_request(self.qi, self.request))
+            await asyncio.sleep(0.01)
+            self.assertIn(self.request.id, _request_waiters)
+            self.qi.delete_request(self.request)
+            self.assertTrue(await asyncio.wait_for(waiter, timeout=1))
+        self.assertNotIn(self.request.id, _request_waiters)
+        # a request that completed before the wait returns right away
+        self.assertTrue(await wait_for_request(self.qi, self.request, timeout=1))
+
+    async def test_timeout(self):
+        """
+        A request that does not complete in time is stopped
+        """
+        with (
+            patch("lcpvian.query_classes.SYNC_REQUEST_RECHECK", 0.01),
+            patch.object(self.qi, "stop_request") as stop_request,
+        ):
+            done = await wait_for_request(self.qi, self.request, timeout=0.05)
+        self.assertFalse(done)
+        stop_request.assert_called_once_with(self.request)
+        self.assertNotIn(self.request.id, _request_waiters)
+
+    async def test_cancelled(self):
+        """
+        A request whose wait is cancelled, e.g. when the client left, is stopped
+        """
+        with patch.object(self.qi, "stop_request") as stop_request:
+            waiter = asyncio.ensure_future(wait_for_request(self.qi, self.request))
+            await asyncio.sleep(0.01)
+            stop_request.assert_not_called()
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+        stop_request.assert_called_once_with(self.request)
+        self.assertNotIn(self.request.id, _request_waiters)
+
+
+if __name__ == "__main__":
+    unittest.main()
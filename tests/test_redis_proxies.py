@@ -0,0 +1,224 @@
+import unittest
+
+from fakeredis import FakeStrictRedis
+
+from lcpvian.redis_proxies import (
+    RedisDict,
+    RedisList,
+    SNAPSHOT_RETRIES,
+    RedisSnapshot,
+    SnapshotConflict,
+    retry_on_conflict,
+)
+
+
+class RedisSnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeStrictRedis()
+        live = RedisDict(self.redis, "query_info::abc")
+        live["status"] = "started"
+        live["requests"] = ["request::1"]
+        live["query_batches"] = {"b1": ["h1", 10]}
+        live["done_batches"] = {"b1": 100}
+
+    def test_load_reads_nested_proxies(self):
+        """
+        A loaded snapshot reads the whole tree without calling redis
+        """
+        snapshot = RedisSnapshot(self.redis).load("query_info::abc")
+        self.redis.flushall()
+        qi = RedisDict(snapshot, "query_info::abc")
+        self.assertEqual(qi["status"], "started")
+        self.assertEqual(qi["requests"].to_list(), ["request::1"])
+        self.assertEqual(qi["query_batches"].to_dict(), {"b1": ["h1", 10]})
+
+    def test_writes_are_flushed(self):
+        """
+        Writes through the snapshot are read back locally and reach redis on flush
+        """
+        snapshot = RedisSnapshot(self.redis).load("query_info::abc")
+        qi = RedisDict(snapshot, "query_info::abc")
+        qi["running_batch"] = "b2"
+        qi["query_batches"]["b2"] = ["h2", 5]
+        qi["requests"].append("request::2")
+        self.assertEqual(qi["running_batch"], "b2")
+        self.assertEqual(qi["requests"].to_list(), ["request::1", "request::2"])
+        live = RedisDict(self.redis, "query_info::abc")
+        self.assertIsNone(live["running_batch"])
+        snapshot.flush()
+        self.assertEqual(live["running_batch"], "b2")
+        self.assertEqual(live["query_batches"]["b2"].to_list(), ["h2", 5])
+        self.assertEqual(live["requests"].to_list(), ["request::1", "request::2"])
+
+    def test_concurrent_writes_are_not_overwritten(self):
+        """
+        The snapshot does not write back stale values over writes made in the meantime
+        """
+        snapshot = RedisSnapshot(self.redis).load("query_info::abc")
+        qi = RedisDict(snapshot, "query_info::abc")
+        # a worker records a new batch and completes the query meanwhile
+        worker = RedisDict(self.redis, "query_info::abc")
+        worker["query_batches"]["b2"] = ["h2", 5]
+        worker["status"] = "complete"
+        # the snapshot still reads the values as of its load
+        self.assertEqual(qi["status"], "started")
+        self.assertNotIn("b2", qi["query_batches"])
+        qi["done_batches"]["b3"] = 50
+        qi["status"] = "failed"
+        with self.assertRaises(SnapshotConflict) as conflict:
+            snapshot.flush()
+        self.assertEqual(conflict.exception.keys, ["query_info::abc"])
+        live = RedisDict(self.redis, "query_info::abc")
+        self.assertEqual(live["status"], "complete")
+        self.assertEqual(
+            live["query_batches"].to_dict(), {"b1": ["h1", 10], "b2": ["h2", 5]}
+        )
+        self.assertEqual(live["done_batches"].to_dict(), {"b1": 100})
+
+    def test_writes_to_other_keys(self):
+        """
+        Concurrent writes to keys that the snapshot does not write are no conflict
+        """
+        snapshot = RedisSnapshot(self.redis).load("query_info::abc")
+        qi = RedisDict(snapshot, "query_info::abc")
+        RedisDict(self.redis, "query_info::abc")["query_batches"]["b2"] = ["h2", 5]
+        qi["done_batches"]["b2"] = 50
+        snapshot.flush()
+        live = RedisDict(self.redis, "query_info::abc")
+        self.assertEqual(live["done_batches"].to_dict(), {"b1": 100, "b2": 50})
+        self.assertIn("b2", live["query_batches"])
+
+    def test_writes_to_other_fields(self):
+        """
+        Concurrent writes to other fields of a hash that the snapshot writes are
+        no conflict, unlike writes to the same fields
+        """
+        snapshot = RedisSnapshot(self.redis).load("query_info::abc")
+        qi = RedisDict(snapshot, "query_info::abc")
+        RedisDict(self.redis, "query_info::abc")["running_batch"] = "b2"
+        qi["status"] = "complete"
+        qi["done_batches"]["b2"] = 50
+        snapshot.flush()
+        live = RedisDict(self.redis, "query_info::abc")
+        self.assertEqual(live["running_batch"], "b2")
+        self.assertEqual(live["status"], "complete")
+        qi["running_batch"] = "b3"
+        live["running_batch"] = "b4"
+        with self.assertRaises(SnapshotConflict):
+            snapshot.flush()
+        self.assertEqual(live["running_batch"], "b4")
+
+    def test_delete_after_concurrent_write(self):
+        """
+        A key that was written since the load is not deleted by the snapshot
+        """
+        snapshot = RedisSnapshot(self.redis).load("query_info::abc")
+        qi = RedisDict(snapshot, "query_info::abc")
+        qi["done_batches"]["b2"] = 20
+        RedisDict(self.redis, "query_info::abc")["done_batches"]["b3"] = 30
+        del qi["done_batches"]
+        with self.assertRaises(SnapshotConflict):
+            snapshot.flush()
+        live = RedisDict(self.redis, "query_info::abc")
+        self.assertEqual(live["done_batches"].to_dict(), {"b1": 100, "b3": 30})
+
+    def test_retry_on_conflict(self):
+        """
+        A function whose snapshot conflicts runs again on the values now in redis
+        """
+        calls: list[str] = []
+
+        @retry_on_conflict
+        def fail(status: str) -> None:
+            snapshot = RedisSnapshot(self.redis).load("query_info::abc")
+            qi = RedisDict(snapshot, "query_info::abc")
+            calls.append(qi["status"])
+            if len(calls) == 1:
+                RedisDict(self.redis, "query_info::abc")["status"] = "complete"
+            if qi["status"] != "complete":
+                qi["status"] = status
+            snapshot.flush()
+
+        fail("failed")
+        self.assertEqual(calls, ["started", "complete"])
+        self.assertEqual(RedisDict(self.redis, "query_info::abc")["status"], "complete")
+
+    def test_retries_exhausted(self):
+        """
+        Once the retries are exhausted, the last run writes its changes anyway
+        """
+        calls: list[str] = []
+
+        @retry_on_conflict
+        def conflict() -> None:
+            snapshot = RedisSnapshot(self.redis).load("query_info::abc")
+            qi = RedisDict(snapshot, "query_info::abc")
+            qi["status"] = f"run{len(calls)}"
+            calls.append(qi["status"])
+            worker = RedisDict(self.redis, "query_info::abc")
+            worker["status"] = f"worker{len(calls)}"
+            snapshot.flush()
+
+        conflict()
+        self.assertEqual(len(calls), SNAPSHOT_RETRIES + 1)
+        status = RedisDict(self.redis, "query_info::abc")["status"]
+        self.assertEqual(status, calls[-1])
+        # the next snapshots check for conflicts again
+        snapshot = RedisSnapshot(self.redis).load("query_info::abc")
+        RedisDict(snapshot, "query_info::abc")["status"] = "failed"
+        RedisDict(self.redis, "query_info::abc")["status"] = "complete"
+        with self.assertRaises(SnapshotConflict):
+            snapshot.flush()
+
+    def test_delete(self):
+        """
+        Deleting a nested proxy through the snapshot removes its keys from redis
+        """
+        snapshot = RedisSnapshot(self.redis).load("query_info::abc")
+        qi = RedisDict(snapshot, "query_info::abc")
+        nested_key = qi["query_batches"]._redis_key
+        del qi["query_batches"]
+        self.assertIsNone(qi["query_batches"])
+        snapshot.flush()
+        self.assertNotIn("query_batches", RedisDict(self.redis, "query_info::abc"))
+        self.assertFalse(self.redis.exists(nested_key, f"{nested_key}::pointers"))
+
+    def test_unloaded_keys(self):
+        """
+        Keys that were not loaded are fetched on first access
+        """
+        RedisList(self.redis, "other").append("x")
+        snapshot = RedisSnapshot(self.redis).load("query_info::abc")
+        self.assertEqual(RedisList(snapshot, "other").to_list(), ["x"])
+
+
+class RedisDictTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeStrictRedis()
+        self.qi = RedisDict(self.redis, "query_info::abc")
+        self.qi["truncated_batches"] = {"b1": 25, "b2": 10}
+        self.qi["query_batches"] = {"b1": ["h1", 10]}
+
+    def test_pop(self):
+        """
+        Popping a key removes it from redis and returns its value
+        """
+        truncated = self.qi["truncated_batches"]
+        self.assertEqual(truncated.pop("b1"), 25)
+        self.assertEqual(truncated.pop("b1", None), None)
+        self.assertEqual(self.qi["truncated_batches"].to_dict(), {"b2": 10})
+        with self.assertRaises(KeyError):
+            truncated.pop("b1")
+
+    def test_pop_nested(self):
+        """
+        Nested values are returned as plain copies and deleted from redis
+        """
+        nested_key = self.qi["query_batches"]._redis_key
+        self.assertEqual(self.qi.pop("query_batches"), {"b1": ["h1", 10]})
+        self.assertNotIn("query_batches", self.qi)
+        self.assertFalse(self.redis.exists(nested_key))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+from lcpvian.result_cache import decode_results, encode_results, slice_results
+
+ROWS = [
+    [0, [5]],
+    [1, [10, [1, 2]]],
+    [2, ["NOUN", 3]],
+    [1, [11, [4, 5]]],
+    [1, [12, [6, 7]]],
+    [2, ["VERB", 1]],
+]
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        """
+        Both codecs give back the rows they encoded
+        """
+        for codec in ("json", "arrow"):
+            with self.subTest(codec=codec):
+                self.assertEqual(decode_results(encode_results(ROWS, codec)), ROWS)
+
+    def test_not_rows_stored_as_json(self):
+        """
+        Anything that is not a list of [rtype, row] pairs is stored as JSON
+        """
+        data = {"result_sets": [], "total": 3}
+        raw = encode_results(data, "arrow")
+        self.assertEqual(raw, encode_results(data, "json"))
+        self.assertEqual(decode_results(raw), data)
+
+    def test_detect_format(self):
+        """
+        Entries are readable whatever the configured codec, also as str
+        """
+        raw = encode_results(ROWS, "json")
+        self.assertEqual(decode_results(raw.decode("utf-8")), ROWS)
+        self.assertEqual(decode_results(encode_results(ROWS, "arrow")), ROWS)
+
+    def test_slice(self):
+        """
+        Slices by rtype or by position are the same for both codecs
+        """
+        for codec in ("json", "arrow"):
+            raw = encode_results(ROWS, codec)
+            with self.subTest(codec=codec):
+                self.assertEqual(slice_results(raw, [1], 1, 3), ROWS[3:5])
+                self.assertEqual(slice_results(raw, [1, 2], 0, 2), ROWS[1:3])
+                self.assertEqual(slice_results(raw, None, 4), ROWS[4:])
+                self.assertEqual(
+                    slice_results(raw, positions=[0, 5, 9]), [ROWS[0], ROWS[5]]
+                )
+                self.assertEqual(slice_results(raw, [3]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+class ChunksTestCase(unittest.TestCase):
+    def test_chunks(self):
+        """
+        Streamed entries (lists of chunks) read like one entry, whatever their codecs
+        """
+        for codecs in (("json", "json"), ("arrow", "arrow"), ("arrow", "json")):
+            chunks = [
+                encode_results(ROWS[:2], codecs[0]),
+                encode_results(ROWS[2:], codecs[1]),
+            ]
+            with self.subTest(codecs=codecs):
+                self.assertEqual(decode_results(chunks), ROWS)
+                self.assertEqual(slice_results(chunks, [1], 1, 3), ROWS[3:5])
+                self.assertEqual(slice_results(chunks, positions=[1, 2]), ROWS[1:3])
+
+    def test_single_chunk(self):
+        """
+        A list with one chunk reads like the chunk itself
+        """
+        raw = encode_results(ROWS, "arrow")
+        self.assertEqual(decode_results([raw]), decode_results(raw))
+        self.assertEqual(slice_results([raw], [2]), slice_results(raw, [2]))
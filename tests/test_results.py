@@ -0,0 +1,77 @@
+import json
+import re
+import unittest
+
+from lcpvian.abstract_query.create import json_to_sql
+from lcpvian.abstract_query.plan_cache import PLAN_CACHE
+from lcpvian.utils import _determine_language
+
+from .test_plan_cache import data_queries
+
+
+class RowBudgetTestCase(unittest.TestCase):
+    def setUp(self):
+        PLAN_CACHE.clear()
+
+    def test_lines_are_ordered(self):
+        """
+        The plain result sets are ordered by their columns with or without a budget,
+        and a budget only adds a limit after the order
+        """
+        for base, json_query, meta in data_queries():
+            lang = _determine_language(meta["batch"]) or ""
+            query = json.dumps(json_query)
+            sqls = {
+                budget: json_to_sql(
+                    json.loads(query),
+                    meta["schema"],
+                    meta["batch"],
+                    meta,
+                    lang,
+                    row_budget=budget,
+                )[0]
+                for budget in (None, 0, 25)
+            }
+            sqls = {k: " ".join(v.split()) for k, v in sqls.items()}
+            meta_json = json_to_sql(
+                json.loads(query), meta["schema"], meta["batch"], meta, lang
+            )[1]
+            n_plain = sum(
+                1
+                for rs in meta_json.get("result_sets", [])
+                if rs.get("type") == "plain"
+            )
+            # the lines are built from the ordered (and limited) columns
+            ordered = re.compile(
+                r"jsonb_build_array\([^()]*jsonb_build_array\([^()]*\).*?\) FROM "
+                r"\(SELECT DISTINCT ([^()]*) FROM match_list ORDER BY ([^()]*?)"
+                r"( LIMIT \d+)?\) match_list ORDER BY ([^()]*)\)"
+            )
+            with self.subTest(query=base):
+                self.assertEqual(sqls[0], sqls[None])
+                matches = ordered.findall(sqls[None])
+                self.assertEqual(len(matches), n_plain)
+                for columns, order, limit, outer_order in matches:
+                    self.assertEqual(limit, "")
+                    self.assertEqual(order, outer_order)
+                    self.assertTrue(columns.startswith(order))
+                self.assertEqual(len(ordered.findall(sqls[25])), n_plain)
+                self.assertEqual(sqls[25].count(" LIMIT 25)"), n_plain)
+                self.assertEqual(sqls[25].replace(" LIMIT 25", ""), sqls[None])
+
+    def test_lines_not_ordered_on_json(self):
+        """
+        The lines are ordered by segment and first token, not on the JSON built from them
+        """
+        base, json_query, meta = next(data_queries())
+        lang = _determine_language(meta["batch"]) or ""
+        sql = json_to_sql(
+            json_query, meta["schema"], meta["batch"], meta, lang, row_budget=25
+        )[0]
+        sql = " ".join(sql.split())
+        self.assertNotIn("ORDER BY 2", sql)
+        self.assertIn('ORDER BY "s", "t1", "t2", "t3" LIMIT 25', sql)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import json
+import os
+import unittest
+
+from unittest.mock import patch
+
+from fakeredis import FakeStrictRedis
+
+from lcpvian import segment_cache
+from lcpvian.segment_cache import SegmentCache, dedupe_rows, rows_by_segment
+
+META = os.path.join(os.path.dirname(__file__), "test_data", "01.meta")
+
+
+def segment_row(sid: int, lower: int, upper: int) -> list:
+    return [-1, [sid, 0, [["word"]], {}, f"[{lower},{upper})"]]
+
+
+class SegmentCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeStrictRedis()
+        with open(META) as mfile:
+            self.config = json.load(mfile)
+
+    def cache(self, context: str | None = None) -> SegmentCache:
+        return SegmentCache(self.redis, self.config, [], context)
+
+    def test_shared_across_batches(self):
+        """
+        Entries do not depend on the batch the segments were fetched for
+        """
+        rows = {"1": [segment_row(1, 0, 10)], "2": [segment_row(2, 10, 20)]}
+        self.cache().set_many(rows)
+        self.assertEqual(self.cache().get_many(["1", "2", "3"]), rows)
+        self.assertEqual(self.cache("Document").get_many(["1", "2"]), {})
+
+    def test_evict_least_recently_used(self):
+        """
+        Beyond the byte budget, the least recently used entries are evicted
+        """
+        cache = self.cache()
+        cache.set_many({"1": [segment_row(1, 0, 10)]})
+        cache.set_many({"2": [segment_row(2, 10, 20)]})
+        cache.get_many(["1"])
+        size = int(self.redis.get(cache.total_key))
+        with patch.object(segment_cache, "SEGMENT_CACHE_MAX_BYTES", size):
+            cache.set_many({"3": [segment_row(3, 20, 30)]})
+        self.assertEqual(sorted(cache.get_many(["1", "2", "3"])), ["1", "3"])
+        self.assertEqual(self.redis.zcard(cache.lru_key), 2)
+        self.assertLessEqual(int(self.redis.get(cache.total_key)), size)
+
+    def test_forget_expired(self):
+        """
+        Entries that expired on their own are removed from the bookkeeping
+        """
+        cache = self.cache()
+        cache.set_many({"1": [segment_row(1, 0, 10)]})
+        self.redis.delete(cache.key("1"))
+        self.assertEqual(cache.get_many(["1"]), {})
+        self.assertEqual(self.redis.zcard(cache.lru_key), 0)
+        self.assertEqual(int(self.redis.get(cache.total_key)), 0)
+
+    def test_rows_by_segment(self):
+        """
+        Rows go to the segment ids whose char range overlaps theirs
+        """
+        rows = [segment_row(1, 0, 10), segment_row(2, 10, 20), [-2, ["meta"]]]
+        by_segment = rows_by_segment(rows, {"1": [0, 12], "2": [15, 30], "3": 1})
+        self.assertEqual(by_segment, {"1": rows[:2], "2": [rows[1]]})
+        shared = by_segment["1"] + by_segment["2"]
+        self.assertEqual(dedupe_rows(shared), rows[:2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+
+from fakeredis import FakeStrictRedis
+
+from lcpvian.selectivity import SELECTIVITY_TTL, SelectivityModel, query_shape
+
+QUERY = {
+    "query": [
+        {
+            "unit": {
+                "layer": "Token",
+                "label": "t",
+                "constraints": [
+                    {
+                        "comparison": {
+                            "left": "lemma",
+                            "comparator": "=",
+                            "string": "dog",
+                        }
+                    }
+                ],
+            }
+        }
+    ]
+}
+# The same query on another lemma and label
+OTHER = {
+    "query": [
+        {
+            "unit": {
+                "layer": "Token",
+                "label": "x",
+                "constraints": [
+                    {
+                        "comparison": {
+                            "left": "lemma",
+                            "comparator": "=",
+                            "string": "cat",
+                        }
+                    }
+                ],
+            }
+        }
+    ]
+}
+
+
+class SelectivityModelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeStrictRedis()
+        self.model = SelectivityModel(self.redis, "1", QUERY)
+
+    def test_query_shape(self):
+        """
+        Literal values are blanked out at any depth, the structure is kept
+        """
+        self.assertEqual(query_shape(QUERY), query_shape(OTHER))
+        unit = query_shape(QUERY)["query"][0]["unit"]
+        self.assertEqual(unit["label"], "?")
+        self.assertEqual(unit["layer"], "Token")
+        comparison = unit["constraints"][0]["comparison"]
+        self.assertEqual(
+            comparison, {"left": "lemma", "comparator": "=", "string": "?"}
+        )
+        other_layer = {"query": [{"unit": {**OTHER["query"][0]["unit"], "layer": "s"}}]}
+        self.assertNotEqual(query_shape(QUERY), query_shape(other_layer))
+        other = SelectivityModel(self.redis, "1", OTHER)
+        self.assertEqual(self.model.shape_key, other.shape_key)
+        self.assertNotEqual(self.model.exact_key, other.exact_key)
+        self.assertNotEqual(
+            self.model.shape_key, SelectivityModel(self.redis, "2", OTHER).shape_key
+        )
+
+    def test_record(self):
+        """
+        Each run is added under the exact and the shape keys, which expire
+        """
+        self.assertFalse(self.model.known)
+        self.model.record("b1", hits=10, words=1000, runtime=0.5)
+        self.model.record("b1", hits=20, words=1000, runtime=1.5)
+        self.assertTrue(self.model.known)
+        for key in (self.model.exact_key, self.model.shape_key):
+            with self.subTest(key=key):
+                stored = self.redis.hgetall(key)
+                self.assertEqual(float(stored[b"b1:hits"]), 30)
+                self.assertEqual(float(stored[b"b1:words"]), 2000)
+                self.assertEqual(float(stored[b"b1:runtime"]), 2.0)
+                self.assertEqual(float(stored[b"b1:n"]), 2)
+                self.assertLessEqual(self.redis.ttl(key), SELECTIVITY_TTL)
+                self.assertGreater(self.redis.ttl(key), 0)
+        self.assertEqual(self.model.exact_hits("b1"), 15)
+        self.assertIsNone(self.model.exact_hits("b2"))
+
+    def test_predict(self):
+        """
+        A batch is predicted from the same query on that batch, else from the rates
+        per word of the same query, else of its shape, else not at all
+        """
+        other = SelectivityModel(self.redis, "1", OTHER)
+        self.assertIsNone(self.predict("b1", 500))
+        # only the shape is known
+        other.record("b1", hits=40, words=1000, runtime=2.0)
+        self.assertEqual(self.predict("b1", 500), (20, 1.0))
+        # the exact query on another batch takes precedence over the shape
+        self.model.record("b2", hits=10, words=2000, runtime=1.0)
+        self.assertEqual(self.predict("b1", 500), (2.5, 0.25))
+        # the exact query on the same batch is averaged over its runs
+        self.model.record("b1", hits=6, words=1000, runtime=0.5)
+        self.model.record("b1", hits=8, words=1000, runtime=1.5)
+        self.assertEqual(self.predict("b1", 500), (7, 1.0))
+        # another corpus knows nothing
+        self.assertIsNone(self.predict("b1", 500, corpus="2"))
+
+    def test_stats_cached(self):
+        """
+        The stats are read from redis once, until the model records a run
+        """
+        self.assertIsNone(self.model.predict("b1", 500))
+        SelectivityModel(self.redis, "1", QUERY).record("b1", 4, 1000, 1.0)
+        self.assertIsNone(self.model.predict("b1", 500))
+        self.model.record("b1", 6, 1000, 1.0)
+        self.assertEqual(self.model.predict("b1", 500), (5, 1.0))
+
+    def predict(self, batch: str, words: int, corpus: str = "1"):
+        """
+        The prediction of a new model, as made by each scheduling of the query
+        """
+        return SelectivityModel(self.redis, corpus, QUERY).predict(batch, words)
+
+
+if __name__ == "__main__":
+    unittest.main()
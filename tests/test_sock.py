@@ -0,0 +1,203 @@
+import asyncio
+import json
+import random
+import unittest
+
+from unittest.mock import AsyncMock, patch
+
+from fakeredis import FakeAsyncRedis, FakeStrictRedis
+from redis.exceptions import ConnectionError
+
+from lcpvian.sock import MessageDispatcher, handle_stream_messages, listen_to_redis
+from lcpvian.utils import MESSAGE_STREAM
+
+
+class MessageDispatcherTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.handled: list[tuple[str, int]] = []
+        self.running = 0
+        self.max_running = 0
+        self.dispatcher = MessageDispatcher({}, n_handlers=3, maxsize=4)
+        patcher = patch("lcpvian.sock._process_payload", self.process_payload)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def asyncTearDown(self):
+        await self.dispatcher.close()
+
+    async def process_payload(self, data, payload, channel, app):
+        """
+        Stand-in for _process_payload: record the message after a random delay
+        """
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(random.random() / 100)
+            if payload.get("fail"):
+                raise ValueError(f"Could not handle {payload['n']}")
+            self.handled.append((str(payload["hash"]), int(payload["n"])))
+        finally:
+            self.running -= 1
+
+    async def test_per_key_order(self):
+        """
+        The messages of each query are handled in order, different queries concurrently
+        """
+        random.seed(3)
+        hashes = [f"q{n}" for n in range(6)]
+        for n in range(60):
+            payload = {"hash": random.choice(hashes), "n": n}
+            await self.dispatcher.put(payload, payload, None)
+        await self.dispatcher.join()
+        self.assertEqual(len(self.handled), 60)
+        for qhash in hashes:
+            with self.subTest(qhash=qhash):
+                numbers = [n for h, n in self.handled if h == qhash]
+                self.assertEqual(numbers, sorted(numbers))
+        self.assertGreater(self.max_running, 1)
+        self.assertLessEqual(self.max_running, 3)
+        self.assertEqual(self.dispatcher.stats()["dispatched"], 60)
+
+    async def test_failing_handler(self):
+        """
+        A message whose handling fails is reported and does not stop its handler
+        """
+        done: list[int] = []
+
+        def acknowledge(n: int):
+            async def ack() -> None:
+                done.append(n)
+
+            return ack
+
+        for n in range(4):
+            payload = {"hash": "q1", "n": n, "fail": n == 1}
+            await self.dispatcher.put(payload, payload, None, acknowledge(n))
+        with patch("lcpvian.sock.logging.error") as error:
+            await self.dispatcher.join()
+        self.assertEqual(self.handled, [("q1", 0), ("q1", 2), ("q1", 3)])
+        self.assertEqual(done, [0, 1, 2, 3])
+        error.assert_called_once()
+        self.assertEqual(error.call_args.kwargs["extra"]["status"], "failed")
+        self.assertTrue(all(not task.done() for task in self.dispatcher._tasks))
+
+
+class StreamMessagesTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.redis = FakeAsyncRedis()
+        self.app = {"redis": FakeStrictRedis()}
+        self.handled: list[int] = []
+        self.in_flight: set[bytes] = set()
+        self.dispatcher = MessageDispatcher(self.app)
+        for name, value in [
+            ("_process_payload", self.process_payload),
+            ("MESSAGE_STREAM_GROUP", "lcp1"),
+            ("MESSAGE_STREAM_CONSUMER", "lcp1"),
+        ]:
+            patcher = patch(f"lcpvian.sock.{name}", value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def asyncTearDown(self):
+        await self.dispatcher.close()
+
+    async def process_payload(self, data, payload, channel, app):
+        self.handled.append(int(payload["n"]))
+
+    async def add(self, n: int) -> bytes:
+        data = json.dumps({"action": "test", "room": "r1", "n": n})
+        return await self.redis.xadd(MESSAGE_STREAM, {"data": data})
+
+    async def pending(self) -> int:
+        return (await self.redis.xpending(MESSAGE_STREAM, "lcp1"))["pending"]
+
+    async def read(self, **kwargs) -> None:
+        await handle_stream_messages(
+            self.redis, self.app, self.dispatcher, self.in_flight, **kwargs
+        )
+
+    async def test_group_creation(self):
+        """
+        The group is created with the stream, and only gets the entries added since
+        """
+        create = self.redis.xgroup_create
+
+        async def create_group(*args, **kwargs):
+            await create(*args, **kwargs)
+            await self.add(1)
+
+        await self.add(0)
+        with patch.object(self.redis, "xgroup_create", create_group):
+            await self.read(test=True)
+        self.assertEqual(self.handled, [1])
+        # an existing group is reused
+        await self.add(2)
+        await self.read(test=True)
+        self.assertEqual(self.handled, [1, 2])
+        groups = await self.redis.xinfo_groups(MESSAGE_STREAM)
+        self.assertEqual([g["name"] for g in groups], [b"lcp1"])
+
+    async def test_ack(self):
+        """
+        An entry is acknowledged once it was handled
+        """
+        await self.redis.xgroup_create(MESSAGE_STREAM, "lcp1", id="0", mkstream=True)
+        await self.add(1)
+        with patch.object(self.dispatcher, "join", AsyncMock()):
+            # the entry is handled in the background
+            await self.read(test=True)
+        self.assertEqual(await self.pending(), 1)
+        await self.dispatcher.join()
+        self.assertEqual(self.handled, [1])
+        self.assertEqual(await self.pending(), 0)
+        self.assertEqual(self.in_flight, set())
+
+    async def test_replay(self):
+        """
+        The entries delivered to this consumer before a restart are replayed,
+        unless they are still queued in the dispatcher
+        """
+        await self.redis.xgroup_create(MESSAGE_STREAM, "lcp1", id="0", mkstream=True)
+        entry = await self.add(1)
+        await self.redis.xreadgroup("lcp1", "lcp1", {MESSAGE_STREAM: ">"})
+        self.in_flight.add(entry)
+        await self.read(test=True)
+        self.assertEqual(self.handled, [])
+        self.assertEqual(await self.pending(), 1)
+        self.in_flight.clear()
+        await self.read(test=True)
+        self.assertEqual(self.handled, [1])
+        self.assertEqual(await self.pending(), 0)
+
+    async def test_claim(self):
+        """
+        The entries left pending by another consumer are claimed once idle
+        """
+        await self.redis.xgroup_create(MESSAGE_STREAM, "lcp1", id="0", mkstream=True)
+        await self.add(1)
+        await self.redis.xreadgroup("lcp1", "lcp0", {MESSAGE_STREAM: ">"})
+        await self.add(2)
+        with patch("lcpvian.sock.MESSAGE_STREAM_CLAIM_IDLE", 20):
+            await asyncio.sleep(0.03)
+            await self.read(test=True)
+        self.assertEqual(self.handled, [1, 2])
+        self.assertEqual(await self.pending(), 0)
+
+    async def test_reconnect(self):
+        """
+        After a connection error, the stream is read again from the same group
+        """
+        read = AsyncMock(side_effect=[ConnectionError("lost"), None])
+        app = {**self.app, "aredis": self.redis}
+        with (
+            patch("lcpvian.sock.MESSAGE_TRANSPORT", "streams"),
+            patch("lcpvian.sock.handle_stream_messages", read),
+        ):
+            await listen_to_redis(app, "redis")
+        self.assertEqual(read.await_count, 2)
+        first, second = read.await_args_list
+        self.assertIs(first.args[3], second.args[3])
+
+
+if __name__ == "__main__":
+    unittest.main()
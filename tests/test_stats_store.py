@@ -0,0 +1,142 @@
+import threading
+import time
+import unittest
+
+from unittest.mock import patch
+
+from fakeredis import FakeStrictRedis
+
+from lcpvian.stats_store import StatsStore
+
+FREQUENCY = {
+    "type": "analysis",
+    "attributes": [
+        {"name": "form", "type": "attribute"},
+        {"name": "frequency", "type": "aggregate"},
+    ],
+    "total": [{"name": "frequency", "type": "aggregate"}],
+}
+COLLOCATION = {"type": "collocation"}
+PLAIN = {"type": "plain"}
+APPROXIMATE = {**FREQUENCY, "approximate": {"top": 2}}
+
+
+def freq(form: str, count: int) -> list:
+    return [2, [False, form, count]]
+
+
+def total(count: int) -> list:
+    return [2, [True, count]]
+
+
+def coll(text: str, count: int, e: float) -> list:
+    return [3, [text, count, e]]
+
+
+class StatsStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeStrictRedis()
+        self.store = StatsStore(self.redis, "q1", [PLAIN, FREQUENCY, COLLOCATION])
+
+    def test_running_totals(self):
+        """
+        Frequencies are summed by row body across batches, collocation E values
+        are averaged weighted by the size of the batches
+        """
+        batch1 = [freq("cat", 2), freq("dog", 1), freq("cat", 1), total(4)]
+        batch1 += [coll("a b", 2, 0.5), [1, [1, "ignored"]]]
+        batch2 = [freq("dog", 5), total(5), coll("a b", 1, 2.0), coll("c", 1, 1.0)]
+        self.assertTrue(self.store.add_batch("b1", 100, batch1))
+        self.assertTrue(self.store.add_batch("b2", 300, batch2))
+        self.assertEqual(self.store.batches(), {"b1": 100, "b2": 300})
+        results = self.store.results()
+        self.assertEqual(
+            sorted(results["2"], key=str),
+            [["False", "cat", 3], ["False", "dog", 6], ["True", 9]],
+        )
+        self.assertEqual(
+            sorted(results["3"]),
+            [["a b", 3, (0.5 * 100 + 2.0 * 300) / 400], ["c", 1, 300 / 400]],
+        )
+
+    def test_batch_added_once(self):
+        """
+        A batch that was already aggregated is not counted again
+        """
+        self.assertTrue(self.store.add_batch("b1", 10, [freq("cat", 2)]))
+        self.assertFalse(self.store.add_batch("b1", 10, [freq("cat", 2)]))
+        self.assertEqual(self.store.results()["2"], [["False", "cat", 2]])
+
+    def test_failed_batch_can_be_retried(self):
+        """
+        If the rows of a batch cannot be added, the batch is not marked as aggregated
+        """
+        with self.assertRaises(ValueError):
+            self.store.add_batch("b1", 10, [coll("a", 1, 1.0), [3, ["too short"]]])
+        self.assertEqual(self.store.batches(), {})
+        self.assertTrue(self.store.add_batch("b1", 10, [freq("cat", 2)]))
+
+    def test_filters_apply_to_totals(self):
+        """
+        Filters are applied to the totals over all the batches, not batch by batch
+        """
+        self.store.add_batch("b1", 10, [freq("cat", 2), freq("dog", 3)])
+        self.store.add_batch("b2", 10, [freq("cat", 2)])
+        post = {
+            2: [{"comparison": {"left": "frequency", "comparator": ">", "right": 3}}]
+        }
+        self.assertEqual(self.store.results(post)["2"], [["False", "cat", 4]])
+
+
+class ApproximateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeStrictRedis()
+
+    def store(self) -> StatsStore:
+        return StatsStore(self.redis, "q1", [PLAIN, APPROXIMATE])
+
+    def test_top_and_bound(self):
+        """
+        Only the top rows are kept, and the highest dropped count is the error bound
+        """
+        store = self.store()
+        rows = [freq(form, n) for n, form in enumerate("abcdef", start=1)]
+        with patch("lcpvian.stats_store.STATS_APPROXIMATE_FACTOR", 2):
+            store.add_batch("b1", 10, rows + [total(21)])
+            store.add_batch("b2", 10, [freq("a", 10)])
+        self.assertEqual(
+            store.results()["2"],
+            [["True", 21], ["False", "a", 10], ["False", "f", 6]],
+        )
+        self.assertEqual(store.bounds()["2"]["max_error"], 2 + 3)
+
+    def test_concurrent_merges(self):
+        """
+        Two batches merged at the same time by different workers are both counted
+        """
+        read = StatsStore._read
+
+        def slow_read(store: StatsStore, key: int):
+            # Leave time for the other merge to read the same totals
+            out = read(store, key)
+            time.sleep(0.2)
+            return out
+
+        batches = {"b1": [freq("cat", 2)], "b2": [freq("dog", 3)]}
+        with patch.object(StatsStore, "_read", slow_read):
+            threads = [
+                threading.Thread(target=self.store().add_batch, args=(name, 10, rows))
+                for name, rows in batches.items()
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(
+            sorted(self.store().results()["2"]),
+            [["False", "cat", 2], ["False", "dog", 3]],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
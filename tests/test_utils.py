@@ -0,0 +1,201 @@
+import asyncio
+import json
+import unittest
+
+from unittest.mock import patch
+
+from aiohttp import WSCloseCode
+from fakeredis import FakeStrictRedis
+from rq import Queue
+from rq.command import PUBSUB_CHANNEL_TEMPLATE
+
+from lcpvian.typed import Websockets
+from lcpvian.utils import CANCEL_BACKEND_COMMAND, PG_BACKEND_KEY, _stop_job, push_msg
+
+
+def noop() -> None:
+    return None
+
+
+class StopJobTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeStrictRedis()
+        self.job = Queue("query", connection=self.redis).enqueue(noop)
+        self.job.worker_name = "worker1"
+        self.job.save()
+        self.pubsub = self.redis.pubsub()
+        self.pubsub.subscribe(PUBSUB_CHANNEL_TEMPLATE % "worker1")
+        self.pubsub.get_message()  # subscription confirmation
+
+    def commands(self) -> list[dict]:
+        sent = []
+        while message := self.pubsub.get_message():
+            sent.append(json.loads(message["data"]))
+        return sent
+
+    def test_cancel_backend_and_delete_key(self):
+        """
+        Stopping a job asks its worker to cancel its backend, then deletes the key
+        """
+        self.redis.set(PG_BACKEND_KEY % self.job.id, "query:4242")
+        _stop_job(self.redis, self.job)
+        cancel, stop = self.commands()
+        self.assertEqual(cancel["command"], CANCEL_BACKEND_COMMAND)
+        self.assertEqual(cancel["job_id"], self.job.id)
+        self.assertEqual((cancel["engine"], cancel["pid"]), ("query", 4242))
+        self.assertEqual(stop["command"], "stop-job")
+        self.assertFalse(self.redis.exists(PG_BACKEND_KEY % self.job.id))
+
+    def test_no_backend(self):
+        """
+        A job that holds no connection is only stopped
+        """
+        _stop_job(self.redis, self.job)
+        self.assertEqual([c["command"] for c in self.commands()], ["stop-job"])
+
+
+class Socket:
+    """
+    Stand-in for a websocket connection
+    """
+
+    def __init__(self, delay: float = 0.0, closed: bool = False):
+        self.delay = delay
+        self.closed = closed
+        self.close_code: int | None = None
+        self.sent: list[dict] = []
+
+    async def send_str(self, data: str) -> None:
+        if self.closed:
+            raise ConnectionResetError("Cannot write to closing transport")
+        await asyncio.sleep(self.delay)
+        self.sent.append(json.loads(data))
+
+    async def close(self, code: int, message: bytes = b"") -> bool:
+        self.closed = True
+        self.close_code = code
+        return True
+
+
+class WebsocketsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sockets = Websockets()
+        self.ws1, self.ws2, self.ws3 = Socket(), Socket(), Socket()
+        self.sockets.join("r1", self.ws1, "u1")
+        self.sockets.join("r1", self.ws2, "u1")
+        self.sockets.join("r1", self.ws3, "u2")
+        self.sockets.join("r2", self.ws3, "u2")
+
+    def assertConsistent(self):
+        """
+        The indexes agree with the connections of each room
+        """
+        connections: dict = {}
+        for room, conns in self.sockets.items():
+            self.assertTrue(conns, f"empty room {room}")
+            for ws, user in conns:
+                connections.setdefault((room, user), set()).add(ws)
+        self.assertEqual(self.sockets.connections, connections)
+        users: dict = {}
+        for room, user in connections:
+            users.setdefault(room, set()).add(user)
+        self.assertEqual(self.sockets.users, users)
+
+    def test_join(self):
+        """
+        Joining indexes the connection once
+        """
+        self.assertFalse(self.sockets.join("r1", self.ws1, "u1"))
+        self.assertEqual(self.sockets.connections[("r1", "u1")], {self.ws1, self.ws2})
+        self.assertEqual(self.sockets.users, {"r1": {"u1", "u2"}, "r2": {"u2"}})
+        self.assertEqual(sorted(self.sockets.rooms_of("u2")), ["r1", "r2"])
+        self.assertConsistent()
+
+    def test_leave(self):
+        """
+        Leaving removes the connection, then the user, then the room from the indexes
+        """
+        self.assertTrue(self.sockets.leave("r1", self.ws1, "u1"))
+        self.assertFalse(self.sockets.leave("r1", self.ws1, "u1"))
+        self.assertEqual(self.sockets.users["r1"], {"u1", "u2"})
+        self.assertConsistent()
+        self.assertTrue(self.sockets.leave("r1", self.ws2, "u1"))
+        self.assertEqual(self.sockets.users["r1"], {"u2"})
+        self.assertEqual(self.sockets.rooms_of("u1"), [])
+        self.assertConsistent()
+        self.assertTrue(self.sockets.leave("r2", self.ws3, "u2"))
+        self.assertNotIn("r2", self.sockets)
+        self.assertEqual(self.sockets.rooms_of("u2"), ["r1"])
+        self.assertConsistent()
+        self.assertFalse(self.sockets.leave("r3", self.ws3, "u2"))
+        self.assertNotIn("r3", self.sockets)
+
+
+class PushMsgTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.sockets = Websockets()
+        self.ws1, self.ws2, self.ws3 = Socket(), Socket(), Socket()
+        self.sockets.join("r1", self.ws1, "u1")
+        self.sockets.join("r1", self.ws2, "u2")
+        self.sockets.join("r2", self.ws3, "u3")
+
+    def received(self) -> list[int]:
+        return [len(ws.sent) for ws in (self.ws1, self.ws2, self.ws3)]
+
+    async def test_routing(self):
+        """
+        Messages go to a room, all rooms, a single user or all but one user
+        """
+        await push_msg(self.sockets, "r1", {"n": 1})
+        self.assertEqual(self.received(), [1, 1, 0])
+        await push_msg(self.sockets, "", {"n": 2})
+        self.assertEqual(self.received(), [2, 2, 1])
+        await push_msg(self.sockets, "r1", {"n": 3}, just=("r1", "u2"))
+        self.assertEqual(self.received(), [2, 3, 1])
+        await push_msg(self.sockets, "r1", {"n": 4}, just=("r2", "u3"))
+        await push_msg(self.sockets, "r1", {"n": 5}, just=(None, "u1"))
+        self.assertEqual(self.received(), [2, 3, 1])
+        await push_msg(self.sockets, "r1", {"n": 6}, skip=("r1", "u1"))
+        self.assertEqual(self.received(), [2, 4, 1])
+        self.assertEqual([m["n"] for m in self.ws2.sent], [1, 2, 3, 6])
+
+    async def test_open_connection_preferred(self):
+        """
+        A user with several connections in a room gets the message once,
+        on an open connection
+        """
+        closed = Socket(closed=True)
+        self.sockets.join("r1", closed, "u1")
+        await push_msg(self.sockets, "r1", {"n": 1}, just=("r1", "u1"))
+        self.assertEqual(len(self.ws1.sent), 1)
+        self.assertIn(closed, self.sockets.connections[("r1", "u1")])
+
+    async def test_disconnected(self):
+        """
+        A connection that was closed is dropped when a message is sent to it
+        """
+        self.ws1.closed = True
+        await push_msg(self.sockets, "r1", {"n": 1})
+        self.assertEqual(self.received(), [0, 1, 0])
+        self.assertNotIn(("r1", "u1"), self.sockets.connections)
+        self.assertEqual(self.sockets.users["r1"], {"u2"})
+
+    async def test_slow_connection_dropped(self):
+        """
+        A connection that does not take the message within WS_SEND_TIMEOUT is
+        dropped and closed, without delaying the others
+        """
+        self.ws1.delay = 1.0
+        with patch("lcpvian.utils.WS_SEND_TIMEOUT", 0.05):
+            await push_msg(self.sockets, "", {"n": 1})
+            self.assertEqual(self.received(), [0, 1, 1])
+            self.assertEqual(self.sockets.users, {"r1": {"u2"}, "r2": {"u3"}})
+            self.assertEqual(set(self.sockets["r1"]), {(self.ws2, "u2")})
+            await push_msg(self.sockets, "", {"n": 2})
+        self.assertEqual(self.received(), [0, 2, 2])
+        self.assertEqual(self.ws1.close_code, WSCloseCode.GOING_AWAY)
+        self.assertIsNone(self.ws2.close_code)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import asyncio
+import unittest
+
+from lcpvian.validate import QueryValidator
+
+
+class DebounceTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.validator = QueryValidator(workers=1, processes=False, debounce=0.05)
+        self.addCleanup(self.validator.shutdown)
+        self.responses: list[tuple[str, str, str]] = []
+
+    async def respond(self, room: str, user: str, query: str) -> None:
+        self.responses.append((room, user, query))
+
+    def edit(self, room: str, user: str, query: str) -> None:
+        self.validator.debounce((room, user), self.respond(room, user, query))
+
+    async def test_latest_query_of_each_user(self):
+        """
+        Only the latest edit of a user is validated, whatever the others in the
+        room edit meanwhile
+        """
+        self.edit("room1", "alice", "a1")
+        self.edit("room1", "bob", "b1")
+        self.edit("room1", "alice", "a2")
+        self.edit("room2", "alice", "c1")
+        await asyncio.sleep(0.2)
+        self.assertEqual(
+            sorted(self.responses),
+            [
+                ("room1", "alice", "a2"),
+                ("room1", "bob", "b1"),
+                ("room2", "alice", "c1"),
+            ],
+        )
+        self.assertEqual(self.validator._pending, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
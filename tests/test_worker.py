@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import unittest
+
+from unittest.mock import patch
+
+from fakeredis import FakeStrictRedis
+from asyncpg.exceptions import QueryCanceledError
+from rq import Queue, get_current_connection, get_current_job
+from rq.job import JobStatus
+
+for var in (
+    "SQL_UPLOAD_USERNAME",
+    "SQL_QUERY_USERNAME",
+    "SQL_WEB_USERNAME",
+    "SQL_UPLOAD_PASSWORD",
+    "SQL_QUERY_PASSWORD",
+    "SQL_WEB_PASSWORD",
+    "SQL_DATABASE",
+):
+    os.environ.setdefault(var, "test")
+os.environ.setdefault("SQL_HOST", "localhost")
+
+from lcpvian import worker
+from lcpvian.utils import _job_stopped, _mark_stopped
+from lcpvian.worker import MyWorker, SQLJob
+
+
+def engines_and_pid() -> tuple[int, int]:
+    job = get_current_job()
+    assert isinstance(job, SQLJob)
+    return id(job.engines), os.getpid()
+
+
+async def coroutine_job() -> int:
+    return os.getpid()
+
+
+async def slow_coroutine_job() -> None:
+    await asyncio.sleep(5)
+
+
+def cancelled_query_job() -> None:
+    # _stop_job marks the job, then postgres cancels its query
+    _mark_stopped(get_current_connection(), get_current_job().id)
+    raise QueryCanceledError("canceling statement due to user request")
+
+
+class WorkerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeStrictRedis()
+        self.queue = Queue("query", connection=self.redis, job_class=SQLJob)
+        self.worker = MyWorker([self.queue], connection=self.redis)
+
+    def test_jobs_share_the_worker_engines(self):
+        """
+        Jobs run in the worker process, with the engines of the worker
+        """
+        jobs = [self.queue.enqueue(engines_and_pid) for _ in range(3)]
+        self.worker.work(burst=True)
+        results = {job.return_value() for job in jobs}
+        self.assertEqual(results, {(id(self.worker.engines), os.getpid())})
+
+    def test_coroutine_job(self):
+        """
+        Coroutine jobs run on the loop of the registry, in the worker process
+        """
+        job = self.queue.enqueue(coroutine_job)
+        self.worker.work(burst=True)
+        self.assertEqual(job.return_value(), os.getpid())
+
+    def test_kill_horse_spares_the_worker(self):
+        """
+        There is no work horse: killing it must not kill the worker
+        """
+        self.worker.kill_horse()
+        self.assertEqual(self.worker.horse_pid, 0)
+
+    def stop_while_running(self, func) -> SQLJob:
+        job = self.queue.enqueue(func)
+
+        def stop() -> None:
+            while self.worker.get_current_job_id() != job.id:
+                time.sleep(0.01)
+            time.sleep(0.1)
+            payload = {"command": "stop-job", "job_id": job.id}
+            self.worker.handle_payload({"data": json.dumps(payload).encode()})
+
+        stopper = threading.Thread(target=stop)
+        stopper.start()
+        start = time.perf_counter()
+        self.worker.work(burst=True)
+        stopper.join()
+        self.assertLess(time.perf_counter() - start, 2)
+        return job
+
+    def test_stop_coroutine_job(self):
+        """
+        A running coroutine job is cancelled by the stop-job command
+        """
+        job = self.stop_while_running(slow_coroutine_job)
+        self.assertEqual(job.get_status(), JobStatus.STOPPED)
+        self.assertTrue(_job_stopped(self.redis, job))
+        self.assertEqual(self.worker.engines.run(coroutine_job()), os.getpid())
+
+    def test_stop_before_task(self):
+        """
+        A coroutine job stopped before its task was created is cancelled right away
+        """
+        job = self.queue.enqueue(slow_coroutine_job)
+        job.engines = self.worker.engines
+        self.assertFalse(job.interrupt())
+        start = time.perf_counter()
+        with self.assertRaises(asyncio.CancelledError):
+            job._execute()
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_cancelled_query(self):
+        """
+        A job whose query was cancelled by _stop_job ends as stopped, without an error
+        """
+        job = self.queue.enqueue(cancelled_query_job)
+        with self.assertNoLogs("rq.worker", "ERROR"):
+            self.worker.work(burst=True)
+        self.assertEqual(job.get_status(), JobStatus.STOPPED)
+
+
+class FakeBackends:
+    """
+    Stand-in for an asyncpg connection to postgres, whose backend 4242 runs
+    a query with the given application name
+    """
+
+    def __init__(self, application_name: str, busy_after_cancel: bool = False):
+        self.application_name = application_name
+        self.busy_after_cancel = busy_after_cancel
+        self.signals: list[str] = []
+
+    async def fetchval(self, query: str, pid: int, application_name: str):
+        if pid != 4242 or application_name != self.application_name:
+            return None
+        if self.signals and not self.busy_after_cancel:
+            return None
+        self.signals.append(query.split("(")[0].split()[-1])
+        return True
+
+    async def close(self) -> None:
+        return None
+
+
+class CancelBackendTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        redis = FakeStrictRedis()
+        self.worker = MyWorker([Queue(connection=redis)], connection=redis)
+
+    async def signal(self, backends: FakeBackends) -> list[str]:
+        async def connect(*args, **kwargs):
+            return backends
+
+        with (
+            patch.object(worker.asyncpg, "connect", connect),
+            patch.object(worker, "QUERY_CANCEL_GRACE", 0),
+        ):
+            await self.worker._signal_backend("job1", "query", 4242)
+        return backends.signals
+
+    async def test_cancel(self):
+        """
+        The backend running the job's query is cancelled
+        """
+        signals = await self.signal(FakeBackends("lcpvian:job1"))
+        self.assertEqual(signals, ["pg_cancel_backend"])
+
+    async def test_terminate_if_still_busy(self):
+        """
+        The backend is terminated if it still runs the job's query after the grace period
+        """
+        signals = await self.signal(FakeBackends("lcpvian:job1", True))
+        self.assertEqual(signals, ["pg_cancel_backend", "pg_terminate_backend"])
+
+    async def test_backend_of_another_job(self):
+        """
+        A backend that moved on to another job is left alone
+        """
+        signals = await self.signal(FakeBackends("lcpvian:job2", True))
+        self.assertEqual(signals, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
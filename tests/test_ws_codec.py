@@ -0,0 +1,99 @@
+import json
+import unittest
+
+from unittest.mock import patch
+
+from lcpvian import ws_codec
+from lcpvian.ws_codec import (
+    ENCODINGS,
+    MAGIC,
+    VERSION,
+    EncodedMessage,
+    EncodingStats,
+    negotiate,
+)
+
+MESSAGE = {
+    "action": "query_result",
+    "result": {"1": [[n, [f"word{n}", n * 2]] for n in range(2000)]},
+}
+
+
+def decode(frame: bytes) -> tuple[str, object]:
+    """
+    The encoding and the message of a binary frame, as a client would read it
+    """
+    assert frame[:2] == MAGIC and frame[2] == VERSION
+    name = next(k for k, (code, _, _) in ENCODINGS.items() if code == frame[3])
+    body = frame[4:]
+    if name.endswith("zstd"):
+        body = ws_codec.pyzstd.decompress(body)
+    if name.startswith("msgpack"):
+        return name, ws_codec.msgpack.unpackb(body)
+    return name, json.loads(body)
+
+
+class WsCodecTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(ws_codec, "stats", EncodingStats())
+        self.stats = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_round_trip(self):
+        """
+        Each available encoding gives a frame with the b"LC" header that decodes
+        back to the message
+        """
+        encoded = EncodedMessage(MESSAGE)
+        self.assertEqual(json.loads(encoded.get()), MESSAGE)
+        for name, (code, _, available) in ENCODINGS.items():
+            with self.subTest(encoding=name):
+                if not available:
+                    self.skipTest(f"{name} is not installed")
+                frame = encoded.get(name)
+                self.assertIsInstance(frame, bytes)
+                self.assertEqual(frame[:4], MAGIC + bytes((VERSION, code)))
+                self.assertEqual(decode(frame), (name, MESSAGE))
+
+    def test_small_messages_stay_json(self):
+        """
+        Messages under WS_BINARY_MIN_BYTES are sent as JSON text whatever the encoding
+        """
+        encoded = EncodedMessage({"action": "joined"})
+        for name in ENCODINGS:
+            self.assertEqual(encoded.get(name), '{"action": "joined"}')
+
+    def test_negotiate(self):
+        """
+        The first encoding requested that is available is used, else JSON
+        """
+        available = [name for name, (_, _, ok) in ENCODINGS.items() if ok]
+        missing = [name for name, (_, _, ok) in ENCODINGS.items() if not ok]
+        self.assertEqual(negotiate(["brotli"]), "json")
+        self.assertEqual(negotiate("zstd"), "json")
+        self.assertEqual(negotiate(missing), "json")
+        if not available:
+            self.skipTest("neither msgpack nor pyzstd is installed")
+        self.assertEqual(negotiate(["brotli", *missing, *available]), available[0])
+
+    def test_stats(self):
+        """
+        Each encoding is counted once per message, however many times it is sent
+        """
+        encoded = EncodedMessage(MESSAGE)
+        encoded.get()
+        encoded.get()
+        available = [name for name, (_, _, ok) in ENCODINGS.items() if ok]
+        for name in available:
+            encoded.get(name)
+        report = self.stats.report()
+        self.assertEqual(sorted(report), sorted(["json", *available]))
+        self.assertEqual(report["json"]["messages"], 1)
+        self.assertEqual(report["json"]["ratio"], 1.0)
+        for name in available:
+            self.assertEqual(report[name]["json_bytes"], len(encoded.text))
+            self.assertLess(report[name]["ratio"], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()